@@ -46,6 +46,10 @@ const wizNext = document.getElementById("wizNext");
 let wizardStep = 1;
 let goalMode = "guided"; // default
 
+// Session state: after the first analysis only the newly pasted turns are sent
+const sessionId = crypto.randomUUID();
+let sentConversation = null;
+
 function setStatus(msg) {
   statusEl.textContent = msg;
 }
@@ -165,15 +169,23 @@ wizNext.addEventListener("click", () => {
 async function loadPersonas() {
   setStatus("Loading personas...");
   try {
-    const res = await fetch(`${API_BASE}/personas`);
-    if (!res.ok) {
-      setStatus(`Failed to load personas: ${res.status}`);
-      return;
-    }
-    const data = await res.json();
-
-    const koi = data.personas.filter(p => p.module === "koi");
-    const fox = data.personas.filter(p => p.module === "fox");
+    // The catalog is paginated; follow next_cursor until the last page
+    const personas = [];
+    let cursor = null;
+    do {
+      const url = `${API_BASE}/personas?limit=500` + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : "");
+      const res = await fetch(url);
+      if (!res.ok) {
+        setStatus(`Failed to load personas: ${res.status}`);
+        return;
+      }
+      const data = await res.json();
+      personas.push(...data.personas);
+      cursor = data.next_cursor;
+    } while (cursor);
+
+    const koi = personas.filter(p => p.module === "koi");
+    const fox = personas.filter(p => p.module === "fox");
 
     koiSelect.innerHTML = koi.map(p => `<option value="${p.id}">${escapeHtml(p.name)}</option>`).join("");
     foxSelect.innerHTML = fox.map(p => `<option value="${p.id}">${escapeHtml(p.name)}</option>`).join("");
@@ -184,6 +196,11 @@ async function loadPersonas() {
   }
 }
 
+function partialStatus(meta) {
+  const failed = Object.keys((meta && meta.errors) || {});
+  return failed.length ? `Done (no ${failed.join(" / ")} result this time).` : "Done.";
+}
+
 function renderFoxOptions(replyOptions) {
   optionsEl.innerHTML = "";
   if (!replyOptions || replyOptions.length === 0) {
@@ -191,32 +208,61 @@ function renderFoxOptions(replyOptions) {
     return;
   }
 
-  replyOptions.forEach((opt) => {
-    const div = document.createElement("div");
-    div.className = "option";
-
-    div.innerHTML = `
-      <div class="tag">${escapeHtml(opt.tag)}</div>
-      <div class="text">${escapeHtml(opt.text)}</div>
-      <div class="why">Why: ${escapeHtml(opt.why)}</div>
-      <div class="actions">
-        <button class="copyBtn">Copy</button>
-        <button class="useBtn">Use as Draft</button>
-      </div>
-    `;
-
-    div.querySelector(".copyBtn").addEventListener("click", async () => {
-      await navigator.clipboard.writeText(opt.text);
-      setStatus(`Copied: ${opt.tag}`);
-    });
-
-    div.querySelector(".useBtn").addEventListener("click", async () => {
-      draftEl.value = opt.text;
-      setStatus(`Draft replaced with: ${opt.tag}`);
-    });
-
-    optionsEl.appendChild(div);
+  replyOptions.forEach(appendFoxOption);
+}
+
+function appendFoxOption(opt) {
+  const div = document.createElement("div");
+  div.className = "option";
+
+  div.innerHTML = `
+    <div class="tag">${escapeHtml(opt.tag)}</div>
+    <div class="text">${escapeHtml(opt.text)}</div>
+    <div class="why">Why: ${escapeHtml(opt.why)}</div>
+    <div class="actions">
+      <button class="copyBtn">Copy</button>
+      <button class="useBtn">Use as Draft</button>
+    </div>
+  `;
+
+  div.querySelector(".copyBtn").addEventListener("click", async () => {
+    await navigator.clipboard.writeText(opt.text);
+    setStatus(`Copied: ${opt.tag}`);
   });
+
+  div.querySelector(".useBtn").addEventListener("click", async () => {
+    draftEl.value = opt.text;
+    setStatus(`Draft replaced with: ${opt.tag}`);
+  });
+
+  optionsEl.appendChild(div);
+}
+
+// Reads the /v2/analyze/stream SSE body and calls onEvent(name, data) per event.
+async function readEventStream(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let name = "message";
+      let data = "";
+      block.split("\n").forEach(line => {
+        if (line.startsWith("event: ")) name = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      });
+      onEvent(name, data ? JSON.parse(data) : null);
+    }
+  }
 }
 
 clearBtn.addEventListener("click", () => {
@@ -237,15 +283,14 @@ analyzeBtn.addEventListener("click", async () => {
   }
 
   const mode = getGoalMode();
-  const endpoint = mode === "guided" ? "/v2/analyze" : "/analyze";
+  const endpoint = mode === "guided" ? "/v2/analyze/stream" : "/analyze";
 
   setStatus(`Analyzing (${mode})...`);
   koiOutEl.textContent = "";
   optionsEl.innerHTML = "";
 
   let payload = {
-    session_id: "demo",
-    conversation,
+    session_id: sessionId,
     user_draft: userDraft,
     koi_persona_id: koiSelect.value,
     fox_persona_id: foxSelect.value,
@@ -258,24 +303,62 @@ analyzeBtn.addEventListener("click", async () => {
     payload.goal_spec = getGoalSpec();
   }
 
+  if (sentConversation !== null && conversation.startsWith(sentConversation)) {
+    payload.conversation_delta = conversation.slice(sentConversation.length);
+  } else {
+    payload.conversation = conversation;
+  }
+
+  const send = () => fetch(`${API_BASE}${endpoint}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload)
+  });
+
   try {
-    const res = await fetch(`${API_BASE}${endpoint}`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(payload)
-    });
+    let res = await send();
+
+    if (res.status === 409 && payload.conversation_delta !== undefined) {
+      // Server session expired: resend the full conversation
+      delete payload.conversation_delta;
+      payload.conversation = conversation;
+      res = await send();
+    }
 
     if (!res.ok) {
       const err = await res.text();
       setStatus(`Error: ${err}`);
       return;
     }
+    sentConversation = conversation;
+
+    if (mode === "guided") {
+      // Progressive: Koi first, then each Fox option as soon as it is complete
+      let streamed = 0;
+      await readEventStream(res, (name, data) => {
+        if (name === "koi") {
+          koiOutEl.textContent = JSON.stringify(data, null, 2);
+          setStatus("Koi ready, waiting for Fox...");
+        } else if (name === "reply_option") {
+          appendFoxOption(data);
+          streamed += 1;
+        } else if (name === "fox") {
+          if (streamed === 0) renderFoxOptions(data.reply_options);
+        } else if (name === "done") {
+          setStatus(partialStatus(data));
+        } else if (name === "error") {
+          setStatus(`Error: ${data.detail}`);
+        }
+      });
+      return;
+    }
 
     const data = await res.json();
 
-    koiOutEl.textContent = JSON.stringify(data.koi, null, 2);
-    renderFoxOptions(data.fox.reply_options);
-    setStatus("Done.");
+    // A module that failed or timed out comes back as null (reason in meta.errors)
+    koiOutEl.textContent = data.koi ? JSON.stringify(data.koi, null, 2) : "(unavailable)";
+    renderFoxOptions(data.fox ? data.fox.reply_options : []);
+    setStatus(partialStatus(data.meta));
   } catch (e) {
     setStatus(`Failed: ${e}`);
   }
@@ -0,0 +1,171 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import os
+import re
+from typing import List, Optional, Tuple
+
+from .conversation import Turn, parse_turns, render_turns
+from .llm.cache import MemoryTier
+from .llm.context import call_options
+from .llm.provider import LLMProvider
+from .schemas import CompactionReport
+
+# Rough BPE approximation: CJK characters, word pieces of up to 6 chars, punctuation
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w{1,6}|[^\w\s]")
+
+SUMMARIZER_PROMPT = (
+    "You compress chat history for a communication assistant.\n"
+    "Summarize the given turns in at most 3 short sentences. Keep who said what, "
+    "offers, numbers, commitments, open questions and the emotional tone.\n\n"
+    "STRICT OUTPUT: Return JSON only with EXACT key: summary.\n"
+    "No commentary. No markdown."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContextCompactor:
+    """
+    Keeps a conversation within a token budget.
+
+    The most recent turns stay verbatim (up to recent_share of the budget).
+    Older turns are cut into fixed segments aligned to the start of the chat,
+    so a segment never changes once it is complete; each segment is summarized
+    once and cached by content hash. If the segment summaries still exceed the
+    remaining budget, groups of them are summarized again (hierarchically).
+
+    Env:
+      CONTEXT_BUDGET_TOKENS   conversation budget per prompt (default 0: off). Opt in: older
+                              turns are then sent as LLM summaries, which costs summary calls
+                              and changes what Koi and Fox see (e.g. 3000)
+      CONTEXT_SEGMENT_TURNS   turns per summarized segment (default 8)
+      LLM_INPUT_COST_PER_1K   USD per 1k prompt tokens for the report (default 0.00015)
+    """
+
+    def __init__(
+        self,
+        llm: LLMProvider,
+        budget_tokens: int = 3000,
+        segment_turns: int = 8,
+        recent_share: float = 0.6,
+        merge_fanout: int = 4,
+        cost_per_1k: float = 0.00015,
+        cache: Optional[MemoryTier] = None,
+    ):
+        self.llm = llm
+        self.budget_tokens = budget_tokens
+        self.segment_turns = segment_turns
+        self.recent_share = recent_share
+        self.merge_fanout = merge_fanout
+        self.cost_per_1k = cost_per_1k
+        self.cache = cache or MemoryTier(max_entries=8192, ttl_s=24 * 3600.0)
+
+    @classmethod
+    def from_env(cls, llm: LLMProvider) -> Optional["ContextCompactor"]:
+        budget = int(os.getenv("CONTEXT_BUDGET_TOKENS", "0"))
+        if budget <= 0:
+            return None
+        return cls(
+            llm,
+            budget_tokens=budget,
+            segment_turns=int(os.getenv("CONTEXT_SEGMENT_TURNS", "8")),
+            cost_per_1k=float(os.getenv("LLM_INPUT_COST_PER_1K", "0.00015")),
+        )
+
+    def _cost(self, tokens: int) -> float:
+        return round(tokens / 1000.0 * self.cost_per_1k, 6)
+
+    async def _summarize(self, text: str) -> Tuple[str, bool]:
+        """
+        Returns (summary, cache_hit).
+        """
+        key = _digest(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+        # Labelled so metrics and model routing can tell summaries from module calls
+        with call_options(module="summary", persona="", schema=None):
+            data = await self.llm.generate_json(SUMMARIZER_PROMPT, text)
+        summary = str(data.get("summary", "")).strip() or text[:400]
+        self.cache.put(key, summary)
+        return summary, False
+
+    async def compact(self, conversation: str, turns: Optional[List[Turn]] = None) -> Tuple[str, CompactionReport]:
+        tokens_before = estimate_tokens(conversation)
+        report = CompactionReport(
+            compacted=False,
+            tokens_before=tokens_before,
+            tokens_after=tokens_before,
+            est_cost_before_usd=self._cost(tokens_before),
+            est_cost_after_usd=self._cost(tokens_before),
+        )
+        if tokens_before <= self.budget_tokens:
+            return conversation, report
+
+        turns = turns if turns is not None else parse_turns(conversation)
+
+        # Recent turns, newest first, until the verbatim share of the budget is used
+        recent_budget = int(self.budget_tokens * self.recent_share)
+        used, split = 0, len(turns)
+        while split > 0:
+            cost = estimate_tokens(f"{turns[split - 1].speaker}: {turns[split - 1].text}")
+            if used + cost > recent_budget and split < len(turns):
+                break
+            used += cost
+            split -= 1
+
+        # Only whole segments are summarized; the ragged tail stays verbatim
+        split -= split % self.segment_turns
+        if split == 0:
+            return conversation, report
+
+        segments = [render_turns(turns[i:i + self.segment_turns]) for i in range(0, split, self.segment_turns)]
+        results = await asyncio.gather(*(self._summarize(s) for s in segments))
+        summaries = [s for s, _ in results]
+        hits = sum(1 for _, hit in results if hit)
+        calls = len(results)
+
+        summary_budget = self.budget_tokens - used
+        while len(summaries) > 1 and estimate_tokens("\n".join(summaries)) > summary_budget:
+            groups = [
+                "\n".join(summaries[i:i + self.merge_fanout])
+                for i in range(0, len(summaries), self.merge_fanout)
+            ]
+            merged = await asyncio.gather(*(self._summarize(g) for g in groups))
+            summaries = [s for s, _ in merged]
+            hits += sum(1 for _, hit in merged if hit)
+            calls += len(merged)
+
+        text = (
+            "[Earlier conversation, summarized]\n"
+            + "\n".join(f"- {s}" for s in summaries)
+            + "\n\n[Recent turns, verbatim]\n"
+            + render_turns(turns[split:])
+        )
+        tokens_after = estimate_tokens(text)
+        report.compacted = True
+        report.tokens_after = tokens_after
+        report.est_cost_after_usd = self._cost(tokens_after)
+        report.turns_total = len(turns)
+        report.turns_verbatim = len(turns) - split
+        report.summaries = len(summaries)
+        report.summary_calls = calls - hits
+        report.summary_cache_hits = hits
+        return text, report
+
+
+async def compact_conversation(
+    compactor: Optional[ContextCompactor],
+    conversation: str,
+    turns: Optional[List[Turn]] = None,
+) -> Tuple[str, Optional[CompactionReport]]:
+    if compactor is None:
+        return conversation, None
+    return await compactor.compact(conversation, turns)
@@ -0,0 +1,49 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+# "Speaker: message" — speaker labels are short and contain no sentence punctuation
+_TURN_RE = re.compile(r"^\s*([^:\n]{1,40}?)\s*[:：]\s*(.*)$")
+
+
+@dataclass(frozen=True)
+class Turn:
+    speaker: str
+    text: str
+
+
+def parse_turns(conversation: str, previous: Optional[Turn] = None) -> List[Turn]:
+    """
+    Splits pasted chat text into speaker turns.
+
+    Lines without a "Speaker:" prefix continue the previous turn. If the text
+    starts with such a line and `previous` is given (delta updates), the line
+    is reported as a continuation turn of that speaker.
+    """
+    turns: List[Turn] = []
+    speaker: Optional[str] = None
+    lines: List[str] = []
+
+    def flush() -> None:
+        if speaker is not None and lines:
+            turns.append(Turn(speaker=speaker, text="\n".join(lines).strip()))
+
+    for raw in conversation.splitlines():
+        if not raw.strip():
+            continue
+        m = _TURN_RE.match(raw)
+        if m and not m.group(1).strip().startswith(("http", "-")):
+            flush()
+            speaker, lines = m.group(1).strip(), [m.group(2)]
+        elif speaker is None:
+            speaker = previous.speaker if previous is not None else "unknown"
+            lines = [raw.strip()]
+        else:
+            lines.append(raw.strip())
+    flush()
+    return turns
+
+
+def render_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"{t.speaker}: {t.text}" for t in turns)
@@ -0,0 +1,345 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from pydantic import BaseModel
+
+from .llm.context import call_options, current_options
+from .llm.provider import LLMProvider
+from .llm.repair import conforms, validate_or_none
+from .llm.resilience import DeadlineExceeded
+from .metrics import FUSED_FALLBACKS, stage_timer
+from .personas.registry import Persona, fox_analysis_persona, fox_style_persona, fuse_personas, with_output_fields
+from .schemas import FoxAnalysis, FoxOutput, KoiOutputV2, ReplyOption
+
+# A stage receives the results of the stages it depends on.
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: StageFn
+    after: Tuple[str, ...] = ()
+
+
+async def _timed(stage: Stage, deps: Dict[str, Any]) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    value = await stage.run(deps)
+    return value, (time.perf_counter() - start) * 1000.0
+
+
+async def run_stages(stages: List[Stage]) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs a declared stage graph. Every stage starts as soon as the stages it
+    depends on have finished, so independent stages run concurrently.
+
+    Returns (results by stage name, elapsed ms by stage name).
+    If any stage fails, the stages still running are cancelled and the error is re-raised.
+    """
+    names = {s.name for s in stages}
+    if len(names) != len(stages):
+        raise ValueError("Duplicate stage names")
+    for s in stages:
+        missing = [d for d in s.after if d not in names]
+        if missing:
+            raise ValueError(f"Stage {s.name} depends on unknown stages: {missing}")
+
+    results: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    pending = {s.name: s for s in stages}
+    running: Dict[asyncio.Task, Stage] = {}
+
+    try:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(d in results for d in stage.after):
+                    del pending[name]
+                    deps = {d: results[d] for d in stage.after}
+                    running[asyncio.create_task(_timed(stage, deps))] = stage
+
+            if not running:
+                raise ValueError(f"Stage graph has a cycle: {sorted(pending)}")
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stage = running.pop(task)
+                value, elapsed = task.result()
+                results[stage.name] = value
+                timings[stage.name] = round(elapsed, 2)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    return results, timings
+
+
+# -----------------------
+# COLLABORATION STRATEGIES
+#
+# centralised: Koi and Fox see the same payload and run in parallel (fan-out).
+# relay:       Fox runs after Koi and is conditioned on Koi's output.
+# solo:        one call with the fused persona produces both modules, so the
+#              payload is sent once; a module whose part fails validation is
+#              re-run on its own.
+
+STRATEGIES = ("centralised", "relay", "solo")
+
+
+def analysis_deadline() -> float:
+    """
+    Deadline for an analysis starting now, for call_options(deadline=...).
+    ANALYSIS_DEADLINE_S (default 30) is the end-to-end budget.
+    """
+    return time.monotonic() + float(os.getenv("ANALYSIS_DEADLINE_S", "30"))
+
+
+async def within_deadline(work: Awaitable[Any], module: str) -> Any:
+    """
+    Awaits work, raising DeadlineExceeded if the current analysis deadline passes first.
+    """
+    deadline = current_options().deadline
+    if deadline is None:
+        return await work
+    remaining = deadline - time.monotonic()
+    try:
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        return await asyncio.wait_for(work, remaining)
+    except asyncio.TimeoutError:
+        if asyncio.iscoroutine(work):
+            work.close()  # never started
+        raise DeadlineExceeded(f"{module}: analysis deadline exceeded") from None
+
+
+async def call_module(
+    llm: LLMProvider,
+    module: str,
+    persona_id: str,
+    system_prompt: str,
+    payload: str,
+    schema: Optional[Type[BaseModel]] = None,
+) -> Dict[str, Any]:
+    """
+    One generate_json call, labelled with its module/persona for metrics and timed.
+    schema is what the output must satisfy (model routing escalates when it does not).
+    Raises DeadlineExceeded if it cannot finish before the current analysis deadline.
+    """
+    with call_options(module=module, persona=persona_id, schema=schema), stage_timer("generate", provider=getattr(llm, "name", "")):
+        return await within_deadline(llm.generate_json(system_prompt, payload), module)
+
+
+def tolerant(stage: Stage, failures: Dict[str, Exception]) -> Stage:
+    """
+    The same stage, but a failure is recorded in failures and yields None instead
+    of cancelling the other stages, so one module can still answer if the other fails.
+    """
+    async def run(deps: Dict[str, Any]) -> Any:
+        try:
+            return await stage.run(deps)
+        except Exception as e:
+            failures[stage.name] = e
+            return None
+
+    return replace(stage, run=run)
+
+
+def describe_failure(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+
+def relay_payload(payload: str, koi_json: Dict[str, Any]) -> str:
+    return (
+        f"{payload}\n\n"
+        "=== Koi Analysis (use it to steer your reply options) ===\n"
+        f"{json.dumps(koi_json, ensure_ascii=False)}\n\n"
+        "Return STRICT JSON only."
+    )
+
+
+OptionCallback = Callable[[int, Dict[str, Any]], None]
+
+
+async def fox_fanout(
+    llm: LLMProvider,
+    fox: Persona,
+    payload: str,
+    styles: Sequence[str],
+    on_option: Optional[OptionCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Fox as short concurrent calls: one for the situation (emotion, power
+    dynamic, risks) and one per reply style, instead of one long completion.
+    on_option(style index, option) is called as each option arrives, first
+    ready first. Returns FoxOutput JSON with the options in style order; a style
+    whose call fails is left out, and if every style fails its error is raised.
+    """
+    failures: Dict[str, Exception] = {}
+
+    def style_stage(index: int, style: str) -> Stage:
+        async def run(_: Dict[str, Any]) -> Dict[str, Any]:
+            persona = fox_style_persona(fox, style)
+            data = await call_module(llm, "fox_style", persona.id, persona.system_prompt, payload, ReplyOption)
+            option = ReplyOption.model_validate(data).model_dump()
+            if on_option is not None:
+                on_option(index, option)
+            return option
+
+        return Stage(f"style_{index}", run)
+
+    analysis = fox_analysis_persona(fox)
+    stages = [Stage(
+        "analysis",
+        lambda _: call_module(llm, "fox_analysis", analysis.id, analysis.system_prompt, payload, FoxAnalysis),
+    )]
+    stages += [style_stage(i, style) for i, style in enumerate(styles)]
+    results, _ = await run_stages([tolerant(s, failures) for s in stages])
+
+    options = [results[f"style_{i}"] for i in range(len(styles)) if results[f"style_{i}"] is not None]
+    if not options:
+        raise next(e for name, e in failures.items() if name != "analysis")
+    # Without the analysis the options still stand; the orchestrator's coercion fills the gaps
+    return {**(results["analysis"] or {}), "reply_options": options}
+
+
+async def _ready(value: Any) -> Any:
+    return value
+
+
+def build_stages(
+    strategy: str,
+    llm: LLMProvider,
+    koi: Persona,
+    fox: Persona,
+    payload: str,
+    local_koi: Optional[Dict[str, Any]] = None,
+    koi_model: Type[BaseModel] = KoiOutputV2,
+    fox_styles: Optional[Sequence[str]] = None,
+) -> List[Stage]:
+    def fox_call(fox_payload: str) -> Awaitable[Dict[str, Any]]:
+        if fox_styles:
+            return fox_fanout(llm, fox, fox_payload, fox_styles)
+        return call_module(llm, "fox", fox.id, fox.system_prompt, fox_payload, FoxOutput)
+
+    if local_koi is not None:
+        koi_stage = Stage("koi", lambda _: _ready(local_koi))
+    else:
+        koi_stage = Stage("koi", lambda _: call_module(llm, "koi", koi.id, koi.system_prompt, payload, koi_model))
+    if strategy == "centralised":
+        return [
+            koi_stage,
+            Stage("fox", lambda _: fox_call(payload)),
+        ]
+    if strategy == "relay":
+        return [
+            koi_stage,
+            Stage(
+                "fox",
+                # Without Koi's result (it failed) Fox still runs on the plain payload
+                lambda deps: fox_call(relay_payload(payload, deps["koi"]) if deps["koi"] is not None else payload),
+                after=("koi",),
+            ),
+        ]
+    if strategy == "solo":
+        fused = fuse_personas(koi, fox)
+        return [Stage("solo", lambda _: call_module(llm, "solo", fused.id, fused.system_prompt, payload))]
+    raise ValueError(f"Unknown strategy: {strategy}")
+
+
+async def run_collaboration(
+    strategy: str,
+    llm: LLMProvider,
+    koi: Persona,
+    fox: Persona,
+    payload: str,
+    koi_model: Type[BaseModel] = KoiOutputV2,
+    local_koi: Optional[Dict[str, Any]] = None,
+    fox_styles: Optional[Sequence[str]] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, float], Dict[str, str]]:
+    """
+    Runs Koi and Fox with the chosen strategy.
+    Returns (koi_json, fox_json, timings_ms, errors); timings include a "total" entry.
+
+    A module that fails (or misses the deadline) comes back as None with its reason
+    in errors; if both fail, the Koi error is raised.
+    koi_model is the Koi schema the caller validates against: Koi's prompt (alone or
+    fused) asks for its fields, and solo's fallback re-runs a Koi part that misses them.
+    local_koi is a Koi answer computed without the LLM; Koi is then not called
+    (and solo, with only Fox left to ask, makes a plain Fox call).
+    fox_styles switches Fox to fan-out (see fox_fanout); solo then runs as centralised.
+    """
+    start = time.perf_counter()
+    failures: Dict[str, Exception] = {}
+    koi = with_output_fields(koi, tuple(koi_model.model_fields))
+    if (local_koi is not None or fox_styles) and strategy == "solo":
+        strategy = "centralised"
+    stages = [
+        tolerant(s, failures)
+        for s in build_stages(strategy, llm, koi, fox, payload, local_koi, koi_model, fox_styles)
+    ]
+    results, timings = await run_stages(stages)
+
+    if strategy == "solo":
+        both = results["solo"] if isinstance(results["solo"], dict) else {}
+        koi_json, fox_json = both.get("koi"), both.get("fox")
+        fallbacks = []
+        if not conforms(koi_model, koi_json):
+            fallbacks.append(Stage(
+                "koi_fallback", lambda _: call_module(llm, "koi", koi.id, koi.system_prompt, payload, koi_model)
+            ))
+        if not conforms(FoxOutput, fox_json):
+            fallbacks.append(Stage(
+                "fox_fallback", lambda _: call_module(llm, "fox", fox.id, fox.system_prompt, payload, FoxOutput)
+            ))
+        if fallbacks:
+            for stage in fallbacks:
+                FUSED_FALLBACKS.inc(module=stage.name.split("_")[0])
+            retried, retry_timings = await run_stages([tolerant(s, failures) for s in fallbacks])
+            timings.update(retry_timings)
+            koi_json = retried.get("koi_fallback", koi_json)
+            fox_json = retried.get("fox_fallback", fox_json)
+        failed = {
+            "koi": failures.get("koi_fallback") or failures.get("solo"),
+            "fox": failures.get("fox_fallback") or failures.get("solo"),
+        }
+    else:
+        koi_json, fox_json = results["koi"], results["fox"]
+        failed = {"koi": failures.get("koi"), "fox": failures.get("fox")}
+
+    timings["total"] = round((time.perf_counter() - start) * 1000.0, 2)
+    if koi_json is None and fox_json is None:
+        raise failed["koi"] or failed["fox"] or RuntimeError("No module produced a result")
+    errors = {
+        module: describe_failure(error)
+        for module, error in failed.items()
+        if error is not None and (koi_json if module == "koi" else fox_json) is None
+    }
+    return koi_json, fox_json, timings, errors
+
+
+def validate_results(
+    koi_model: Type[BaseModel],
+    koi_json: Optional[Dict[str, Any]],
+    koi_persona: str,
+    fox_json: Optional[Dict[str, Any]],
+    fox_persona: str,
+    errors: Dict[str, str],
+) -> Tuple[Optional[BaseModel], Optional[FoxOutput]]:
+    """
+    Validates run_collaboration's results (see validate_output). A module whose
+    output is unusable is reported in errors like one that failed; if neither
+    module is left, the ValidationError is raised.
+    """
+    invalid: Dict[str, Exception] = {}
+    koi_out = validate_or_none(koi_model, koi_json, "koi", koi_persona, invalid)
+    fox_out = validate_or_none(FoxOutput, fox_json, "fox", fox_persona, invalid)
+    if koi_out is None and fox_out is None and invalid:
+        raise invalid.get("koi") or invalid["fox"]
+    errors.update({module: describe_failure(e) for module, e in invalid.items()})
+    return koi_out, fox_out
@@ -0,0 +1,129 @@
+"""
+Live drafting: analysis of a draft while it is being typed, over a WebSocket.
+
+Draft updates are debounced; a newer draft cancels the analysis of an older
+one (its LLM calls included) and only the latest analysis is pushed. When the
+context is unchanged and the draft was only reworded, the previous Koi result
+is reused and just Fox is asked again.
+"""
+from __future__ import annotations
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from pydantic_core import to_json
+
+from .conversation import Turn
+from .local_analyzer import embed
+from .metrics import LIVE_DRAFTS
+from .schemas import AnalyzeRequestV2, AnalyzeResponseV2
+
+# (request with the draft filled in, its turns, Koi result to reuse or None) -> analysis
+Analyze = Callable[[AnalyzeRequestV2, List[Turn], Optional[Dict[str, Any]]], Awaitable[AnalyzeResponseV2]]
+Send = Callable[[str], Awaitable[None]]
+
+
+class LiveDraftSession:
+    """
+    One WebSocket client's drafting state. set_context() installs the resolved
+    request (conversation, goal, personas, knobs); draft() schedules an analysis
+    debounce_s after the last update.
+    """
+
+    def __init__(
+        self,
+        send: Send,
+        analyze: Analyze,
+        error_status: Callable[[Exception], int],
+        debounce_s: float = 0.4,
+        koi_reuse_similarity: float = 0.8,
+    ):
+        self.send = send
+        self.analyze = analyze
+        self.error_status = error_status
+        self.debounce_s = debounce_s
+        self.koi_reuse_similarity = koi_reuse_similarity
+        self.base: Optional[AnalyzeRequestV2] = None
+        self.turns: List[Turn] = []
+        self.draft_text = ""
+        self.seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._analyzing = False
+        # Koi result of the current context, and the draft it was computed for
+        self._koi: Optional[Dict[str, Any]] = None
+        self._koi_draft: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_env(cls, send: Send, analyze: Analyze, error_status: Callable[[Exception], int]) -> "LiveDraftSession":
+        """
+        Env:
+          LIVE_DEBOUNCE_MS               wait this long after the last draft update (default 400)
+          LIVE_KOI_REUSE_SIMILARITY      reuse Koi when the new draft is at least this similar (default 0.8)
+        """
+        return cls(
+            send,
+            analyze,
+            error_status,
+            debounce_s=float(os.getenv("LIVE_DEBOUNCE_MS", "400")) / 1000.0,
+            koi_reuse_similarity=float(os.getenv("LIVE_KOI_REUSE_SIMILARITY", "0.8")),
+        )
+
+    def set_context(self, req: AnalyzeRequestV2, turns: List[Turn]) -> None:
+        # New conversation, goal, personas or knobs: Koi has to be asked again
+        self.base = req
+        self.turns = list(turns)
+        self._koi = None
+        self._koi_draft = None
+        if self.draft_text:
+            self._schedule(debounce=False)
+
+    def draft(self, text: str) -> None:
+        if text == self.draft_text and self._task is not None:
+            return
+        self.draft_text = text
+        if self.base is not None:
+            self._schedule(debounce=True)
+
+    def _schedule(self, debounce: bool) -> None:
+        self.seq += 1
+        if self._task is not None and not self._task.done():
+            LIVE_DRAFTS.inc(outcome="cancelled" if self._analyzing else "debounced")
+            self._task.cancel()
+        self._task = asyncio.create_task(self._run(self.seq, self.draft_text, debounce))
+
+    def _reusable_koi(self, draft_vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        if self._koi is None or self._koi_draft is None:
+            return None
+        return self._koi if float(draft_vec @ self._koi_draft) >= self.koi_reuse_similarity else None
+
+    async def _run(self, seq: int, text: str, debounce: bool) -> None:
+        if debounce:
+            await asyncio.sleep(self.debounce_s)
+        assert self.base is not None
+        req = self.base.model_copy(update={"user_draft": text})
+        draft_vec = embed([text])[0]
+        koi = self._reusable_koi(draft_vec)
+        self._analyzing = True
+        try:
+            resp = await self.analyze(req, self.turns, koi)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.send(to_json(
+                {"type": "error", "seq": seq, "status": self.error_status(e), "detail": str(e)}
+            ).decode("utf-8"))
+            return
+        finally:
+            self._analyzing = False
+
+        LIVE_DRAFTS.inc(outcome="reused_koi" if koi is not None else "analyzed")
+        if koi is None and resp.koi is not None:
+            self._koi = resp.koi.model_dump()
+            self._koi_draft = draft_vec
+        await self.send(to_json({"type": "analysis", "seq": seq, "draft": text, "result": resp}).decode("utf-8"))
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .context import current_options
+from .provider import LLMProvider
+from ..compaction import estimate_tokens
+from ..metrics import ADMISSION_WAIT_SECONDS
+
+
+class AdmissionRejected(Exception):
+    """
+    The call could not be admitted within the wait limit; retry after retry_after_s.
+    """
+
+    def __init__(self, retry_after_s: float, reason: str):
+        super().__init__(f"LLM quota exhausted ({reason}); retry in {retry_after_s:.1f}s")
+        self.retry_after_s = retry_after_s
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    rate units per second, holding at most capacity. Refilled lazily.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._at) * self.rate)
+        self._at = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount is available (0 if it is now). Amounts above the
+        capacity are clamped, so one oversized call can still pass on a full bucket.
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    cost: int = field(compare=False)
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    return float(raw) if raw else default
+
+
+class AdmissionController:
+    """
+    Admits LLM calls against per-provider requests/tokens per minute and a
+    per-session tokens-per-minute budget.
+
+    Calls that do not fit wait in a priority queue (lower priority value first,
+    then arrival order); only the head of the queue may take from the provider
+    buckets, so a big call is not starved by small ones. A call that cannot be
+    admitted within max_wait_s is rejected with AdmissionRejected.
+    """
+
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        session_tpm: float = 0,
+        max_wait_s: float = 10.0,
+        max_sessions: int = 10_000,
+    ):
+        # Buckets hold one minute of quota; 0 disables a limit
+        self.requests = TokenBucket(rpm / 60.0, rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, tpm) if tpm > 0 else None
+        self.session_tpm = session_tpm
+        self.max_wait_s = max_wait_s
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Condition()
+        self.admitted = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["AdmissionController"]:
+        """
+        Env (all default 0 = unlimited; None is returned when nothing is limited):
+          LLM_RPM                   provider requests per minute
+          LLM_TPM                   provider tokens per minute
+          LLM_SESSION_TPM           tokens per minute per session_id
+          LLM_ADMISSION_MAX_WAIT_S  longest a call may queue before a 429 (default 10)
+        """
+        rpm = _env_float("LLM_RPM", 0)
+        tpm = _env_float("LLM_TPM", 0)
+        session_tpm = _env_float("LLM_SESSION_TPM", 0)
+        if not (rpm or tpm or session_tpm):
+            return None
+        return cls(rpm, tpm, session_tpm, max_wait_s=_env_float("LLM_ADMISSION_MAX_WAIT_S", 10.0))
+
+    def _session_bucket(self, session: str) -> Optional[TokenBucket]:
+        if not self.session_tpm or not session:
+            return None
+        bucket = self._sessions.get(session)
+        if bucket is None:
+            bucket = self._sessions[session] = TokenBucket(self.session_tpm / 60.0, self.session_tpm)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session)
+        return bucket
+
+    def _provider_wait(self, cost: int) -> float:
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(cost))
+        return max(waits)
+
+    def _reject(self, start: float, retry_after_s: float, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, outcome="rejected")
+        return AdmissionRejected(retry_after_s, reason)
+
+    async def acquire(self, cost: int, priority: int = 0, session: str = "") -> None:
+        start = time.monotonic()
+        deadline = start + self.max_wait_s
+
+        # A session over its own budget waits (or is rejected) without holding up the shared queue
+        bucket = self._session_bucket(session)
+        if bucket is not None:
+            wait = bucket.wait_time(cost)
+            if wait > self.max_wait_s:
+                raise self._reject(start, wait, "session")
+            if wait:
+                await asyncio.sleep(wait)
+            bucket.take(cost)
+
+        waiter = _Waiter(priority, next(self._seq), cost)
+        async with self._changed:
+            heapq.heappush(self._queue, waiter)
+            try:
+                while True:
+                    if self._queue[0] is waiter:
+                        wait = self._provider_wait(cost)
+                        if wait == 0:
+                            heapq.heappop(self._queue)
+                            if self.requests is not None:
+                                self.requests.take(1)
+                            if self.tokens is not None:
+                                self.tokens.take(cost)
+                            self._changed.notify_all()
+                            break
+                    else:
+                        # Behind others: at least the head's wait
+                        wait = self._provider_wait(self._queue[0].cost)
+                    remaining = deadline - time.monotonic()
+                    if wait > remaining:
+                        raise self._reject(start, wait + self._queued_ahead_s(waiter), "provider")
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=max(wait, 0.001) if wait else remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                    self._changed.notify_all()
+
+        self.admitted += 1
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, outcome="admitted")
+
+    def _queued_ahead_s(self, waiter: _Waiter) -> float:
+        # Rough time for the quota to cover everyone queued ahead of waiter
+        ahead = [w for w in self._queue if w < waiter]
+        seconds = 0.0
+        if self.tokens is not None and ahead:
+            seconds = max(seconds, sum(w.cost for w in ahead) / self.tokens.rate)
+        if self.requests is not None and ahead:
+            seconds = max(seconds, len(ahead) / self.requests.rate)
+        return seconds
+
+    def stats(self) -> Dict[str, float]:
+        out = {"queue_depth": len(self._queue), "admitted": self.admitted, "rejected": self.rejected}
+        if self.tokens is not None:
+            out["tokens_available"] = math.floor(self.tokens.level)
+        if self.requests is not None:
+            out["requests_available"] = math.floor(self.requests.level)
+        return out
+
+
+class AdmittedProvider(LLMProvider):
+    """
+    Wraps a provider so every call first passes the admission controller.
+    The cost of a call is its estimated prompt tokens plus expected_completion_tokens;
+    priority and session come from the current call options.
+    """
+
+    def __init__(self, inner: LLMProvider, admission: AdmissionController, expected_completion_tokens: int = 400):
+        self.inner = inner
+        self.admission = admission
+        self.expected_completion_tokens = expected_completion_tokens
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
+
+    async def _admit(self, system_prompt: str, user_payload: str) -> None:
+        opts = current_options()
+        cost = estimate_tokens(system_prompt) + estimate_tokens(user_payload) + self.expected_completion_tokens
+        await self.admission.acquire(cost, priority=opts.priority, session=opts.session)
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        await self._admit(system_prompt, user_payload)
+        return await self.inner.generate_json(system_prompt, user_payload)
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        await self._admit(system_prompt, user_payload)
+        async for chunk in self.inner.stream_json(system_prompt, user_payload):
+            yield chunk
+
+    async def warmup(self) -> None:
+        await self.inner.warmup()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
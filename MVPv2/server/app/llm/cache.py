@@ -0,0 +1,301 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .context import current_options
+from .provider import LLMProvider
+from .repair import conforms
+from .resilience import answering_upstreams
+
+
+def cache_key(model: str, system_prompt: str, user_payload: str, temperature: float) -> str:
+    """
+    Content address of one generate_json call.
+    """
+    raw = json.dumps([model, system_prompt, user_payload, temperature], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """
+    In-process LRU with a TTL, bounded by entry count and total value size
+    (UTF-8 bytes). Values are stored as JSON text so callers never share mutable dicts.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.size_bytes = 0
+        self.evictions = 0
+        # key -> (expires_at, value, encoded size)
+        self._data: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value, _ = item
+        if expires_at < time.time():
+            self._remove(key)
+            self.evictions += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        if key in self._data:
+            self._remove(key)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._data[key] = (time.time() + self.ttl_s, value, size)
+        self.size_bytes += size
+        while len(self._data) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._data.pop(key)
+        self.size_bytes -= size
+
+
+class SQLiteTier:
+    """
+    Persistent tier. WAL mode lets several uvicorn workers read and write the
+    same file concurrently, and entries survive restarts. Every purge_every
+    puts, expired rows are deleted and the soonest-expiring ones beyond
+    max_entries evicted.
+    """
+
+    def __init__(self, path: str, ttl_s: float = 24 * 3600.0, max_entries: int = 100_000, purge_every: int = 256):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self.evictions = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires_at ON llm_cache (expires_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl_s),
+            )
+            self._conn.commit()
+            self._puts += 1
+            due = self._puts % self.purge_every == 0
+        if due:
+            self.purge()
+
+    def purge(self) -> int:
+        """
+        Deletes expired rows, then the soonest-expiring rows beyond max_entries.
+        Returns the number of rows deleted.
+        """
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),)).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                deleted += self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            self._conn.commit()
+        self.evictions += deleted
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Two-tier cache: memory first, then the optional SQLite tier (hits there are
+    promoted to memory).
+    """
+
+    def __init__(self, memory: MemoryTier, disk: Optional[SQLiteTier] = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """
+        Env:
+          LLM_CACHE_MAX_ENTRIES  memory tier entries (default 1024)
+          LLM_CACHE_MAX_BYTES    memory tier size (default 32 MiB)
+          LLM_CACHE_TTL_S        entry lifetime (default 3600)
+          LLM_CACHE_PATH         SQLite file for the persistent tier (default: off)
+          LLM_CACHE_DISK_MAX_ENTRIES  persistent tier rows (default 100000)
+        """
+        ttl = float(os.getenv("LLM_CACHE_TTL_S", "3600"))
+        memory = MemoryTier(
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            ttl_s=ttl,
+        )
+        path = os.getenv("LLM_CACHE_PATH", "").strip()
+        disk = None
+        if path:
+            disk = SQLiteTier(path, ttl_s=ttl, max_entries=int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "100000")))
+        return cls(memory, disk)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.put(key, value)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def purge(self) -> int:
+        """
+        Trims the persistent tier (expired rows, row cap); run at startup.
+        """
+        if self.disk is None:
+            return 0
+        return await asyncio.to_thread(self.disk.purge)
+
+    async def put(self, key: str, data: Dict[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False)
+        self.memory.put(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.memory.evictions,
+            "entries": len(self.memory),
+            "bytes": self.memory.size_bytes,
+            "persistent": self.disk is not None,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+class CachedProvider(LLMProvider):
+    """
+    Wraps any provider. Identical (model, system prompt, payload, temperature)
+    calls are answered from the cache; call_options(bypass_cache=True) skips the
+    lookup and refreshes the stored entry.
+
+    An answer is stored under the model that gave it (a hedged or failed-over
+    call is answered by the fallback), and only if it is usable output for the
+    call's schema (call_options(schema=...), see repair.conforms). Lookups try
+    the primary's key first. Models sampled at a non-zero temperature (OpenAI's
+    default is 0.4) then return the same sample for a repeated call until the
+    entry expires, which is why the pool leaves the cache off by default.
+    """
+
+    def __init__(self, inner: LLMProvider, cache: ResponseCache):
+        self.inner = inner
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
+
+    def _upstreams(self) -> List[LLMProvider]:
+        # A ResilientProvider (possibly behind admission) answers from one of its upstreams
+        upstreams = getattr(self.inner, "upstreams", None)
+        return [u.provider for u in upstreams] if upstreams else [self.inner]
+
+    @staticmethod
+    def _key(provider: LLMProvider, system_prompt: str, user_payload: str) -> str:
+        return cache_key(
+            getattr(provider, "model", type(provider).__name__),
+            system_prompt,
+            user_payload,
+            getattr(provider, "temperature", 0.0),
+        )
+
+    async def _lookup(self, system_prompt: str, user_payload: str) -> Optional[Dict[str, Any]]:
+        if current_options().bypass_cache:
+            return None
+        keys = dict.fromkeys(self._key(p, system_prompt, user_payload) for p in self._upstreams())
+        for key in keys:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+        return None
+
+    async def _store(self, answered: List[LLMProvider], system_prompt: str, user_payload: str, data: Any) -> None:
+        if not conforms(current_options().schema, data):
+            return  # never cache output the caller will reject (or retry)
+        provider = answered[-1] if answered else self._upstreams()[0]
+        await self.cache.put(self._key(provider, system_prompt, user_payload), data)
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        cached = await self._lookup(system_prompt, user_payload)
+        if cached is not None:
+            return cached
+
+        with answering_upstreams() as answered:
+            data = await self.inner.generate_json(system_prompt, user_payload)
+        await self._store(answered, system_prompt, user_payload, data)
+        return data
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        cached = await self._lookup(system_prompt, user_payload)
+        if cached is not None:
+            yield json.dumps(cached, ensure_ascii=False)
+            return
+
+        parts = []
+        with answering_upstreams() as answered:
+            async for chunk in self.inner.stream_json(system_prompt, user_payload):
+                parts.append(chunk)
+                yield chunk
+        try:
+            data = json.loads("".join(parts))
+        except json.JSONDecodeError:
+            return  # never cache a broken stream
+        await self._store(answered, system_prompt, user_payload, data)
+
+    async def warmup(self) -> None:
+        await self.inner.warmup()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
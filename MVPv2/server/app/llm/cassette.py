@@ -0,0 +1,268 @@
+"""
+Record/replay of LLM calls for deterministic, zero-cost performance testing.
+
+LLM_RECORD=1 wraps the configured backend(s) in a RecordingProvider, which
+saves every call (request, response, observed latency, token counts) to the
+cassette at LLM_CASSETTE. LLM_PROVIDER=replay then serves those responses by
+request hash: with the recorded latencies (LLM_REPLAY_TIMING=recorded) or
+with none (fast). Unlike the mock, payload sizes, outputs and timing are the
+real ones.
+
+A cassette is one SQLite file: recordings keyed by a 32-byte digest of
+(model, system prompt, payload), values as zlib-compressed JSON. Prompts and
+payloads are stored once per distinct text, since every call uses one of a
+few system prompts and Koi and Fox send the same payload.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional
+
+from ..compaction import estimate_tokens
+from ..metrics import record_call, record_usage, stage_timer, tally
+from .provider import LLMProvider
+from .registry import ProviderConfigError
+
+
+class CassetteMiss(LookupError):
+    """
+    Replay of a call that was never recorded.
+    """
+
+
+def cassette_key(model: str, system_prompt: str, user_payload: str) -> bytes:
+    raw = json.dumps([model, system_prompt, user_payload], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).digest()
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob))
+
+
+@dataclass
+class Recording:
+    response: Dict[str, Any]
+    latency_ms: float
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class CassetteStore:
+    """
+    A lookup is one probe of the key index plus one row read, so it stays flat
+    at tens of thousands of recordings; WAL lets a recording app and readers
+    share the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS texts (digest BLOB PRIMARY KEY, text BLOB NOT NULL) WITHOUT ROWID")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recordings ("
+            "key BLOB NOT NULL UNIQUE, model TEXT NOT NULL, prompt BLOB NOT NULL, payload BLOB NOT NULL, "
+            "response BLOB NOT NULL, latency_ms REAL NOT NULL, prompt_tokens INTEGER NOT NULL, "
+            "completion_tokens INTEGER NOT NULL, recorded_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._known_texts: set = set()
+
+    def _text_ref(self, text: str) -> bytes:
+        # Koi and Fox send the same payload, and every call one of a few system
+        # prompts: each distinct text is stored once
+        digest = hashlib.sha256(text.encode("utf-8")).digest()[:16]
+        if digest not in self._known_texts:
+            self._conn.execute("INSERT OR IGNORE INTO texts (digest, text) VALUES (?, ?)", (digest, _pack(text)))
+            self._known_texts.add(digest)
+        return digest
+
+    def put(
+        self,
+        model: str,
+        system_prompt: str,
+        user_payload: str,
+        recording: Recording,
+    ) -> bytes:
+        key = cassette_key(model, system_prompt, user_payload)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, model, self._text_ref(system_prompt), self._text_ref(user_payload),
+                    _pack(recording.response), recording.latency_ms,
+                    recording.prompt_tokens, recording.completion_tokens, time.time(),
+                ),
+            )
+            self._conn.commit()
+        return key
+
+    def get(self, key: bytes) -> Optional[Recording]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency_ms, prompt_tokens, completion_tokens FROM recordings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return Recording(_unpack(row[0]), row[1], row[2], row[3])
+
+    def request(self, key: bytes) -> Optional[Dict[str, str]]:
+        """
+        The recorded request, for inspecting a cassette.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.model, p.text, u.text FROM recordings r "
+                "JOIN texts p ON p.digest = r.prompt JOIN texts u ON u.digest = r.payload WHERE r.key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"model": row[0], "system_prompt": _unpack(row[1]), "user_payload": _unpack(row[2])}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+
+    def checkpoint(self) -> None:
+        """
+        Folds the write-ahead log into the file, leaving one compact file.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        self.checkpoint()
+        with self._lock:
+            self._conn.close()
+
+
+def cassette_path() -> str:
+    path = os.getenv("LLM_CASSETTE", "").strip()
+    if not path:
+        raise ProviderConfigError("LLM_CASSETTE must name the cassette file")
+    return path
+
+
+class RecordingProvider(LLMProvider):
+    """
+    Passes calls through to the wrapped backend and records each one.
+    Token counts are the provider-reported ones (estimated when it reports none).
+    """
+
+    def __init__(self, inner: LLMProvider, store: CassetteStore):
+        self.inner = inner
+        self.store = store
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
+
+    async def _save(self, system_prompt: str, user_payload: str, data: Dict[str, Any], elapsed_s: float, tokens) -> None:
+        recording = Recording(
+            response=data,
+            latency_ms=round(elapsed_s * 1000.0, 2),
+            prompt_tokens=tokens.get("prompt") or estimate_tokens(system_prompt) + estimate_tokens(user_payload),
+            completion_tokens=tokens.get("completion") or estimate_tokens(json.dumps(data, ensure_ascii=False)),
+        )
+        model = getattr(self.inner, "model", "")
+        await asyncio.to_thread(self.store.put, model, system_prompt, user_payload, recording)
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with tally() as counts:
+            data = await self.inner.generate_json(system_prompt, user_payload)
+        await self._save(system_prompt, user_payload, data, time.perf_counter() - start, counts.tokens)
+        return data
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        parts = []
+        with tally() as counts:
+            async for chunk in self.inner.stream_json(system_prompt, user_payload):
+                parts.append(chunk)
+                yield chunk
+        try:
+            data = json.loads("".join(parts))
+        except json.JSONDecodeError:
+            return  # a broken stream is not worth replaying
+        await self._save(system_prompt, user_payload, data, time.perf_counter() - start, counts.tokens)
+
+    async def warmup(self) -> None:
+        await self.inner.warmup()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+        self.store.close()
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Serves recorded responses by request hash. Calls count in the usual metrics
+    with the recorded token usage, so benchmarks see real payload sizes.
+    """
+
+    name = "replay"
+    temperature = 0.0
+
+    def __init__(self, store: CassetteStore, model: str, timing: str = "recorded"):
+        if timing not in ("recorded", "fast"):
+            raise ProviderConfigError(f"LLM_REPLAY_TIMING must be recorded or fast, got {timing!r}")
+        self.store = store
+        self.model = model
+        self.timing = timing
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, model: Optional[str] = None) -> "ReplayProvider":
+        """
+        Env:
+          LLM_CASSETTE         cassette file to replay (required)
+          LLM_REPLAY_MODEL     model the calls were recorded with (default OPENAI_MODEL, else gpt-4o-mini)
+          LLM_REPLAY_TIMING    recorded | fast (default recorded)
+        """
+        path = cassette_path()
+        if not os.path.exists(path):
+            raise ProviderConfigError(f"Cassette {path} does not exist; record one with LLM_RECORD=1")
+        return cls(
+            CassetteStore(path),
+            model=model or os.getenv("LLM_REPLAY_MODEL", "").strip() or os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            timing=os.getenv("LLM_REPLAY_TIMING", "recorded").strip().lower(),
+        )
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        # One indexed read of pages the OS has cached: cheaper than a thread hop
+        recording = self.store.get(cassette_key(self.model, system_prompt, user_payload))
+        if recording is None:
+            self.misses += 1
+            record_call(self.name, "failed")
+            raise CassetteMiss(f"No recording for this {self.model} call in {self.store.path}")
+        self.hits += 1
+        with stage_timer("llm_request", self.name):
+            if self.timing == "recorded":
+                await asyncio.sleep(recording.latency_ms / 1000.0)
+        record_usage(self.name, SimpleNamespace(
+            prompt_tokens=recording.prompt_tokens, completion_tokens=recording.completion_tokens
+        ))
+        record_call(self.name, "ok")
+        return recording.response
+
+    async def aclose(self) -> None:
+        self.store.close()
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import Any, Iterator, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class CallOptions:
+    """
+    Request-scoped options for LLM calls.
+
+    Set by the orchestrators with call_options(...) and read by provider wrappers,
+    so per-request flags reach the providers without changing generate_json's signature.
+    """
+    bypass_cache: bool = False
+    # Labels for metrics: which module/persona the current call serves
+    module: str = ""
+    persona: str = ""
+    # time.monotonic() by which the whole analysis must be done (None: no deadline)
+    deadline: Optional[float] = None
+    # Admission control: queue order (lower first) and per-session quota key
+    priority: int = 0
+    session: str = ""
+    # Model routing: the request's knob settings, and the schema the call's output
+    # must satisfy (a cheap model's invalid answer is escalated to a stronger one)
+    knobs: Tuple[Tuple[str, float], ...] = ()
+    schema: Optional[type] = None
+
+
+_current: ContextVar[CallOptions] = ContextVar("llm_call_options", default=CallOptions())
+
+
+def current_options() -> CallOptions:
+    return _current.get()
+
+
+@contextmanager
+def call_options(**changes) -> Iterator[CallOptions]:
+    opts = replace(_current.get(), **changes)
+    token = _current.set(opts)
+    try:
+        yield opts
+    finally:
+        _current.reset(token)
+
+
+KNOBS = ("aggressiveness", "interruptiveness", "structure_strength")
+
+
+def request_knobs(req: Any) -> Tuple[Tuple[str, float], ...]:
+    """
+    A request's knob settings, for call_options(knobs=...).
+    """
+    return tuple((name, float(getattr(req, name))) for name in KNOBS if hasattr(req, name))
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, List, Optional
+
+
+class JsonArrayScanner:
+    """
+    Incremental scanner for a JSON object that arrives in chunks.
+
+    Finds the array stored under `key` in the top-level object and returns each
+    element object as soon as its closing brace has been seen, long before the
+    whole document is complete:
+
+        scanner = JsonArrayScanner("reply_options")
+        for chunk in chunks:
+            for item in scanner.feed(chunk):
+                ...
+
+    Every character is looked at exactly once across all feed() calls, and only
+    the element still being received is kept for scanning, so feeding stays
+    linear in the document size.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None  # stack depth inside the target array
+        self._item_start: Optional[int] = None
+        self._parts: List[str] = []
+        # Unscanned-or-unfinished text: what an open item or top-level string still needs
+        self._tail = ""
+        self._tail_start = 0
+
+    @property
+    def text(self) -> str:
+        """
+        Everything fed so far (the chunks are joined on demand).
+        """
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._parts.append(chunk)
+        text = self._tail + chunk
+        base = self._tail_start  # offset of text[0] in the whole document
+        items: List[Dict[str, Any]] = []
+
+        for i in range(self._pos - base, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._stack[0] == "{":
+                        self._last_string = text[self._string_start - base + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = base + i
+            elif ch == ":" and len(self._stack) == 1:
+                self._pending_key = self._last_string
+            elif ch == "," and len(self._stack) == 1:
+                self._pending_key = None
+            elif ch in "{[":
+                if (
+                    ch == "["
+                    and self._array_depth is None
+                    and len(self._stack) == 1
+                    and self._pending_key == self.key
+                ):
+                    self._array_depth = 2
+                self._stack.append(ch)
+                if ch == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._item_start = base + i
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == "}" and self._item_start is not None and len(self._stack) == self._array_depth:
+                    try:
+                        item = json.loads(text[self._item_start - base:i + 1])
+                    except json.JSONDecodeError:
+                        item = None
+                    if isinstance(item, dict):
+                        items.append(item)
+                    self._item_start = None
+                elif ch == "]" and self._array_depth is not None and len(self._stack) == self._array_depth - 1:
+                    # Target array closed; ignore any later arrays with the same key
+                    self._array_depth = -1
+
+        self._pos = base + len(text)
+        keep = [self._pos]
+        if self._item_start is not None:
+            keep.append(self._item_start)
+        if self._in_string and len(self._stack) == 1:
+            keep.append(self._string_start)
+        self._tail_start = min(keep)
+        self._tail = text[self._tail_start - base:]
+        return items
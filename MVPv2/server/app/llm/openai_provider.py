@@ -0,0 +1,180 @@
+"""
+OpenAI (and OpenAI-compatible) chat-completions backend. Registered as
+"openai" in llm.registry; the SDK is imported only when this module is.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+import httpx
+from openai import AsyncOpenAI
+from ..metrics import record_call, record_usage, stage_timer
+from .layout import LAYOUTS, chat_messages
+from .provider import LLMProvider, MockProvider
+from .registry import ProviderConfigError, env_int
+from .repair import repair_json
+
+log = logging.getLogger(__name__)
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: Optional[str] = None,
+        max_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        layout: str = "persona_first",
+    ):
+        if layout not in LAYOUTS:
+            raise ProviderConfigError(f"LLM_PROMPT_LAYOUT must be one of {LAYOUTS}, got {layout!r}")
+        # One HTTP client (and connection pool) per provider; keep it alive across requests.
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
+        self.model = model
+        self.temperature = 0.4
+        self.layout = layout
+
+    @classmethod
+    def from_env(cls, model: Optional[str] = None) -> LLMProvider:
+        """
+        Env:
+          OPENAI_API_KEY             required; when empty the MockProvider is used instead
+          OPENAI_MODEL               default gpt-4o-mini
+          OPENAI_BASE_URL            OpenAI-compatible endpoint (default: api.openai.com)
+          LLM_POOL_MAX_CONNECTIONS   HTTP connections (default 20)
+          LLM_PROMPT_LAYOUT          persona_first | shared_prefix (default persona_first), see llm.layout
+        """
+        key = os.getenv("OPENAI_API_KEY", "").strip()
+        if not key:
+            log.warning("LLM_PROVIDER=openai but OPENAI_API_KEY is empty; using MockProvider")
+            return MockProvider.from_env(model)
+        return cls(
+            api_key=key,
+            model=model or _required("OPENAI_MODEL", "gpt-4o-mini"),
+            base_url=os.getenv("OPENAI_BASE_URL", "").strip() or None,
+            max_connections=env_int("LLM_POOL_MAX_CONNECTIONS", 20),
+            layout=_layout_from_env(),
+        )
+
+    @classmethod
+    def fallback_from_env(cls) -> Optional[LLMProvider]:
+        """
+        Secondary upstream for hedging/failover: another OpenAI-compatible model or
+        endpoint. Unset LLM_FALLBACK_MODEL means no fallback.
+        """
+        model = os.getenv("LLM_FALLBACK_MODEL", "").strip()
+        key = os.getenv("LLM_FALLBACK_API_KEY", "").strip() or os.getenv("OPENAI_API_KEY", "").strip()
+        if not model or not key:
+            return None
+        return cls(
+            api_key=key,
+            model=model,
+            base_url=os.getenv("LLM_FALLBACK_BASE_URL", "").strip() or os.getenv("OPENAI_BASE_URL", "").strip() or None,
+            max_connections=env_int("LLM_POOL_MAX_CONNECTIONS", 20),
+            layout=_layout_from_env(),
+        )
+
+    async def warmup(self) -> None:
+        # Opens (and keeps) a TLS connection so the first real request skips the handshake.
+        await self.client.models.list()
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        """
+        Forces JSON-only output. Invalid JSON is repaired locally when possible;
+        otherwise we try one LLM repair pass.
+        """
+        messages = chat_messages(system_prompt, user_payload, self.layout)
+
+        # Ask for strict JSON object only
+        with stage_timer("llm_request", self.name):
+            resp = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                response_format={"type": "json_object"},
+            )
+        record_usage(self.name, resp.usage)
+
+        text = resp.choices[0].message.content or "{}"
+        try:
+            with stage_timer("json_decode", self.name):
+                data = json.loads(text)
+            record_call(self.name, "ok")
+            return data
+        except json.JSONDecodeError:
+            pass
+
+        # Local repair first (fences, prose, trailing commas, truncation): no extra round trip
+        with stage_timer("local_repair", self.name):
+            data = repair_json(text)
+        if data is not None:
+            record_call(self.name, "local_repair")
+            return data
+
+        # Last resort: one LLM repair attempt
+        repair_messages = messages + [
+            {"role": "user", "content": "Your last output was not valid JSON. Return ONLY a valid JSON object, no extra text."}
+        ]
+        with stage_timer("llm_repair", self.name):
+            resp2 = await self.client.chat.completions.create(
+                model=self.model,
+                messages=repair_messages,
+                temperature=0.0,
+                response_format={"type": "json_object"},
+            )
+        record_usage(self.name, resp2.usage)
+        text2 = resp2.choices[0].message.content or "{}"
+        try:
+            data = json.loads(text2)
+        except json.JSONDecodeError:
+            data = repair_json(text2)
+            if data is None:
+                record_call(self.name, "failed")
+                raise
+        record_call(self.name, "llm_repair")
+        return data
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=chat_messages(system_prompt, user_payload, self.layout),
+            temperature=self.temperature,
+            response_format={"type": "json_object"},
+            stream=True,
+            # The last chunk then carries usage (incl. cached tokens), as on non-streamed calls
+            stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(self.name, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+
+def _layout_from_env() -> str:
+    return os.getenv("LLM_PROMPT_LAYOUT", "persona_first").strip().lower() or "persona_first"
+
+
+def _required(name: str, default: str) -> str:
+    value = os.getenv(name, default).strip()
+    if not value:
+        raise ProviderConfigError(f"{name} must not be empty")
+    return value
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from .cache import CachedProvider, ResponseCache
+from .provider import LLMProvider
+from .registry import ProviderRegistry, env_int
+from .routing import RoutedProvider, RoutingTable
+from .admission import AdmissionController, AdmittedProvider
+from .resilience import ResilientProvider
+
+log = logging.getLogger(__name__)
+
+
+class BoundedProvider(LLMProvider):
+    """
+    Wraps a provider with a concurrency semaphore so a burst of requests queues
+    here instead of opening more upstream connections than the pool allows.
+    """
+
+    def __init__(self, inner: LLMProvider, max_concurrency: int):
+        self.inner = inner
+        self.max_concurrency = max_concurrency
+        self._sem = asyncio.Semaphore(max_concurrency)
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose wrapped attributes such as .model
+        return getattr(self.inner, name)
+
+    @property
+    def in_flight(self) -> int:
+        return self.max_concurrency - self._sem._value
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        async with self._sem:
+            return await self.inner.generate_json(system_prompt, user_payload)
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        async with self._sem:
+            async for chunk in self.inner.stream_json(system_prompt, user_payload):
+                yield chunk
+
+    async def warmup(self) -> None:
+        await self.inner.warmup()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def build_providers_from_env(
+    registry: Optional[ProviderRegistry] = None, model: Optional[str] = None
+) -> Tuple[LLMProvider, Optional[LLMProvider]]:
+    """
+    Primary and optional fallback provider for LLM_PROVIDER (default mock). Only
+    the selected backend's module is imported; bad configuration raises
+    ProviderConfigError here rather than on the first request.
+    """
+    registry = registry or ProviderRegistry.from_env()
+    cls = registry.load(os.getenv("LLM_PROVIDER", "mock"))
+    provider, fallback = cls.from_env(model), cls.fallback_from_env()
+    if os.getenv("LLM_RECORD", "0") == "1":
+        from .cassette import CassetteStore, RecordingProvider, cassette_path
+
+        provider = RecordingProvider(provider, CassetteStore(cassette_path()))
+        if fallback is not None:
+            fallback = RecordingProvider(fallback, CassetteStore(cassette_path()))
+    return provider, fallback
+
+
+class ProviderPool:
+    """
+    Process-wide providers, created once at startup and shared by all requests.
+
+    Env:
+      LLM_PROVIDER              backend name, see llm.registry (default mock)
+      LLM_POOL_MAX_CONNECTIONS  HTTP connections per provider (default 20)
+      LLM_MAX_CONCURRENCY       in-flight calls per provider (default 16)
+      LLM_WARMUP                warm connections at startup (default 1)
+      LLM_CACHE                 1: cache responses, see ResponseCache.from_env and CachedProvider
+                                (default 0: at a non-zero temperature a hit replays one sample)
+      LLM_FALLBACK_MODEL        secondary model for hedging/failover (plus LLM_FALLBACK_BASE_URL,
+                                LLM_FALLBACK_API_KEY); timeouts etc. see ResilientProvider.from_env
+      LLM_RPM / LLM_TPM / ...   rate-limit admission, see AdmissionController.from_env (default off)
+      LLM_ROUTES                per-call model routing table, see llm.routing (default off)
+      LLM_RECORD                1: record every upstream call to LLM_CASSETTE, see llm.cassette;
+                                LLM_PROVIDER=replay serves them back
+    """
+
+    def __init__(self, cache: Optional[ResponseCache] = None) -> None:
+        self._providers: Dict[str, LLMProvider] = {}
+        self.cache = cache
+        self.router: Optional[RoutedProvider] = None
+
+    def add(
+        self,
+        name: str,
+        provider: LLMProvider,
+        max_concurrency: Optional[int] = None,
+        fallback: Optional[LLMProvider] = None,
+    ) -> LLMProvider:
+        limit = max_concurrency or env_int("LLM_MAX_CONCURRENCY", 16)
+        upstreams = [("primary", BoundedProvider(provider, limit))]
+        if fallback is not None:
+            upstreams.append(("fallback", BoundedProvider(fallback, limit)))
+        # Timeouts, hedging and failover per call; each upstream keeps its own semaphore
+        wrapped: LLMProvider = ResilientProvider.from_env(upstreams)
+        admission = AdmissionController.from_env()
+        if admission is not None:
+            # Rate limits apply per logical call, before hedging/failover
+            wrapped = AdmittedProvider(wrapped, admission, env_int("LLM_EXPECTED_COMPLETION_TOKENS", 400))
+        if self.cache is not None:
+            # Cache outside the semaphore: hits never wait for a slot
+            wrapped = CachedProvider(wrapped, self.cache)
+        self._providers[name] = wrapped
+        return wrapped
+
+    def add_routed(self, name: str, table: RoutingTable, registry: Optional[ProviderRegistry] = None) -> LLMProvider:
+        """
+        One provider per model of the routing table (each with its own concurrency
+        limit, resilience and cache entries), behind a RoutedProvider named name.
+        """
+        registry = registry or ProviderRegistry.from_env()
+        routes = {}
+        for model in table.models:
+            provider, fallback = build_providers_from_env(registry, model.name)
+            routes[model.name] = self.add(f"model:{model.name}", provider, fallback=fallback)
+        self.router = RoutedProvider(table, routes)
+        self._providers[name] = self.router
+        return self.router
+
+    def get(self, name: str = "default") -> LLMProvider:
+        if name not in self._providers:
+            raise KeyError(f"Unknown provider: {name}")
+        return self._providers[name]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        out = {}
+        for name, provider in self._providers.items():
+            if provider is self.router:
+                continue  # its routes are listed as model:<name>
+            stats = {"in_flight": provider.in_flight, "max_concurrency": provider.max_concurrency}
+            for upstream, state in provider.breaker_states().items():
+                stats[f"{upstream}_circuit_open"] = int(state != "closed")
+            admission = getattr(provider, "admission", None)
+            if admission is not None:
+                stats.update({f"admission_{k}": v for k, v in admission.stats().items()})
+            out[name] = stats
+        return out
+
+    @classmethod
+    def from_env(cls) -> "ProviderPool":
+        cache = ResponseCache.from_env() if os.getenv("LLM_CACHE", "0") == "1" else None
+        pool = cls(cache=cache)
+        table = RoutingTable.from_env()
+        if table is not None:
+            pool.add_routed("default", table)
+        else:
+            provider, fallback = build_providers_from_env()
+            pool.add("default", provider, fallback=fallback)
+        return pool
+
+    async def start(self) -> None:
+        if os.getenv("LLM_WARMUP", "1") == "0":
+            return
+        for name, provider in self._providers.items():
+            try:
+                await provider.warmup()
+            except Exception as e:  # warm-up is best effort
+                log.warning("Warm-up failed for provider %s: %s", name, e)
+
+    async def close(self) -> None:
+        for provider in self._providers.values():
+            await provider.aclose()
+        self._providers.clear()
+        if self.cache is not None:
+            self.cache.close()
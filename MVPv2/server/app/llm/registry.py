@@ -0,0 +1,110 @@
+"""
+Provider registry: LLM backends by name, imported only when selected.
+
+Backends come from three places:
+  - the built-ins below (mock, openai, replay)
+  - LLM_PROVIDER_PLUGINS="name=package.module:Class,..." (config map, no packaging
+    needed), which may also replace a built-in
+  - installed packages declaring an entry point in the "foxkoi.llm_providers" group,
+    which only add names: a built-in or LLM_PROVIDER_PLUGINS entry of the same
+    name always wins
+
+A target is "module:attribute"; a module starting with "." is relative to this
+package. Entry points are scanned only for names that are not otherwise known,
+so the common case never touches package metadata.
+"""
+from __future__ import annotations
+import importlib
+import os
+from typing import Dict, List, Optional, Type
+
+from .provider import LLMProvider
+
+ENTRY_POINT_GROUP = "foxkoi.llm_providers"
+
+BUILTIN: Dict[str, str] = {
+    "mock": ".provider:MockProvider",
+    "openai": ".openai_provider:OpenAIProvider",
+    "replay": ".cassette:ReplayProvider",
+}
+
+
+class ProviderConfigError(ValueError):
+    """
+    LLM provider configuration that cannot work (unknown backend, bad value).
+    Raised at startup so a misconfigured worker fails before taking traffic.
+    """
+
+
+def env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise ProviderConfigError(f"{name} must be an integer, got {raw!r}") from None
+
+
+def _parse_plugins(spec: str) -> Dict[str, str]:
+    targets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, target = item.partition("=")
+        if not sep or ":" not in target:
+            raise ProviderConfigError(f"LLM_PROVIDER_PLUGINS entry {item!r} is not name=module:Class")
+        targets[name.strip().lower()] = target.strip()
+    return targets
+
+
+class ProviderRegistry:
+    def __init__(self, targets: Optional[Dict[str, str]] = None):
+        self._targets: Dict[str, str] = {**BUILTIN, **(targets or {})}
+        self._loaded: Dict[str, Type[LLMProvider]] = {}
+        self._entry_points_scanned = False
+
+    @classmethod
+    def from_env(cls) -> "ProviderRegistry":
+        """
+        Env:
+          LLM_PROVIDER_PLUGINS   name=module:Class pairs, comma-separated (default none)
+        """
+        return cls(_parse_plugins(os.getenv("LLM_PROVIDER_PLUGINS", "")))
+
+    def _scan_entry_points(self) -> None:
+        if self._entry_points_scanned:
+            return
+        self._entry_points_scanned = True
+        from importlib.metadata import entry_points
+
+        for ep in entry_points(group=ENTRY_POINT_GROUP):
+            self._targets.setdefault(ep.name.lower(), ep.value)
+
+    def names(self) -> List[str]:
+        self._scan_entry_points()
+        return sorted(self._targets)
+
+    def load(self, name: str) -> Type[LLMProvider]:
+        """
+        Imports the backend's module (first call only) and returns its class.
+        """
+        name = name.strip().lower()
+        if name in self._loaded:
+            return self._loaded[name]
+        if name not in self._targets:
+            self._scan_entry_points()
+        target = self._targets.get(name)
+        if target is None:
+            raise ProviderConfigError(f"Unknown LLM provider {name!r}; available: {', '.join(self.names())}")
+        module_name, _, attr = target.partition(":")
+        try:
+            module = importlib.import_module(module_name, package=__package__)
+            cls = getattr(module, attr)
+        except (ImportError, AttributeError) as e:
+            raise ProviderConfigError(f"LLM provider {name!r} ({target}) cannot be loaded: {e}") from e
+        if not (isinstance(cls, type) and issubclass(cls, LLMProvider)):
+            raise ProviderConfigError(f"LLM provider {name!r} ({target}) is not an LLMProvider")
+        self._loaded[name] = cls
+        return cls
+
+    def loaded(self) -> List[str]:
+        return sorted(self._loaded)
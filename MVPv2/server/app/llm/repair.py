@@ -0,0 +1,260 @@
+"""
+Local fixes for almost-valid model output, so a malformed reply does not cost a
+second LLM round trip (repair_json) and a slightly-off key set does not become
+an HTTP 500 (coerce_to_model / validate_output).
+
+Coercion only fixes the shape. A schema's content_fields (e.g. Fox's
+reply_options) must still be non-empty, otherwise the output is rejected:
+an answer with nothing in it is a failed module, not an empty success.
+"""
+from __future__ import annotations
+import json
+import re
+import typing
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from ..metrics import validation_timer
+
+M = TypeVar("M", bound=BaseModel)
+
+_FENCE = re.compile(r"```[a-zA-Z0-9_-]*\s*\n?")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def repair_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Best-effort parse of a JSON object out of model output. Handles code fences,
+    prose before/after the object, trailing commas and truncation (unterminated
+    strings, missing closing brackets, a dangling key or value).
+    Returns None when nothing usable is found.
+    """
+    text = _FENCE.sub("", text)
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    out: List[str] = []
+    stack: List[str] = []
+    # (length of out, open brackets) at each point where cutting leaves valid JSON
+    cuts: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = escaped = False
+
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(ch)
+            out.append(ch)
+            cuts.append((len(out), tuple(stack)))
+            continue
+        elif ch in "}]":
+            # Drop a trailing comma before the closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack or _CLOSERS[stack[-1]] != ch:
+                break  # unbalanced: keep what we have and let truncation handling close it
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # end of the top-level object; anything after is prose
+            cuts.append((len(out), tuple(stack)))
+            continue
+        elif ch == ",":
+            cuts.append((len(out), tuple(stack)))
+        out.append(ch)
+
+    body = "".join(out)
+    if not stack and not in_string:
+        return _loads_object(body)
+
+    # Truncated: close the open string and brackets, backing off to earlier cut points if needed
+    closed = body + ('"' if in_string else "") + "".join(_CLOSERS[b] for b in reversed(stack))
+    data = _loads_object(closed)
+    if data is not None:
+        return data
+    for length, open_brackets in reversed(cuts):
+        candidate = body[:length].rstrip().rstrip(",") + "".join(_CLOSERS[b] for b in reversed(open_brackets))
+        data = _loads_object(candidate)
+        if data is not None:
+            return data
+    return None
+
+
+def _normalise_key(key: str) -> str:
+    # "replyOptions", "Reply Options", "reply-options" -> "reply_options"
+    key = re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", str(key).strip())
+    return re.sub(r"[\s\-]+", "_", key).lower()
+
+
+def _empty(annotation: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        return []
+    if origin is typing.Literal:
+        return typing.get_args(annotation)[0]
+    if annotation is float:
+        return 0.0
+    if annotation is int:
+        return 0
+    if annotation is bool:
+        return False
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return coerce_to_model(annotation, {})
+    return ""
+
+
+def _coerce_value(annotation: Any, value: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return None if value is None else _coerce_value(args[0], value)
+    if value is None:
+        return _empty(annotation)
+    if origin in (list, List):
+        (item,) = typing.get_args(annotation) or (Any,)
+        if not isinstance(value, list):
+            value = [value]
+        items = [_coerce_value(item, v) for v in value if v is not None]
+        if isinstance(item, type) and issubclass(item, BaseModel):
+            items = [v for v in items if has_content(item, v)]
+        return items
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return coerce_to_model(annotation, value if isinstance(value, dict) else {})
+    if annotation in (float, int):
+        if isinstance(value, str):
+            match = re.search(r"-?\d+(?:\.\d+)?", value)
+            if match is None:
+                return _empty(annotation)
+            number = float(match.group())
+            value = number / 100.0 if value.strip().endswith("%") else number
+        if isinstance(value, (int, float)):
+            return annotation(value)
+        return _empty(annotation)
+    if annotation is str:
+        if isinstance(value, list):
+            return " ".join(str(v) for v in value)
+        if isinstance(value, dict):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+    return value
+
+
+def _blank(value: Any) -> bool:
+    if isinstance(value, str):
+        return not value.strip()
+    return value is None or value == [] or value == {}
+
+
+def has_content(model: Type[BaseModel], data: Dict[str, Any]) -> bool:
+    """
+    True if none of model's content_fields is missing or empty in data.
+    """
+    return all(not _blank(data.get(name)) for name in getattr(model, "content_fields", ()))
+
+
+def conforms(schema: Optional[type], data: Any) -> bool:
+    """
+    True if data is usable output for schema: a JSON object that validates and
+    has its content fields filled. Without a (Pydantic) schema any object will do.
+    """
+    if not isinstance(data, dict):
+        return False
+    if schema is None or not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+        return True
+    try:
+        schema.model_validate(data)
+    except ValidationError:
+        return False
+    return has_content(schema, data)
+
+
+def _no_content(model: Type[BaseModel], data: Any) -> ValidationError:
+    missing = [name for name in getattr(model, "content_fields", ()) if _blank(data.get(name))]
+    return ValidationError.from_exception_data(
+        model.__name__, [{"type": "missing", "loc": (name,), "input": data} for name in missing]
+    )
+
+
+def coerce_to_model(model: Type[BaseModel], data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Maps data onto model's fields: keys are matched loosely (case, camelCase,
+    spaces), unknown keys are dropped, missing fields get their default (or an
+    empty value of the right type) and values are cast where possible.
+    data must be a dict (TypeError otherwise).
+    """
+    if not isinstance(data, dict):
+        raise TypeError(f"{model.__name__}: expected a JSON object, got {type(data).__name__}")
+    by_key = {_normalise_key(k): v for k, v in data.items()}
+    out: Dict[str, Any] = {}
+    for name, field in model.model_fields.items():
+        if name in data:
+            value = data[name]
+        elif name in by_key:
+            value = by_key[name]
+        elif not field.is_required():
+            continue  # let the model apply its own default
+        else:
+            out[name] = _empty(field.annotation)
+            continue
+        out[name] = _coerce_value(field.annotation, value)
+    return out
+
+
+def validate_output(model: Type[M], data: Any, module: str, persona: str) -> M:
+    """
+    Validates a module's output against its schema, coercing it on failure.
+    Raises the ValidationError if data is not a JSON object or has no content
+    (see has_content), before or after coercion.
+    Counted in foxkoi_validations_total as ok, coerced or failed.
+    """
+    with validation_timer(module, persona) as result:
+        try:
+            out = model.model_validate(data)
+        except ValidationError:
+            if not isinstance(data, dict):
+                raise
+            coerced = coerce_to_model(model, data)
+            if not has_content(model, coerced):
+                raise
+            result["outcome"] = "coerced"
+            return model.model_validate(coerced)
+        if not has_content(model, data):
+            raise _no_content(model, data)
+        return out
+
+
+def validate_or_none(
+    model: Type[M], data: Any, module: str, persona: str, failures: Dict[str, Exception]
+) -> Optional[M]:
+    """
+    validate_output for a module that may already have failed: None stays None,
+    and output that does not validate is recorded in failures[module] and becomes None.
+    """
+    if data is None:
+        return None
+    try:
+        return validate_output(model, data, module, persona)
+    except ValidationError as e:
+        failures[module] = e
+        return None
@@ -0,0 +1,306 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .provider import LLMProvider
+from ..metrics import HEDGES, UPSTREAM_FAILURES
+
+log = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    The analysis ran out of its end-to-end time budget.
+    """
+
+
+class ProvidersUnavailable(RuntimeError):
+    """
+    Every upstream provider is out of rotation (circuit open).
+    """
+
+
+_answered_by: ContextVar[Optional[List[LLMProvider]]] = ContextVar("llm_answered_by", default=None)
+
+
+@contextmanager
+def answering_upstreams() -> Iterator[List[LLMProvider]]:
+    """
+    Collects the upstream provider that answered each ResilientProvider call made
+    in the block: the primary, or the hedge/fallback whose answer was returned.
+    """
+    answered: List[LLMProvider] = []
+    token = _answered_by.set(answered)
+    try:
+        yield answered
+    finally:
+        _answered_by.reset(token)
+
+
+def _answered(upstream: "Upstream") -> None:
+    answered = _answered_by.get()
+    if answered is not None:
+        answered.append(upstream.provider)
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures; after
+    reset_after_s one trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_after_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_after_s:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def release(self) -> None:
+        # A call let through was cancelled before it had an outcome
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+
+@dataclass
+class Upstream:
+    name: str
+    provider: LLMProvider
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    return float(raw) if raw else default
+
+
+async def _next_before(chunks: AsyncIterator[str], deadline: float, message: str) -> str:
+    """
+    The stream's next chunk, or TimeoutError(message) once time.monotonic() passes deadline.
+    Runs in the caller's task (unlike wait_for), so context variables set by the
+    stream (e.g. tally blocks) stay in one context; the clock only runs while
+    waiting on the upstream, never while the consumer handles a chunk.
+    """
+    task = asyncio.current_task()
+    expired = False
+
+    def expire() -> None:
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(max(deadline - time.monotonic(), 0.0), expire)
+    try:
+        return await chunks.__anext__()
+    except asyncio.CancelledError:
+        if not expired:
+            raise
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+        raise TimeoutError(message) from None
+    finally:
+        handle.cancel()
+
+
+class ResilientProvider(LLMProvider):
+    """
+    Puts per-call timeouts, hedging and failover in front of one or more upstreams
+    (tried in order, e.g. primary model then a fallback provider/model).
+
+    - every call (a stream as a whole) is limited to call_timeout_s
+    - if the first upstream has not answered after hedge_delay_s, the same call is
+      also sent to the next one (or again to the only one) and the first answer wins
+    - a failed call fails over to the next upstream right away
+    - upstreams whose circuit breaker is open are skipped
+    """
+
+    def __init__(
+        self,
+        upstreams: List[Upstream],
+        call_timeout_s: float = 20.0,
+        hedge_delay_s: Optional[float] = None,
+    ):
+        self.upstreams = upstreams
+        self.call_timeout_s = call_timeout_s
+        self.hedge_delay_s = hedge_delay_s
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose the primary's attributes such as .model and .in_flight
+        return getattr(self.upstreams[0].provider, name)
+
+    @classmethod
+    def from_env(cls, providers: List[Tuple[str, LLMProvider]]) -> "ResilientProvider":
+        """
+        Env:
+          LLM_CALL_TIMEOUT_S      per-call timeout (default 20)
+          LLM_HEDGE_DELAY_MS      send a hedged duplicate after this long (default: off)
+          LLM_BREAKER_FAILURES    consecutive failures that open a circuit (default 5)
+          LLM_BREAKER_RESET_S     how long a circuit stays open (default 30)
+        """
+        hedge_ms = os.getenv("LLM_HEDGE_DELAY_MS", "").strip()
+        upstreams = [
+            Upstream(
+                name,
+                provider,
+                CircuitBreaker(
+                    failure_threshold=int(_env_float("LLM_BREAKER_FAILURES", 5)),
+                    reset_after_s=_env_float("LLM_BREAKER_RESET_S", 30.0),
+                ),
+            )
+            for name, provider in providers
+        ]
+        return cls(
+            upstreams,
+            call_timeout_s=_env_float("LLM_CALL_TIMEOUT_S", 20.0),
+            hedge_delay_s=float(hedge_ms) / 1000.0 if hedge_ms else None,
+        )
+
+    def _candidates(self) -> List[Upstream]:
+        order = list(self.upstreams)
+        if self.hedge_delay_s is not None and len(order) == 1:
+            order = order * 2  # hedge against the same upstream
+        return order
+
+    async def _call(self, upstream: Upstream, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        try:
+            return await asyncio.wait_for(
+                upstream.provider.generate_json(system_prompt, user_payload), self.call_timeout_s
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{upstream.name}: no answer within {self.call_timeout_s:g}s") from None
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        candidates = iter(self._candidates())
+        running: Dict[asyncio.Task, Upstream] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch_next() -> bool:
+            for upstream in candidates:
+                if upstream.breaker.allow():
+                    running[asyncio.create_task(self._call(upstream, system_prompt, user_payload))] = upstream
+                    return True
+                UPSTREAM_FAILURES.inc(upstream=upstream.name, reason="circuit_open")
+            return False
+
+        if not launch_next():
+            raise ProvidersUnavailable("All LLM providers are out of rotation (circuit open)")
+        first = next(iter(running))
+        hedged = False
+        try:
+            while running:
+                timeout = self.hedge_delay_s if not hedged else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch_next():
+                        HEDGES.inc(upstream=list(running.values())[-1].name, outcome="sent")
+                    continue
+                for task in done:
+                    upstream = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        upstream.breaker.record_success()
+                        if task is not first:
+                            HEDGES.inc(upstream=upstream.name, outcome="won")
+                        _answered(upstream)
+                        return task.result()
+                    upstream.breaker.record_failure()
+                    reason = "timeout" if isinstance(error, TimeoutError) else "error"
+                    UPSTREAM_FAILURES.inc(upstream=upstream.name, reason=reason)
+                    log.warning("LLM upstream %s failed: %s", upstream.name, error)
+                    last_error = error
+                if not running:
+                    launch_next()  # fail over right away
+        finally:
+            for task, upstream in running.items():
+                task.cancel()
+                upstream.breaker.release()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        assert last_error is not None
+        raise last_error
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        # No hedging for streams: the first healthy upstream streams, failures count toward its breaker.
+        # The whole stream is limited to call_timeout_s, like any other call.
+        for upstream in self.upstreams:
+            if not upstream.breaker.allow():
+                continue
+            chunks = upstream.provider.stream_json(system_prompt, user_payload).__aiter__()
+            deadline = time.monotonic() + self.call_timeout_s
+            outcome = False
+            try:
+                while True:
+                    try:
+                        chunk = await _next_before(
+                            chunks, deadline, f"{upstream.name}: stream not done within {self.call_timeout_s:g}s"
+                        )
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+                upstream.breaker.record_success()
+                outcome = True
+                _answered(upstream)
+            except Exception as e:
+                upstream.breaker.record_failure()
+                outcome = True
+                reason = "timeout" if isinstance(e, TimeoutError) else "error"
+                UPSTREAM_FAILURES.inc(upstream=upstream.name, reason=reason)
+                raise
+            finally:
+                if not outcome:
+                    # Cancelled or closed by the consumer: free a half-open trial slot
+                    upstream.breaker.release()
+                await chunks.aclose()
+            return
+        raise ProvidersUnavailable("All LLM providers are out of rotation (circuit open)")
+
+    def breaker_states(self) -> Dict[str, str]:
+        return {u.name: u.breaker.state for u in self.upstreams}
+
+    async def warmup(self) -> None:
+        for upstream in self.upstreams:
+            try:
+                await upstream.provider.warmup()
+            except Exception as e:  # warm-up is best effort
+                log.warning("Warm-up failed for upstream %s: %s", upstream.name, e)
+
+    async def aclose(self) -> None:
+        for upstream in self.upstreams:
+            await upstream.provider.aclose()
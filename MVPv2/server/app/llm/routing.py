@@ -0,0 +1,269 @@
+"""
+Model routing: picks the model for each LLM call from a cost/latency table.
+
+The choice uses a local token estimate of the prompt, the module (koi, fox,
+solo, summary, fox_analysis, fox_style), the persona and the request's knobs
+(see CallOptions). Rules set the minimum capability tier a call needs; among
+the models at or above it that fit the prompt, the one with the lowest
+expected cost plus latency_weight * expected latency (seconds) wins. Only
+when a call's output fails its schema (or is not JSON at all) is it retried
+on the best model of a higher tier.
+
+LLM_ROUTES is a JSON object, inline or a path to a file:
+
+    {
+      "models": {
+        "gpt-4o-mini": {"tier": 0, "input_per_1k": 0.00015, "output_per_1k": 0.0006,
+                        "latency_ms": 600, "latency_ms_per_1k": 120},
+        "gpt-4o":      {"tier": 1, "input_per_1k": 0.0025, "output_per_1k": 0.01,
+                        "latency_ms": 900, "latency_ms_per_1k": 200}
+      },
+      "rules": [
+        {"min_prompt_tokens": 6000, "tier": 1},
+        {"module": "fox", "knobs": {"aggressiveness": 0.8}, "tier": 1},
+        {"persona": "koi_coach_*", "tier": 1}
+      ],
+      "completion_tokens": {"koi": 250, "fox": 450},
+      "latency_weight": 0.0
+    }
+
+Costs are in whatever unit the table uses (e.g. USD); knob thresholds are minimums.
+"""
+from __future__ import annotations
+import fnmatch
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from ..compaction import estimate_tokens
+from ..metrics import ROUTED_CALLS, ROUTE_ESCALATIONS
+from .context import current_options
+from .provider import LLMProvider
+from .registry import ProviderConfigError
+from .repair import conforms
+
+DEFAULT_COMPLETION_TOKENS = {
+    "koi": 250, "fox": 450, "solo": 700, "summary": 150, "fox_analysis": 80, "fox_style": 90,
+}
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    name: str
+    tier: int = 0
+    input_per_1k: float = 0.0
+    output_per_1k: float = 0.0
+    latency_ms: float = 0.0
+    latency_ms_per_1k: float = 0.0
+    max_prompt_tokens: int = 0  # 0: no limit
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.input_per_1k + completion_tokens * self.output_per_1k) / 1000.0
+
+    def latency_ms_for(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return self.latency_ms + (prompt_tokens + completion_tokens) * self.latency_ms_per_1k / 1000.0
+
+    def fits(self, prompt_tokens: int) -> bool:
+        return not self.max_prompt_tokens or prompt_tokens <= self.max_prompt_tokens
+
+
+@dataclass(frozen=True)
+class RouteRule:
+    tier: int
+    module: str = ""
+    persona: str = ""  # fnmatch pattern
+    min_prompt_tokens: int = 0
+    knobs: Tuple[Tuple[str, float], ...] = ()
+
+    def matches(self, module: str, persona: str, prompt_tokens: int, knobs: Dict[str, float]) -> bool:
+        return (
+            (not self.module or self.module == module)
+            and (not self.persona or fnmatch.fnmatchcase(persona, self.persona))
+            and prompt_tokens >= self.min_prompt_tokens
+            and all(knobs.get(name, 0.0) >= minimum for name, minimum in self.knobs)
+        )
+
+
+class RoutingTable:
+    def __init__(
+        self,
+        models: List[ModelProfile],
+        rules: Optional[List[RouteRule]] = None,
+        completion_tokens: Optional[Dict[str, int]] = None,
+        latency_weight: float = 0.0,
+    ):
+        if not models:
+            raise ProviderConfigError("LLM_ROUTES needs at least one model")
+        self.models = models
+        self.rules = rules or []
+        self.completion_tokens = {**DEFAULT_COMPLETION_TOKENS, **(completion_tokens or {})}
+        self.latency_weight = latency_weight
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RoutingTable":
+        try:
+            models = [ModelProfile(name=name, **spec) for name, spec in config["models"].items()]
+            rules = [
+                RouteRule(**{**rule, "knobs": tuple(sorted(rule.get("knobs", {}).items()))})
+                for rule in config.get("rules", [])
+            ]
+            return cls(
+                models,
+                rules,
+                completion_tokens=config.get("completion_tokens"),
+                latency_weight=float(config.get("latency_weight", 0.0)),
+            )
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ProviderConfigError(f"Invalid LLM_ROUTES: {e!r}") from None
+
+    @classmethod
+    def from_env(cls) -> Optional["RoutingTable"]:
+        """
+        Env:
+          LLM_ROUTES    routing table as JSON, inline or a file path (default: no routing)
+        """
+        raw = os.getenv("LLM_ROUTES", "").strip()
+        if not raw:
+            return None
+        try:
+            if raw.startswith("{"):
+                config = json.loads(raw)
+            else:
+                with open(raw, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ProviderConfigError(f"LLM_ROUTES cannot be read: {e}") from None
+        return cls.from_config(config)
+
+    def expected_completion(self, module: str) -> int:
+        return self.completion_tokens.get(module, 400)
+
+    def score(self, model: ModelProfile, module: str, prompt_tokens: int) -> float:
+        completion = self.expected_completion(module)
+        latency_s = model.latency_ms_for(prompt_tokens, completion) / 1000.0
+        return model.cost(prompt_tokens, completion) + self.latency_weight * latency_s
+
+    def _best(self, min_tier: int, module: str, prompt_tokens: int) -> Optional[ModelProfile]:
+        eligible = [m for m in self.models if m.tier >= min_tier and m.fits(prompt_tokens)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda m: (self.score(m, module, prompt_tokens), m.tier))
+
+    def choose(self, module: str, persona: str, prompt_tokens: int, knobs: Dict[str, float]) -> ModelProfile:
+        tier = max((r.tier for r in self.rules if r.matches(module, persona, prompt_tokens, knobs)), default=0)
+        # Nothing at the required tier fits the prompt: take the best that does
+        return (
+            self._best(tier, module, prompt_tokens)
+            or self._best(0, module, prompt_tokens)
+            or max(self.models, key=lambda m: m.max_prompt_tokens)
+        )
+
+    def escalation(self, model: ModelProfile, module: str, prompt_tokens: int) -> Optional[ModelProfile]:
+        return self._best(model.tier + 1, module, prompt_tokens)
+
+
+@dataclass
+class _RouteStats:
+    calls: int = 0
+    invalid: int = 0
+    latency_ms: float = 0.0
+    predicted_latency_ms: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+class RoutedProvider(LLMProvider):
+    """
+    Sends each call to the model the routing table picks; providers holds one
+    (pool-wrapped) provider per model name. The pool owns those providers, so
+    warmup/aclose here do nothing.
+    """
+
+    def __init__(self, table: RoutingTable, providers: Dict[str, LLMProvider]):
+        missing = [m.name for m in table.models if m.name not in providers]
+        if missing:
+            raise ProviderConfigError(f"No provider for routed models: {missing}")
+        self.table = table
+        self.providers = providers
+        self._stats: Dict[Tuple[str, str], _RouteStats] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # Attributes such as .name come from the cheapest model's provider
+        return getattr(self.providers[self.table.models[0].name], name)
+
+    def _route(self, system_prompt: str, user_payload: str) -> Tuple[ModelProfile, str, int]:
+        opts = current_options()
+        prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_payload)
+        model = self.table.choose(opts.module, opts.persona, prompt_tokens, dict(opts.knobs))
+        return model, opts.module, prompt_tokens
+
+    def _record(
+        self, model: ModelProfile, module: str, prompt_tokens: int, data: Any, elapsed_ms: float, valid: bool
+    ) -> None:
+        completion = estimate_tokens(json.dumps(data, ensure_ascii=False)) if data is not None else 0
+        stats = self._stats.setdefault((model.name, module), _RouteStats())
+        stats.calls += 1
+        stats.invalid += int(not valid)
+        stats.latency_ms += elapsed_ms
+        stats.predicted_latency_ms += model.latency_ms_for(prompt_tokens, self.table.expected_completion(module))
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion
+        stats.cost += model.cost(prompt_tokens, completion)
+        ROUTED_CALLS.inc(model=model.name, module=module, outcome="ok" if valid else "invalid")
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        model, module, prompt_tokens = self._route(system_prompt, user_payload)
+        schema = current_options().schema
+        while True:
+            start = time.perf_counter()
+            error: Optional[json.JSONDecodeError] = None
+            try:
+                data: Optional[Dict[str, Any]] = await self.providers[model.name].generate_json(
+                    system_prompt, user_payload
+                )
+            except json.JSONDecodeError as e:
+                data, error = None, e  # unrepairable output counts as invalid
+            valid = error is None and conforms(schema, data)
+            self._record(model, module, prompt_tokens, data, (time.perf_counter() - start) * 1000.0, valid)
+            if valid:
+                return data  # type: ignore[return-value]
+            stronger = self.table.escalation(model, module, prompt_tokens)
+            if stronger is None:
+                # Nothing left to escalate to: the caller coerces (or reports) as before
+                if error is not None:
+                    raise error
+                return data  # type: ignore[return-value]
+            ROUTE_ESCALATIONS.inc(module=module, from_model=model.name, to_model=stronger.name)
+            model = stronger
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        # No escalation mid-stream; the streaming caller falls back to generate_json
+        model, _, _ = self._route(system_prompt, user_payload)
+        async for chunk in self.providers[model.name].stream_json(system_prompt, user_payload):
+            yield chunk
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Per model/module: calls, invalid rate, mean latency against the table's
+        prediction, and estimated cost, for tuning the table.
+        """
+        out: Dict[str, float] = {}
+        for (model, module), s in sorted(self._stats.items()):
+            prefix = f"{model}/{module or 'other'}"
+            out[f"{prefix}/calls"] = s.calls
+            out[f"{prefix}/invalid_ratio"] = s.invalid / s.calls
+            out[f"{prefix}/latency_ms_mean"] = s.latency_ms / s.calls
+            out[f"{prefix}/predicted_latency_ms_mean"] = s.predicted_latency_ms / s.calls
+            out[f"{prefix}/prompt_tokens_mean"] = s.prompt_tokens / s.calls
+            out[f"{prefix}/completion_tokens_mean"] = s.completion_tokens / s.calls
+            out[f"{prefix}/cost_total"] = s.cost
+        return out
+
+    async def warmup(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
@@ -0,0 +1,260 @@
+"""
+Local (no LLM) fast path for Koi: goal_alignment and topic_drift estimated
+from hashed bag-of-words vectors of the turns, the draft and the goal, plus
+rule-based risk flags for Fox.
+
+Turn vectors are kept per session and extended incrementally, so a delta
+request only embeds its new turns. In tiered mode Koi is answered locally
+when the estimate is confident or the user asked for little interruption,
+and by the LLM otherwise.
+"""
+from __future__ import annotations
+import os
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .conversation import Turn
+from .metrics import LOCAL_KOI
+from .schemas import AnalyzeRequestV2
+
+DIM = 2048
+# Cosine between related short texts in hashed bag-of-words space rarely exceeds
+# this; similarities are scaled by it onto 0..1
+SIMILARITY_SCALE = 0.4
+
+_WORD = re.compile(r"[a-z0-9']+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its me my of on or our so that the "
+    "their them there this to too us was we were what when which will with would you your".split()
+)
+
+_RISK_RULES: Tuple[Tuple[str, "re.Pattern[str]", bool], ...] = (
+    # (flag, pattern, applies to the draft only)
+    ("Ultimatum language in the conversation", re.compile(
+        r"\b(non-negotiable|final offer|take it or leave it|or else|last chance|no room)\b", re.I), False),
+    ("Hostile wording in the draft", re.compile(
+        r"\b(stupid|ridiculous|idiot\w*|shut up|nonsense|pathetic|useless|insane)\b", re.I), True),
+    ("Absolute language in the draft (always/never)", re.compile(
+        r"\b(always|never|everyone|nobody|every time)\b", re.I), True),
+    ("Heavy exclamation in the draft", re.compile(r"!{2,}|(?:![^!]*){3,}"), True),
+)
+_SHOUTING = re.compile(r"\b[A-Z]{3,}\b")
+
+
+def _features(text: str) -> List[str]:
+    words = [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def embed(texts: Sequence[str], dim: int = DIM) -> np.ndarray:
+    """
+    (len(texts), dim) L2-normalised signed feature-hashing vectors of words and word bigrams.
+    """
+    rows: List[int] = []
+    cols: List[int] = []
+    signs: List[float] = []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            cols.append(h % dim)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+    out = np.zeros(len(texts) * dim, dtype=np.float32)
+    if rows:
+        flat = np.asarray(rows, dtype=np.int64) * dim + np.asarray(cols, dtype=np.int64)
+        out += np.bincount(flat, weights=signs, minlength=len(texts) * dim).astype(np.float32)
+    out = out.reshape(len(texts), dim)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.where(norms == 0, 1.0, norms)
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+def _scaled(cosine: float) -> float:
+    return float(np.clip(cosine / SIMILARITY_SCALE, 0.0, 1.0))
+
+
+def risk_flags(draft: str, turns: Sequence[Turn], window: int = 4) -> List[str]:
+    recent = " ".join(t.text for t in turns[-window:])
+    flags = []
+    for flag, pattern, draft_only in _RISK_RULES:
+        if pattern.search(draft if draft_only else f"{recent} {draft}"):
+            flags.append(flag)
+    if len(_SHOUTING.findall(draft)) >= 2:
+        flags.append("Shouting (all caps) in the draft")
+    return flags
+
+
+@dataclass
+class KoiEstimate:
+    goal_alignment: float
+    topic_drift: float
+    confidence: float
+
+
+@dataclass
+class LocalVerdict:
+    """
+    What the local analyzer contributes to one analysis: a Koi answer when it
+    takes Koi over (None: call the LLM) and risk flags to add to Fox's.
+    """
+    koi: Optional[Dict[str, object]]
+    risk_flags: List[str]
+    reason: str
+
+    @property
+    def source(self) -> str:
+        if self.koi is None:
+            return "llm"
+        return "reused" if self.reason == "reused" else "local"
+
+
+@dataclass
+class _SessionVectors:
+    turns: int = 0
+    last: Optional[Turn] = None
+    vectors: np.ndarray = field(default_factory=lambda: np.zeros((0, DIM), dtype=np.float32))
+    summary_so_far: List[str] = field(default_factory=list)
+
+
+class LocalAnalyzer:
+    """
+    Tiered Koi: answered locally when the estimate's confidence is at least
+    min_confidence or the request's interruptiveness is at most
+    max_interruptiveness; otherwise the LLM is called.
+    """
+
+    def __init__(
+        self,
+        min_confidence: float = 0.75,
+        max_interruptiveness: float = 0.2,
+        window: int = 4,
+        max_sessions: int = 10_000,
+    ):
+        self.min_confidence = min_confidence
+        self.max_interruptiveness = max_interruptiveness
+        self.window = window
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, _SessionVectors]" = OrderedDict()
+        self.local = 0
+        self.llm = 0
+        self.turns_embedded = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["LocalAnalyzer"]:
+        """
+        Env:
+          LOCAL_KOI                          off | tiered (default off; None is returned when off)
+          LOCAL_KOI_MIN_CONFIDENCE           answer Koi locally at or above this confidence (default 0.75)
+          LOCAL_KOI_MAX_INTERRUPTIVENESS     ...or when interruptiveness is at most this (default 0.2)
+        """
+        if os.getenv("LOCAL_KOI", "off").strip().lower() != "tiered":
+            return None
+        return cls(
+            min_confidence=float(os.getenv("LOCAL_KOI_MIN_CONFIDENCE", "0.75")),
+            max_interruptiveness=float(os.getenv("LOCAL_KOI_MAX_INTERRUPTIVENESS", "0.2")),
+        )
+
+    def _vectors(self, session_id: str, turns: Sequence[Turn]) -> np.ndarray:
+        # Only turns added since the last call are embedded; a restarted conversation starts over
+        state = self._sessions.get(session_id)
+        if state is None or state.turns > len(turns) or (state.turns and turns[state.turns - 1] != state.last):
+            state = _SessionVectors()
+            self._sessions[session_id] = state
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        new = turns[state.turns:]
+        if new:
+            state.vectors = np.vstack([state.vectors, embed([t.text for t in new])])
+            state.turns = len(turns)
+            state.last = turns[-1]
+            self.turns_embedded += len(new)
+        return state.vectors
+
+    def estimate(self, session_id: str, turns: Sequence[Turn], draft: str, goal: str) -> KoiEstimate:
+        vectors = self._vectors(session_id, turns)
+        goal_vec, draft_vec = embed([goal, draft])
+        recent = _unit(vectors[-self.window:].sum(axis=0)) if len(vectors) else np.zeros(DIM, dtype=np.float32)
+        opening = _unit(vectors[: self.window].sum(axis=0)) if len(vectors) else np.zeros(DIM, dtype=np.float32)
+
+        if draft.strip():
+            alignment = _scaled(0.6 * float(draft_vec @ goal_vec) + 0.4 * float(recent @ goal_vec))
+        else:
+            alignment = _scaled(float(recent @ goal_vec))
+        # Drift: where the conversation is now versus what it set out to be about
+        topic = _unit(goal_vec + opening)
+        current = _unit(recent + draft_vec)
+        drift = 1.0 - _scaled(float(current @ topic)) if current.any() else 0.0
+
+        # Confident when the draft says enough to judge and the scores are clear-cut
+        evidence = min(1.0, len(_features(draft)) / 10.0)
+        decisiveness = max(abs(alignment - 0.5), abs(drift - 0.5)) * 2.0
+        return KoiEstimate(round(alignment, 2), round(drift, 2), round(evidence * (0.5 + 0.5 * decisiveness), 2))
+
+    def remember_summary(self, session_id: str, summary_so_far: List[str]) -> None:
+        state = self._sessions.get(session_id)
+        if state is not None:
+            state.summary_so_far = list(summary_so_far)
+
+    def _koi_output(self, req: AnalyzeRequestV2, est: KoiEstimate, turns: Sequence[Turn]) -> Dict[str, object]:
+        goal = req.goal_spec.goal
+        if est.topic_drift >= 0.6:
+            next_move = f"Bring the conversation back to the goal: {goal}"
+        elif est.goal_alignment >= 0.6:
+            next_move = "Keep going: the draft moves toward the goal; ask for a concrete commitment."
+        else:
+            next_move = f"Make the draft state how it advances the goal: {goal}"
+        summary = self._sessions[req.session_id].summary_so_far or [
+            f"{t.speaker}: {t.text[:120]}" for t in turns[-3:]
+        ]
+        return {
+            "goal": goal,
+            "goal_alignment": est.goal_alignment,
+            "topic_drift": est.topic_drift,
+            "missing_info": [],
+            "next_move": next_move,
+            "summary_so_far": summary,
+        }
+
+    def assess(self, req: AnalyzeRequestV2, turns: Sequence[Turn]) -> LocalVerdict:
+        """
+        Decides whether Koi is answered locally for this request.
+        """
+        est = self.estimate(req.session_id, turns, req.user_draft, req.goal_spec.goal)
+        if req.interruptiveness <= self.max_interruptiveness:
+            reason = "low_interruptiveness"
+        elif est.confidence >= self.min_confidence:
+            reason = "confident"
+        else:
+            reason = "uncertain"
+        koi = self._koi_output(req, est, turns) if reason != "uncertain" else None
+        if koi is None:
+            self.llm += 1
+        else:
+            self.local += 1
+        LOCAL_KOI.inc(source="local" if koi is not None else "llm", reason=reason)
+        return LocalVerdict(koi=koi, risk_flags=risk_flags(req.user_draft, turns), reason=reason)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.local + self.llm
+        return {
+            "sessions": len(self._sessions),
+            "turns_embedded": self.turns_embedded,
+            "koi_local": self.local,
+            "koi_llm": self.llm,
+            "koi_calls_avoided_ratio": self.local / total if total else 0.0,
+        }
+
+
+def merge_risk_flags(flags: List[str], extra: Sequence[str]) -> List[str]:
+    seen = {f.strip().lower() for f in flags}
+    return flags + [f for f in extra if f.strip().lower() not in seen]
@@ -1,25 +1,95 @@
+import asyncio
+import json
+import math
 import os
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Literal, Optional
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from .schemas import AnalyzeRequestV2, AnalyzeResponseV2
-from .orchestrator_v2 import run_analysis_v2
-from .llm.provider import MockProvider, OpenAIProvider
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic_core import to_json
+from .schemas import AnalyzeBatchRequest, AnalyzeRequestV2, AnalyzeResponseV2, BatchItemError, BatchItemResult
+from .orchestrator_v2 import run_analysis_v2, run_batch_v2, stream_analysis_v2
+from .llm.pool import ProviderPool
+from .llm.admission import AdmissionRejected
+from .llm.resilience import DeadlineExceeded, ProvidersUnavailable
+from .sessions import SessionError, SessionStore
+from .compaction import ContextCompactor
+from .live import LiveDraftSession
+from .local_analyzer import LocalAnalyzer
+from .metrics import GAUGES, REGISTRY, MetricsMiddleware
+from .singleflight import SingleFlight, request_key
+from .responses import ModelResponse, adapter_for
 
 
 from .schemas import (
     AnalyzeRequest,
     AnalyzeResponse,
-    PersonaItem,
     PersonaListResponse,
 )
-from .personas.registry import list_personas
+from .personas.catalog import InvalidCursor, PersonaCatalog, etag_matches
 from .orchestrator import run_analysis
-from .llm.provider import MockProvider
 
 load_dotenv()
+
+
+def _collect_components() -> None:
+    # Copy component counters into gauges right before each /metrics scrape
+    pool = getattr(app.state, "llm_pool", None)
+    if pool is None:
+        return
+    if pool.cache is not None:
+        for key, value in pool.cache.stats().items():
+            GAUGES.set(float(value), component="cache", key=key)
+    for name, stats in pool.stats().items():
+        for key, value in stats.items():
+            GAUGES.set(float(value), component=f"pool_{name}", key=key)
+    if pool.router is not None:
+        for key, value in pool.router.stats().items():
+            GAUGES.set(float(value), component="router", key=key)
+    for key, value in app.state.singleflight.stats().items():
+        GAUGES.set(float(value), component="singleflight", key=key)
+    for key, value in app.state.catalog.stats().items():
+        GAUGES.set(float(value), component="persona_catalog", key=key)
+    if app.state.local_analyzer is not None:
+        for key, value in app.state.local_analyzer.stats().items():
+            GAUGES.set(float(value), component="local_analyzer", key=key)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Providers (and their HTTP connection pools) live for the whole process. Only the
+    # selected backend is imported; invalid LLM_* configuration fails startup here.
+    pool = ProviderPool.from_env()
+    await pool.start()
+    if pool.cache is not None:
+        # The persistent tier only skips expired rows on read; trim it once per start
+        await pool.cache.purge()
+    app.state.llm_pool = pool
+    app.state.llm = pool.get()
+    app.state.sessions = SessionStore.from_env()
+    app.state.compactor = ContextCompactor.from_env(app.state.llm)
+    # Identical analyses running at the same time share one execution
+    app.state.singleflight = SingleFlight()
+    # LOCAL_KOI=tiered: Koi answered without the LLM when a local estimate suffices
+    app.state.local_analyzer = LocalAnalyzer.from_env()
+    # Built-in personas plus those trained with app.personas.training, hot-reloaded
+    catalog = PersonaCatalog.from_env()
+    catalog.reload()
+    app.state.catalog = catalog
+    watcher = asyncio.create_task(catalog.watch()) if catalog.persona_dir and catalog.reload_interval_s > 0 else None
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+        await pool.close()
+
+
 # Fast API entrance
-app = FastAPI(title="Koi & Fox MVP Server", version="0.1.0")
+app = FastAPI(title="Koi & Fox MVP Server", version="0.1.0", lifespan=lifespan)
 
 # Allow for Chrome extension, local dev to call the API
 app.add_middleware(
@@ -29,48 +99,251 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the timings include CORS handling; SERVER_TIMING=1 adds the header
+app.add_middleware(MetricsMiddleware, server_timing=os.getenv("SERVER_TIMING", "0") == "1")
+REGISTRY.add_collector(_collect_components)
+
+
+# Upstream LLM failures that end a whole analysis
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after_s)))},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(ProvidersUnavailable)
+async def providers_unavailable(request: Request, exc: ProvidersUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+def _error_status(exc: Exception) -> int:
+    # Status an error maps to above, for errors reported inside a response (batch items)
+    if isinstance(exc, KeyError):
+        return 400
+    if isinstance(exc, AdmissionRejected):
+        return 429
+    if isinstance(exc, ProvidersUnavailable):
+        return 503
+    if isinstance(exc, DeadlineExceeded):
+        return 504
+    return 500
 
 
 def _get_llm():
-    provider = os.getenv("LLM_PROVIDER", "mock").lower()
-    if provider == "openai":
-        key = os.getenv("OPENAI_API_KEY", "").strip()
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini").strip()
-        if not key:
-            # fall back to mock if key missing
-            return MockProvider()
-        return OpenAIProvider(api_key=key, model=model)
+    # Resolved once at startup
+    return app.state.llm
+
+
+async def _until_disconnect(request: Request, work: Awaitable[Any]) -> Any:
+    """
+    Awaits work, cancelling it if the client disconnects first (then returns None).
+    """
+    task = asyncio.ensure_future(work)
+
+    async def disconnected() -> None:
+        # The body has been read, so the next message is the disconnect
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
 
-    return MockProvider()
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    return None if task.cancelled() else task.result()
 
 
 @app.get("/personas", response_model=PersonaListResponse)
-async def personas():
-    items = []
-    for p in list_personas():
-        items.append(
-            PersonaItem(
-                id=p.id,
-                name=p.name,
-                module=p.module,  # should be "koi" or "fox"
-                description=p.description,
-            )
-        )
-    return PersonaListResponse(personas=items)
+async def personas(
+    request: Request,
+    module: Optional[Literal["koi", "fox"]] = None,
+    q: Optional[str] = Query(default=None, max_length=200, description="Words to find in name/description"),
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=500),
+):
+    # Pages are serialized once per catalog snapshot; clients revalidate with If-None-Match
+    try:
+        page = app.state.catalog.page(module=module, q=q, cursor=cursor, limit=limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), page.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = app.state.llm_pool.cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/analyze", response_model=AnalyzeResponse)
-async def analyze(req: AnalyzeRequest):
+async def analyze(req: AnalyzeRequest, request: Request):
     try:
+        req, session = await app.state.sessions.apply(req)
         llm = _get_llm()
-        return await run_analysis(req, llm)
+        resp = await _until_disconnect(request, app.state.singleflight.do(
+            request_key(req),
+            lambda: run_analysis(req, llm, app.state.compactor, session.turns),
+        ))
     except KeyError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    
+    except SessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if resp is None:
+        return Response(status_code=499)  # client closed the request
+    # Only a successful request stores its conversation delta, so a retry does not append it twice
+    try:
+        await app.state.sessions.commit(session)
+    except SessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Module outputs were validated by the orchestrator; serialize without a second pass
+    return ModelResponse(resp)
+
+
 @app.post("/v2/analyze", response_model=AnalyzeResponseV2)
-async def analyze_v2(req: AnalyzeRequestV2):
+async def analyze_v2(req: AnalyzeRequestV2, request: Request):
     try:
+        req, session = await app.state.sessions.apply(req)
         llm = _get_llm()
-        return await run_analysis_v2(req, llm)
+        resp = await _until_disconnect(request, app.state.singleflight.do(
+            request_key(req),
+            lambda: run_analysis_v2(req, llm, app.state.compactor, session.turns, app.state.local_analyzer),
+        ))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if resp is None:
+        return Response(status_code=499)  # client closed the request
+    # Only a successful request stores its conversation delta, so a retry does not append it twice
+    try:
+        await app.state.sessions.commit(session)
+    except SessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Module outputs were validated by the orchestrator; serialize without a second pass
+    return ModelResponse(resp)
+
+
+@app.post("/v2/analyze/stream")
+async def analyze_v2_stream(req: AnalyzeRequestV2):
+    """
+    Server-Sent Events: koi, reply_option (one per Fox option), fox, then done or error.
+    """
+    try:
+        req, session = await app.state.sessions.apply(req)
+        events = stream_analysis_v2(req, _get_llm(), app.state.compactor, session.turns, app.state.local_analyzer)
+        # The client takes the delta as sent once the stream starts, whatever its events report
+        await app.state.sessions.commit(session)
     except KeyError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except SessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    async def sse():
+        async for event, data in events:
+            yield b"event: " + event.encode() + b"\ndata: " + to_json(data) + b"\n\n"
+
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post(
+    "/v2/analyze/batch",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}, "description": "One BatchItemResult per line"}},
+)
+async def analyze_v2_batch(req: AnalyzeBatchRequest):
+    """
+    NDJSON: one BatchItemResult line per item, in the order the items complete.
+    A failed item gets an error line; the other items are unaffected.
+    """
+    results = run_batch_v2(req, _get_llm(), app.state.compactor)
+    line = adapter_for(BatchItemResult)
+
+    async def ndjson():
+        async for index, outcome in results:
+            item = BatchItemResult(index=index, id=req.items[index].id)
+            if isinstance(outcome, Exception):
+                item.error = BatchItemError(status=_error_status(outcome), detail=str(outcome))
+            else:
+                item.result = outcome
+            yield line.dump_json(item) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+@app.websocket("/v2/live")
+async def analyze_v2_live(ws: WebSocket):
+    """
+    Live drafting. Client messages (JSON):
+      {"type": "start", ...AnalyzeRequestV2 fields}    conversation, goal, personas, knobs (user_draft optional)
+      {"type": "context", ...fields to change}         e.g. conversation_delta after a new message
+      {"type": "draft", "user_draft": "..."}           on every edit; debounced server-side
+    Server messages: {"type": "analysis", "seq", "draft", "result"} for the latest draft only,
+    {"type": "error", "seq", "status", "detail"}.
+    """
+    await ws.accept()
+
+    async def analyze(req: AnalyzeRequestV2, turns, reuse_koi) -> AnalyzeResponseV2:
+        return await run_analysis_v2(
+            req, _get_llm(), app.state.compactor, turns, app.state.local_analyzer, reuse_koi=reuse_koi
+        )
+
+    live = LiveDraftSession.from_env(ws.send_text, analyze, _error_status)
+    try:
+        while True:
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            try:
+                # A malformed frame gets an error reply; only a disconnect ends the session
+                msg = json.loads(frame.get("text") or frame.get("bytes") or "")
+                if not isinstance(msg, dict):
+                    raise ValueError("messages must be JSON objects")
+                kind = msg.pop("type", None)
+                if kind == "draft":
+                    live.draft(str(msg.get("user_draft", "")))
+                elif kind in ("start", "context"):
+                    if kind == "context" and live.base is None:
+                        raise ValueError("send a start message first")
+                    fields = {"user_draft": ""} if kind == "start" else {
+                        **live.base.model_dump(exclude={"conversation"}), "conversation_delta": None
+                    }
+                    draft = msg.pop("user_draft", None)
+                    req, session = await app.state.sessions.apply(AnalyzeRequestV2(**{**fields, **msg}))
+                    # Context messages are not retried: the new context holds from here on
+                    await app.state.sessions.commit(session)
+                    if draft is not None:
+                        live.draft_text = str(draft)
+                    live.set_context(req, session.turns)
+                else:
+                    raise ValueError(f"unknown message type: {kind!r}")
+            except (ValueError, SessionError) as e:
+                # ValidationError is a ValueError; the connection stays open for a corrected message
+                status = 409 if isinstance(e, SessionError) else 400
+                await ws.send_text(to_json({"type": "error", "seq": live.seq, "status": status, "detail": str(e)}).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await live.close()
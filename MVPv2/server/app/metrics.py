@@ -0,0 +1,366 @@
+"""
+Minimal in-process metrics with Prometheus text exposition (served at /metrics).
+
+Cheap enough to leave on: an observation is a perf_counter() pair, a dict
+lookup and a bisect. Everything runs on the event loop, so no locks.
+"""
+from __future__ import annotations
+import bisect
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .llm.context import current_options
+
+LabelValues = Tuple[str, ...]
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values) if v != ""]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v:g}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[tuple(str(labels.get(n, "")) for n in self.labelnames)] = value
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, row in sorted(self._values.items()):
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                labels = _fmt_labels(self.labelnames, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative:g}")
+            labels = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {row[-1]:g}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {row[-2]:.6f}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {row[-1]:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """
+        fn runs before each scrape, e.g. to copy external counters into gauges.
+        """
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            fn()
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "foxkoi_stage_seconds",
+    "Time spent per analysis stage",
+    ("stage", "module", "persona", "provider"),
+))
+LLM_CALLS = REGISTRY.register(Counter(
+    "foxkoi_llm_calls_total",
+    "generate_json calls by outcome (ok, local_repair, llm_repair, failed)",
+    ("provider", "module", "persona", "outcome"),
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "foxkoi_llm_tokens_total",
+    "Provider-reported token usage (kind cached: prompt tokens read from the provider's prompt cache)",
+    ("provider", "module", "persona", "kind"),
+))
+VALIDATIONS = REGISTRY.register(Counter(
+    "foxkoi_validations_total",
+    "Pydantic validation of module output by outcome (ok, coerced, failed)",
+    ("module", "persona", "outcome"),
+))
+FUSED_FALLBACKS = REGISTRY.register(Counter(
+    "foxkoi_fused_fallbacks_total",
+    "Modules re-run on their own because their part of a fused (solo) answer was invalid",
+    ("module",),
+))
+LOCAL_KOI = REGISTRY.register(Counter(
+    "foxkoi_local_koi_total",
+    "Koi answers in tiered mode by source (local, llm) and reason (confident, low_interruptiveness, uncertain)",
+    ("source", "reason"),
+))
+LIVE_DRAFTS = REGISTRY.register(Counter(
+    "foxkoi_live_drafts_total",
+    "Live-drafting analyses by outcome (analyzed, reused_koi, debounced, cancelled)",
+    ("outcome",),
+))
+ROUTED_CALLS = REGISTRY.register(Counter(
+    "foxkoi_routed_calls_total",
+    "LLM calls by routed model, module and output outcome (ok, invalid)",
+    ("model", "module", "outcome"),
+))
+ROUTE_ESCALATIONS = REGISTRY.register(Counter(
+    "foxkoi_route_escalations_total",
+    "Calls retried on a stronger model because the routed model's output failed validation",
+    ("module", "from_model", "to_model"),
+))
+HEDGES = REGISTRY.register(Counter(
+    "foxkoi_hedged_calls_total",
+    "Hedged duplicate LLM calls: sent, and won (answered before the original)",
+    ("upstream", "outcome"),
+))
+UPSTREAM_FAILURES = REGISTRY.register(Counter(
+    "foxkoi_upstream_failures_total",
+    "Failed or skipped upstream LLM calls by reason (timeout, error, circuit_open)",
+    ("upstream", "reason"),
+))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "foxkoi_admission_wait_seconds",
+    "Time LLM calls waited for rate-limit admission, by outcome (admitted, rejected)",
+    ("outcome",),
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "foxkoi_http_request_seconds",
+    "HTTP request latency",
+    ("method", "path", "status"),
+))
+GAUGES = REGISTRY.register(Gauge(
+    "foxkoi_component",
+    "Point-in-time values from components (cache, pool, ...)",
+    ("component", "key"),
+))
+
+
+# Per-request Server-Timing entries; set only while a request is handled with the header enabled
+_server_timing: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timing", default=None)
+
+
+@contextmanager
+def collect_server_timing() -> Iterator[List[Tuple[str, float]]]:
+    entries: List[Tuple[str, float]] = []
+    token = _server_timing.set(entries)
+    try:
+        yield entries
+    finally:
+        _server_timing.reset(token)
+
+
+def server_timing_header(entries: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000.0:.1f}" for name, seconds in entries)
+
+
+def observe_stage(stage: str, seconds: float, provider: str = "", module: Optional[str] = None) -> None:
+    opts = current_options()
+    module = opts.module if module is None else module
+    STAGE_SECONDS.observe(seconds, stage=stage, module=module, persona=opts.persona, provider=provider)
+    entries = _server_timing.get()
+    if entries is not None:
+        entries.append((f"{module}_{stage}" if module else stage, seconds))
+
+
+@contextmanager
+def stage_timer(stage: str, provider: str = "", module: Optional[str] = None) -> Iterator[None]:
+    """
+    Times a block into foxkoi_stage_seconds (and Server-Timing when enabled).
+    module/persona labels default to the current call options.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, provider, module)
+
+
+@dataclass
+class Tally:
+    """
+    What the counters below recorded within one tally() block: LLM calls by
+    outcome, provider-reported tokens by kind and validations by outcome.
+    """
+    calls: Dict[str, int] = field(default_factory=dict)
+    tokens: Dict[str, int] = field(default_factory=dict)
+    validations: Dict[str, int] = field(default_factory=dict)
+    # Enclosing tally() block, which sees everything this one does
+    parent: Optional["Tally"] = field(default=None, repr=False, compare=False)
+
+
+_tally: ContextVar[Optional[Tally]] = ContextVar("metrics_tally", default=None)
+
+
+def _add_to_tally(kind: str, key: str, n: int = 1) -> None:
+    counts = _tally.get()
+    while counts is not None:
+        bucket = getattr(counts, kind)
+        bucket[key] = bucket.get(key, 0) + n
+        counts = counts.parent
+
+
+@contextmanager
+def tally() -> Iterator[Tally]:
+    """
+    Attributes calls, tokens and validations to the block (and the tasks it
+    starts), e.g. to one analysis among many running concurrently. Blocks nest:
+    an enclosing tally still counts everything.
+    """
+    counts = Tally(parent=_tally.get())
+    token = _tally.set(counts)
+    try:
+        yield counts
+    finally:
+        _tally.reset(token)
+
+
+def record_usage(provider: str, usage) -> None:
+    """
+    Counts an OpenAI-style usage object (prompt_tokens / completion_tokens, and
+    prompt_tokens_details.cached_tokens: the prompt tokens served from the
+    provider's prefix cache, counted as kind "cached").
+    """
+    if usage is None:
+        return
+    opts = current_options()
+    details = getattr(usage, "prompt_tokens_details", None)
+    counts = {
+        "prompt": getattr(usage, "prompt_tokens", None),
+        "completion": getattr(usage, "completion_tokens", None),
+        "cached": getattr(details, "cached_tokens", None),
+    }
+    for kind, n in counts.items():
+        if n:
+            LLM_TOKENS.inc(n, provider=provider, module=opts.module, persona=opts.persona, kind=kind)
+            _add_to_tally("tokens", kind, n)
+
+
+def record_call(provider: str, outcome: str) -> None:
+    opts = current_options()
+    LLM_CALLS.inc(provider=provider, module=opts.module, persona=opts.persona, outcome=outcome)
+    _add_to_tally("calls", outcome)
+
+
+@contextmanager
+def validation_timer(module: str, persona: str) -> Iterator[Dict[str, str]]:
+    """
+    Times Pydantic validation of a module's output and counts outcomes.
+    The block may set result["outcome"] (default "ok"; "failed" on exceptions).
+    """
+    start = time.perf_counter()
+    result = {"outcome": "ok"}
+    try:
+        yield result
+    except Exception:
+        result["outcome"] = "failed"
+        raise
+    finally:
+        VALIDATIONS.inc(module=module, persona=persona, outcome=result["outcome"])
+        _add_to_tally("validations", result["outcome"])
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage="validate", module=module, persona=persona, provider="")
+        entries = _server_timing.get()
+        if entries is not None:
+            entries.append((f"{module}_validate", seconds))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: records foxkoi_http_request_seconds per route template
+    (unmatched paths share one label) and, with server_timing=True, adds a
+    Server-Timing header built from the stages timed while handling the request.
+
+    Streaming responses send their headers before the LLM stages run, so their
+    Server-Timing only covers the work done up to the first byte.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        # Without the header, stages are not collected per request at all
+        with collect_server_timing() if self.server_timing else nullcontext() as entries:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+                    if self.server_timing:
+                        timing = entries + [("total", time.perf_counter() - start)]
+                        headers = list(message.get("headers", []))
+                        headers.append((b"server-timing", server_timing_header(timing).encode("latin-1")))
+                        message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                HTTP_SECONDS.observe(
+                    time.perf_counter() - start,
+                    method=scope["method"],
+                    path=getattr(route, "path", "unmatched"),
+                    status=str(status["code"]),
+                )
@@ -1,16 +1,23 @@
-from .schemas import AnalyzeRequest, AnalyzeResponse, KoiOutput, FoxOutput
+from typing import List, Optional
+from .schemas import AnalyzeRequest, AnalyzeResponse, AnalysisMeta, KoiOutput, FoxOutput
 from .personas.registry import get_persona
 from .llm.provider import LLMProvider
+from .llm.context import call_options, request_knobs
+from .llm.layout import DRAFT_MARKER
+from .compaction import ContextCompactor, compact_conversation
+from .conversation import Turn
+from .metrics import stage_timer
+from .engine import analysis_deadline, run_collaboration, validate_results, within_deadline
 
 
-def _build_user_payload(req: AnalyzeRequest) -> str:
+def _build_user_payload(req: AnalyzeRequest, conversation: Optional[str] = None) -> str:
     """
     Build the unified user payload shared by KOI and FOX.
     """
     return (
         "=== Conversation Context ===\n"
-        f"{req.conversation}\n\n"
-        "=== User Draft ===\n"
+        f"{req.conversation if conversation is None else conversation}\n\n"
+        f"{DRAFT_MARKER}"
         f"{req.user_draft}\n\n"
         "=== Preference Knobs ===\n"
         f"aggressiveness={req.aggressiveness}, "
@@ -20,20 +27,41 @@ def _build_user_payload(req: AnalyzeRequest) -> str:
     )
 
 
-async def run_analysis(req: AnalyzeRequest, llm: LLMProvider) -> AnalyzeResponse:
+async def run_analysis(
+    req: AnalyzeRequest,
+    llm: LLMProvider,
+    compactor: Optional[ContextCompactor] = None,
+    turns: Optional[List[Turn]] = None,
+) -> AnalyzeResponse:
     """
     Orchestrates KOI (direction/goal) + FOX (strategy/tone) and merges outputs.
+    KOI and FOX run according to req.strategy (concurrently by default).
+    With a compactor, long conversations are shrunk to its token budget first
+    (turns: already-parsed turns of req.conversation, if known).
     """
     koi_persona = get_persona(req.koi_persona_id)
     fox_persona = get_persona(req.fox_persona_id)
+    deadline = analysis_deadline()
 
-    payload = _build_user_payload(req)
+    with call_options(bypass_cache=req.no_cache, deadline=deadline, session=req.session_id, knobs=request_knobs(req)):
+        # Summary calls count against the same end-to-end deadline
+        with stage_timer("compaction"):
+            conversation, compaction = await within_deadline(
+                compact_conversation(compactor, req.conversation, turns), "compaction"
+            )
+        with stage_timer("payload_build"):
+            payload = _build_user_payload(req, conversation)
 
-    koi_json = await llm.generate_json(koi_persona.system_prompt, payload)
-    fox_json = await llm.generate_json(fox_persona.system_prompt, payload)
+        koi_json, fox_json, timings, errors = await run_collaboration(
+            req.strategy, llm, koi_persona, fox_persona, payload, koi_model=KoiOutput
+        )
 
     # Validate shapes via Pydantic models
-    koi_out = KoiOutput(**koi_json)
-    fox_out = FoxOutput(**fox_json)
+    # A module that failed, missed the deadline or gave unusable output stays None; the other one is still returned
+    koi_out, fox_out = validate_results(KoiOutput, koi_json, koi_persona.id, fox_json, fox_persona.id, errors)
 
-    return AnalyzeResponse(koi=koi_out, fox=fox_out)
+    return AnalyzeResponse(
+        koi=koi_out,
+        fox=fox_out,
+        meta=AnalysisMeta(strategy=req.strategy, timings_ms=timings, compaction=compaction, errors=errors),
+    )
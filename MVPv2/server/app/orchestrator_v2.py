@@ -1,10 +1,50 @@
-from .schemas import AnalyzeRequestV2, AnalyzeResponseV2, KoiOutputV2, FoxOutput
-from .personas.registry import get_persona
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from .schemas import (
+    AnalyzeBatchRequest,
+    AnalyzeRequestV2,
+    AnalyzeResponseV2,
+    AnalysisMeta,
+    CompactionReport,
+    FoxOutput,
+    GoalSpec,
+    KoiOutputV2,
+    ReplyOption,
+)
+from .personas.registry import REPLY_STYLES, Persona, get_persona
 from .llm.provider import LLMProvider
+from .llm.context import call_options, request_knobs
+from .llm.layout import DRAFT_MARKER
+from .compaction import ContextCompactor, compact_conversation
+from .conversation import Turn, parse_turns
+from .local_analyzer import LocalAnalyzer, LocalVerdict, merge_risk_flags, risk_flags
+from .llm.jsonstream import JsonArrayScanner
+from .metrics import stage_timer
+from .llm.repair import repair_json, validate_output
+from .engine import (
+    Stage,
+    analysis_deadline,
+    call_module,
+    describe_failure,
+    fox_fanout,
+    relay_payload,
+    run_collaboration,
+    run_stages,
+    tolerant,
+    validate_results,
+    within_deadline,
+)
 
+# (event name, JSON-able data) pairs produced by stream_analysis_v2
+StreamEvent = Tuple[str, Dict[str, Any]]
 
-def _build_user_payload_v2(req: AnalyzeRequestV2) -> str:
-    gs = req.goal_spec
+
+def _context_block_v2(gs: GoalSpec, conversation: str) -> str:
+    # The part of the payload shared by every draft analyzed against this conversation
     constraints = "\n".join([f"- {c}" for c in gs.constraints]) or "- (none)"
     criteria = "\n".join([f"- {c}" for c in gs.success_criteria]) or "- (none)"
 
@@ -18,26 +58,329 @@ def _build_user_payload_v2(req: AnalyzeRequestV2) -> str:
         "Success Criteria:\n"
         f"{criteria}\n\n"
         "=== Conversation Context ===\n"
-        f"{req.conversation}\n\n"
-        "=== User Draft ===\n"
-        f"{req.user_draft}\n\n"
+        f"{conversation}\n\n"
+    )
+
+
+def _draft_block_v2(user_draft: str, knobs: Union[AnalyzeRequestV2, AnalyzeBatchRequest]) -> str:
+    return (
+        f"{DRAFT_MARKER}"
+        f"{user_draft}\n\n"
         "=== Preference Knobs ===\n"
-        f"aggressiveness={req.aggressiveness}, interruptiveness={req.interruptiveness}, structure_strength={req.structure_strength}\n\n"
+        f"aggressiveness={knobs.aggressiveness}, interruptiveness={knobs.interruptiveness}, structure_strength={knobs.structure_strength}\n\n"
         "Return STRICT JSON only."
     )
 
 
-async def run_analysis_v2(req: AnalyzeRequestV2, llm: LLMProvider) -> AnalyzeResponseV2:
+def _build_user_payload_v2(req: AnalyzeRequestV2, conversation: Optional[str] = None) -> str:
+    context = _context_block_v2(req.goal_spec, req.conversation if conversation is None else conversation)
+    return context + _draft_block_v2(req.user_draft, req)
+
+
+def _assess_locally(
+    analyzer: Optional[LocalAnalyzer], req: AnalyzeRequestV2, turns: Optional[List[Turn]]
+) -> Optional[LocalVerdict]:
+    if analyzer is None:
+        return None
+    with stage_timer("local_analysis"):
+        return analyzer.assess(req, turns if turns is not None else parse_turns(req.conversation or ""))
+
+
+async def run_analysis_v2(
+    req: AnalyzeRequestV2,
+    llm: LLMProvider,
+    compactor: Optional[ContextCompactor] = None,
+    turns: Optional[List[Turn]] = None,
+    analyzer: Optional[LocalAnalyzer] = None,
+    reuse_koi: Optional[Dict[str, Any]] = None,
+) -> AnalyzeResponseV2:
+    """
+    With an analyzer (tiered mode) Koi may be answered locally, skipping its LLM call.
+    reuse_koi is an earlier Koi result for the same context (e.g. the draft was only
+    reworded); Koi is then not asked again.
+    """
     koi_persona = get_persona(req.koi_persona_id)
     fox_persona = get_persona(req.fox_persona_id)
+    deadline = analysis_deadline()
 
-    payload = _build_user_payload_v2(req)
+    if reuse_koi is not None:
+        flags = risk_flags(req.user_draft, turns or []) if analyzer is not None else []
+        local = LocalVerdict(koi=reuse_koi, risk_flags=flags, reason="reused")
+    else:
+        local = _assess_locally(analyzer, req, turns)
+    # Summary calls count against the same end-to-end deadline
+    with call_options(bypass_cache=req.no_cache, deadline=deadline, session=req.session_id, knobs=request_knobs(req)):
+        with stage_timer("compaction"):
+            conversation, compaction = await within_deadline(
+                compact_conversation(compactor, req.conversation, turns), "compaction"
+            )
+    with stage_timer("payload_build"):
+        payload = _build_user_payload_v2(req, conversation)
 
     # IMPORTANT: prompts must instruct them to NOT invent goals
-    koi_json = await llm.generate_json(koi_persona.system_prompt, payload)
-    fox_json = await llm.generate_json(fox_persona.system_prompt, payload)
+    resp = await _analyze_payload_v2(req, llm, koi_persona, fox_persona, payload, compaction, deadline, local=local)
+    if analyzer is not None and local is not None and local.koi is None and resp.koi is not None:
+        analyzer.remember_summary(req.session_id, resp.koi.summary_so_far)
+    return resp
+
+
+async def _analyze_payload_v2(
+    req: Union[AnalyzeRequestV2, AnalyzeBatchRequest],
+    llm: LLMProvider,
+    koi_persona: Persona,
+    fox_persona: Persona,
+    payload: str,
+    compaction: Optional[CompactionReport],
+    deadline: float,
+    priority: int = 0,
+    local: Optional[LocalVerdict] = None,
+) -> AnalyzeResponseV2:
+    with call_options(
+        bypass_cache=req.no_cache, deadline=deadline, session=req.session_id, priority=priority, knobs=request_knobs(req)
+    ):
+        koi_json, fox_json, timings, errors = await run_collaboration(
+            req.strategy, llm, koi_persona, fox_persona, payload,
+            local_koi=local.koi if local else None,
+            fox_styles=REPLY_STYLES if req.fox_mode == "fanout" else None,
+        )
+
+    # A module that failed, missed the deadline or gave unusable output stays None; the other one is still returned
+    koi_out, fox_out = validate_results(KoiOutputV2, koi_json, koi_persona.id, fox_json, fox_persona.id, errors)
+    if fox_out is not None and local is not None:
+        fox_out.risk_flags = merge_risk_flags(fox_out.risk_flags, local.risk_flags)
+
+    return AnalyzeResponseV2(
+        koi=koi_out,
+        fox=fox_out,
+        meta=AnalysisMeta(
+            strategy=req.strategy,
+            timings_ms=timings,
+            compaction=compaction,
+            errors=errors,
+            koi_source=local.source if local else None,
+        ),
+    )
+
+
+def stream_analysis_v2(
+    req: AnalyzeRequestV2,
+    llm: LLMProvider,
+    compactor: Optional[ContextCompactor] = None,
+    turns: Optional[List[Turn]] = None,
+    analyzer: Optional[LocalAnalyzer] = None,
+) -> AsyncIterator[StreamEvent]:
+    """
+    Progressive variant of run_analysis_v2. Yields, in completion order:
+      ("koi", KoiOutputV2)          as soon as Koi is done
+      ("reply_option", ReplyOption) for each Fox option as soon as it is complete
+      ("fox", FoxOutput)            once Fox is done
+      ("done", AnalysisMeta) or ("error", {"detail": ...}) last
+
+    Personas are resolved eagerly so unknown ids raise KeyError before streaming starts.
+    """
+    koi_persona = get_persona(req.koi_persona_id)
+    fox_persona = get_persona(req.fox_persona_id)
+    return _stream_v2(req, llm, koi_persona, fox_persona, compactor, turns, analyzer)
+
+
+async def _stream_v2(
+    req: AnalyzeRequestV2,
+    llm: LLMProvider,
+    koi_persona: Persona,
+    fox_persona: Persona,
+    compactor: Optional[ContextCompactor],
+    turns: Optional[List[Turn]],
+    analyzer: Optional[LocalAnalyzer],
+) -> AsyncIterator[StreamEvent]:
+    queue: "asyncio.Queue[StreamEvent]" = asyncio.Queue()
+    payload = ""
+    local: Optional[LocalVerdict] = None
+
+    async def koi_stage(_: Dict[str, Any]) -> Dict[str, Any]:
+        if local is not None and local.koi is not None:
+            koi_json = local.koi
+        else:
+            koi_json = await call_module(
+                llm, "koi", koi_persona.id, koi_persona.system_prompt, payload, KoiOutputV2
+            )
+            if analyzer is not None:
+                analyzer.remember_summary(req.session_id, koi_json.get("summary_so_far") or [])
+        koi_out = validate_output(KoiOutputV2, koi_json, "koi", koi_persona.id)
+        queue.put_nowait(("koi", koi_out.model_dump()))
+        return koi_json
+
+    def push_option(index: int, option: Dict[str, Any]) -> None:
+        queue.put_nowait(("reply_option", {"index": index, **option}))
+
+    async def fox_stage(deps: Dict[str, Any]) -> Dict[str, Any]:
+        fox_payload = relay_payload(payload, deps["koi"]) if deps.get("koi") is not None else payload
+        if req.fox_mode == "fanout":
+            # Options arrive as their own calls finish; index is the style's position
+            fox_json = await within_deadline(
+                fox_fanout(llm, fox_persona, fox_payload, REPLY_STYLES, on_option=push_option), "fox"
+            )
+        else:
+            fox_json = await streamed_fox(fox_payload)
+        fox_out = validate_output(FoxOutput, fox_json, "fox", fox_persona.id)
+        if local is not None:
+            fox_out.risk_flags = merge_risk_flags(fox_out.risk_flags, local.risk_flags)
+        queue.put_nowait(("fox", fox_out.model_dump()))
+        return fox_json
+
+    async def streamed_fox(fox_payload: str) -> Dict[str, Any]:
+        scanner = JsonArrayScanner("reply_options")
+
+        async def consume() -> None:
+            index = 0
+            async for chunk in llm.stream_json(fox_persona.system_prompt, fox_payload):
+                for item in scanner.feed(chunk):
+                    try:
+                        option = ReplyOption(**item)
+                    except ValidationError:
+                        continue  # the final FoxOutput validation decides
+                    push_option(index, option.model_dump())
+                    index += 1
+
+        with call_options(module="fox", persona=fox_persona.id, schema=FoxOutput):
+            with stage_timer("stream", provider=getattr(llm, "name", "")):
+                await within_deadline(consume(), "fox")
+        try:
+            fox_json = json.loads(scanner.text)
+        except json.JSONDecodeError:
+            fox_json = repair_json(scanner.text)
+        if fox_json is None:
+            # Beyond local repair: fall back to the non-streaming call
+            fox_json = await call_module(
+                llm, "fox", fox_persona.id, fox_persona.system_prompt, fox_payload, FoxOutput
+            )
+        return fox_json
+
+    async def run() -> None:
+        nonlocal payload, local
+        start = time.perf_counter()
+        try:
+            local = _assess_locally(analyzer, req, turns)
+            with stage_timer("compaction"):
+                conversation, compaction = await within_deadline(
+                    compact_conversation(compactor, req.conversation, turns), "compaction"
+                )
+            with stage_timer("payload_build"):
+                payload = _build_user_payload_v2(req, conversation)
+            if req.strategy == "solo" and req.fox_mode == "single":
+                # One combined call cannot be split while streaming
+                koi_json, fox_json, timings, errors = await run_collaboration(
+                    "solo", llm, koi_persona, fox_persona, payload, local_koi=local.koi if local else None
+                )
+                koi_out, fox_out = validate_results(
+                    KoiOutputV2, koi_json, koi_persona.id, fox_json, fox_persona.id, errors
+                )
+                if koi_out is not None:
+                    queue.put_nowait(("koi", koi_out.model_dump()))
+                if fox_out is not None:
+                    if local is not None:
+                        fox_out.risk_flags = merge_risk_flags(fox_out.risk_flags, local.risk_flags)
+                    queue.put_nowait(("fox", fox_out.model_dump()))
+            else:
+                # As in run_collaboration: a failed module is reported, the other still streams
+                failures: Dict[str, Exception] = {}
+                after = ("koi",) if req.strategy == "relay" else ()
+                _, timings = await run_stages([
+                    tolerant(Stage("koi", koi_stage), failures),
+                    tolerant(Stage("fox", fox_stage, after=after), failures),
+                ])
+                timings["total"] = round((time.perf_counter() - start) * 1000.0, 2)
+                if len(failures) == 2:
+                    raise failures["koi"]
+                errors = {module: describe_failure(e) for module, e in failures.items()}
+            meta = AnalysisMeta(
+                strategy=req.strategy,
+                timings_ms=timings,
+                compaction=compaction,
+                errors=errors,
+                koi_source=local.source if local else None,
+            )
+            queue.put_nowait(("done", meta.model_dump()))
+        except Exception as e:
+            queue.put_nowait(("error", {"detail": str(e)}))
+
+    with call_options(
+        bypass_cache=req.no_cache, deadline=analysis_deadline(), session=req.session_id, knobs=request_knobs(req)
+    ):
+        task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await queue.get()
+            yield event
+            if event[0] in ("done", "error"):
+                return
+    finally:
+        # Client went away (or we finished): stop any outstanding LLM calls
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+# Batch items queue behind interactive requests for LLM quota (admission priority, lower first)
+BATCH_PRIORITY = 10
+
+
+def batch_concurrency(requested: Optional[int] = None) -> int:
+    """
+    Items of one batch analyzed at once: BATCH_CONCURRENCY (default 4), which
+    also caps what a request may ask for.
+    """
+    limit = max(1, int(os.getenv("BATCH_CONCURRENCY", "4")))
+    return min(requested or limit, limit)
+
+
+async def run_batch_v2(
+    req: AnalyzeBatchRequest,
+    llm: LLMProvider,
+    compactor: Optional[ContextCompactor] = None,
+) -> AsyncIterator[Tuple[int, Union[AnalyzeResponseV2, Exception]]]:
+    """
+    Analyzes every item of a batch against the shared conversation and goal spec.
+    Yields (item index, response or the exception it failed with) in completion order.
+
+    The conversation is compacted and the shared part of the payload built once;
+    items then fan out with bounded concurrency, each with its own deadline
+    (the compaction has one of its own; if it fails, every item fails with its error).
+    """
+    try:
+        with call_options(
+            bypass_cache=req.no_cache, deadline=analysis_deadline(), session=req.session_id, priority=BATCH_PRIORITY
+        ):
+            with stage_timer("compaction"):
+                conversation, compaction = await within_deadline(
+                    compact_conversation(compactor, req.conversation), "compaction"
+                )
+    except Exception as e:
+        for index in range(len(req.items)):
+            yield index, e
+        return
+    with stage_timer("payload_build"):
+        context = _context_block_v2(req.goal_spec, conversation)
+
+    limit = asyncio.Semaphore(batch_concurrency(req.concurrency))
 
-    koi_out = KoiOutputV2(**koi_json)
-    fox_out = FoxOutput(**fox_json)
+    async def run_item(index: int) -> Tuple[int, Union[AnalyzeResponseV2, Exception]]:
+        item = req.items[index]
+        async with limit:
+            try:
+                koi_persona = get_persona(item.koi_persona_id or req.koi_persona_id)
+                fox_persona = get_persona(item.fox_persona_id or req.fox_persona_id)
+                payload = context + _draft_block_v2(item.user_draft or req.user_draft, req)
+                return index, await _analyze_payload_v2(
+                    req, llm, koi_persona, fox_persona, payload, compaction, analysis_deadline(), BATCH_PRIORITY
+                )
+            except Exception as e:
+                return index, e
 
-    return AnalyzeResponseV2(koi=koi_out, fox=fox_out)
+    tasks = [asyncio.create_task(run_item(i)) for i in range(len(req.items))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away (or we finished): stop the items still queued or running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
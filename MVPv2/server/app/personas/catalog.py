@@ -0,0 +1,232 @@
+from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .registry import BUILTIN_IDS, Persona, list_personas, load_persona_dir, register_personas
+from ..schemas import PersonaItem, PersonaListResponse
+
+log = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _encode_cursor(key: Tuple[int, str]) -> str:
+    return base64.urlsafe_b64encode(f"{key[0]}:{key[1]}".encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        rank, pid = raw.split(":", 1)
+        return int(rank), pid
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+@dataclass
+class Page:
+    body: bytes
+    etag: str
+
+
+@dataclass
+class _Snapshot:
+    """
+    Immutable view of the catalog: personas in listing order plus an inverted
+    index (module -> positions, token -> positions) and the serialized pages
+    served from it so far.
+    """
+    personas: List[Persona]
+    keys: List[Tuple[int, str]]
+    by_module: Dict[str, FrozenSet[int]]
+    postings: Dict[str, FrozenSet[int]]
+    vocabulary: List[str]
+    generation: int
+    pages: "OrderedDict[Tuple, Page]" = field(default_factory=OrderedDict)
+
+    @classmethod
+    def build(cls, personas: List[Persona], generation: int) -> "_Snapshot":
+        # Built-ins first in registry order, then trained personas by id
+        builtin_rank = {pid: i for i, pid in enumerate(p.id for p in personas if p.id in BUILTIN_IDS)}
+        ordered = sorted(personas, key=lambda p: (builtin_rank.get(p.id, len(builtin_rank)), p.id))
+        keys = [(builtin_rank.get(p.id, len(builtin_rank)), p.id) for p in ordered]
+
+        by_module: Dict[str, Set[int]] = {}
+        postings: Dict[str, Set[int]] = {}
+        for pos, p in enumerate(ordered):
+            by_module.setdefault(p.module, set()).add(pos)
+            for token in set(_tokens(f"{p.id} {p.name} {p.description}")):
+                postings.setdefault(token, set()).add(pos)
+        return cls(
+            personas=ordered,
+            keys=keys,
+            by_module={m: frozenset(v) for m, v in by_module.items()},
+            postings={t: frozenset(v) for t, v in postings.items()},
+            vocabulary=sorted(postings),
+            generation=generation,
+        )
+
+    def _prefix_matches(self, token: str) -> Set[int]:
+        # Every indexed token starting with token ("neg" finds "negotiation")
+        found: Set[int] = set()
+        i = bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(token):
+            found |= self.postings[self.vocabulary[i]]
+            i += 1
+        return found
+
+    def search(self, module: Optional[str], query: Optional[str]) -> List[int]:
+        """
+        Sorted positions matching module and every word of query.
+        """
+        matches: Optional[Set[int]] = None
+        if module:
+            matches = set(self.by_module.get(module, ()))
+        for token in _tokens(query or ""):
+            found = self._prefix_matches(token)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        if matches is None:
+            return list(range(len(self.personas)))
+        return sorted(matches)
+
+
+class PersonaCatalog:
+    """
+    Serves /personas from an indexed snapshot of the registry (built-ins plus
+    personas trained into persona_dir).
+
+    Filtering by module and text search go through the inverted index, pages
+    are addressed by an opaque cursor (the sort key of the last item, so it stays
+    valid across reloads) and each page is serialized once per snapshot together
+    with its ETag. watch() polls persona_dir and swaps in a new snapshot when
+    artifacts are added, changed or removed.
+    """
+
+    def __init__(self, persona_dir: str = "", reload_interval_s: float = 2.0, max_cached_pages: int = 256):
+        self.persona_dir = persona_dir
+        self.reload_interval_s = reload_interval_s
+        self.max_cached_pages = max_cached_pages
+        self._signature: Tuple = ()
+        self._snapshot = _Snapshot.build(list_personas(), generation=0)
+        self.reloads = 0
+        self.page_hits = 0
+        self.page_misses = 0
+
+    @classmethod
+    def from_env(cls) -> "PersonaCatalog":
+        """
+        Env:
+          PERSONA_DIR        directory of trained persona artifacts (default: none)
+          PERSONA_RELOAD_S   how often to check it for changes (default 2; 0 = load once)
+        """
+        raw = os.getenv("PERSONA_RELOAD_S", "").strip()
+        return cls(os.getenv("PERSONA_DIR", "").strip(), reload_interval_s=float(raw) if raw else 2.0)
+
+    def _dir_signature(self) -> Tuple:
+        if not self.persona_dir or not os.path.isdir(self.persona_dir):
+            return ()
+        with os.scandir(self.persona_dir) as entries:
+            stats = [(e.name, e.stat()) for e in entries if e.name.endswith(".json")]
+        return tuple(sorted((name, st.st_mtime_ns, st.st_size) for name, st in stats))
+
+    def reload(self) -> bool:
+        """
+        Re-reads persona_dir if it changed since the last load. Returns whether
+        a new snapshot was installed.
+        """
+        signature = self._dir_signature()
+        if signature == self._signature:
+            return False
+        personas = load_persona_dir(self.persona_dir) if signature else []
+        self._apply(signature, personas)
+        return True
+
+    def _apply(self, signature: Tuple, personas: List[Persona]) -> None:
+        register_personas(personas, replace=True)
+        self._signature = signature
+        self._snapshot = _Snapshot.build(list_personas(), generation=self._snapshot.generation + 1)
+        self.reloads += 1
+        log.info("Persona catalog reloaded: %d personas (generation %d)", len(self), self._snapshot.generation)
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval_s)
+            try:
+                # Disk reads happen off the event loop; the swap itself happens on it
+                signature = await asyncio.to_thread(self._dir_signature)
+                if signature != self._signature:
+                    personas = await asyncio.to_thread(load_persona_dir, self.persona_dir) if signature else []
+                    self._apply(signature, personas)
+            except OSError as e:
+                log.warning("Persona catalog reload failed: %s", e)
+
+    def __len__(self) -> int:
+        return len(self._snapshot.personas)
+
+    def page(self, module: Optional[str] = None, q: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100) -> Page:
+        """
+        One serialized page of the catalog. Raises InvalidCursor.
+        """
+        snap = self._snapshot
+        key = (module, " ".join(_tokens(q or "")), cursor, limit)
+        page = snap.pages.get(key)
+        if page is not None:
+            snap.pages.move_to_end(key)
+            self.page_hits += 1
+            return page
+        self.page_misses += 1
+
+        positions = snap.search(module, q)
+        if cursor:
+            start = bisect_right(snap.keys, _decode_cursor(cursor))
+            positions = positions[bisect_left(positions, start):]
+        selected = positions[:limit]
+        next_cursor = _encode_cursor(snap.keys[selected[-1]]) if len(positions) > limit else None
+
+        response = PersonaListResponse(
+            personas=[
+                PersonaItem(id=p.id, name=p.name, module=p.module, description=p.description)
+                for p in (snap.personas[i] for i in selected)
+            ],
+            next_cursor=next_cursor,
+        )
+        body = response.model_dump_json().encode("utf-8")
+        page = Page(body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"')
+        snap.pages[key] = page
+        if len(snap.pages) > self.max_cached_pages:
+            snap.pages.popitem(last=False)
+        return page
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "personas": len(self),
+            "generation": self._snapshot.generation,
+            "reloads": self.reloads,
+            "page_hits": self.page_hits,
+            "page_misses": self.page_misses,
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
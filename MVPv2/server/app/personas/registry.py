@@ -1,7 +1,15 @@
-from dataclasses import dataclass
-from typing import Dict, List, Literal
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Dict, Iterable, List, Literal, Tuple
 
-Module = Literal["koi", "fox"]
+log = logging.getLogger(__name__)
+
+# "fused" personas (fuse_personas) are built on the fly and never listed
+Module = Literal["koi", "fox", "fused"]
 
 
 @dataclass(frozen=True)
@@ -102,6 +110,9 @@ PERSONAS: Dict[str, Persona] = {
 }
 
 
+BUILTIN_IDS = frozenset(PERSONAS)
+
+
 def list_personas() -> List[Persona]:
     return list(PERSONAS.values())
 
@@ -110,3 +121,205 @@ def get_persona(persona_id: str) -> Persona:
     if persona_id not in PERSONAS:
         raise KeyError(f"Unknown persona_id: {persona_id}")
     return PERSONAS[persona_id]
+
+
+# -----------------------
+# TRAINED PERSONA ARTIFACTS (see personas/training.py)
+
+ARTIFACT_FORMAT = "foxkoi.persona"
+ARTIFACT_FORMAT_VERSION = 1
+
+# Output rules shared by every persona of a module
+OUTPUT_RULES: Dict[str, str] = {
+    "koi": (
+        "STRICT OUTPUT: Return JSON only with EXACT fields:\n"
+        "goal, goal_alignment, topic_drift, missing_info, next_move, summary_so_far.\n"
+        "No extra keys. No commentary. No markdown."
+    ),
+    "fox": (
+        "STRICT OUTPUT: Return JSON only with EXACT fields:\n"
+        "detected_emotion, power_dynamic, risk_flags, reply_options.\n"
+        "reply_options is a list of objects with EXACT fields: tag, text, why.\n"
+        "No extra keys. No commentary. No markdown."
+    ),
+}
+
+# Ids that can name an artifact file (<id>@v<version>.json); others are never loaded
+ARTIFACT_ID = re.compile(r"^[A-Za-z0-9_\-]+$")
+_ARTIFACT_NAME = re.compile(r"^(?P<id>[A-Za-z0-9_\-]+)@v(?P<version>\d+)\.json$")
+
+
+def load_persona_artifact(path: str) -> Tuple[Persona, int]:
+    """
+    (persona, version) from an artifact file. Raises ValueError if it is not a
+    persona artifact this version of the server understands.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != ARTIFACT_FORMAT or data.get("format_version") != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"{path}: not a {ARTIFACT_FORMAT} v{ARTIFACT_FORMAT_VERSION} artifact")
+    if data.get("module") not in ("koi", "fox"):
+        raise ValueError(f"{path}: unknown module {data.get('module')!r}")
+    persona = Persona(
+        id=str(data["id"]),
+        name=str(data["name"]),
+        module=data["module"],
+        description=str(data.get("description", "")),
+        system_prompt=str(data["system_prompt"]),
+    )
+    return persona, int(data.get("version", 1))
+
+
+def load_persona_dir(directory: str) -> List[Persona]:
+    """
+    The newest version of every persona artifact (<id>@v<N>.json) in directory.
+    Unreadable artifacts are logged and skipped.
+    """
+    newest: Dict[str, Tuple[int, str]] = {}
+    for filename in sorted(os.listdir(directory)):
+        m = _ARTIFACT_NAME.match(filename)
+        if m is None:
+            continue
+        version = int(m.group("version"))
+        if version > newest.get(m.group("id"), (0, ""))[0]:
+            newest[m.group("id")] = (version, os.path.join(directory, filename))
+
+    personas = []
+    for _, path in newest.values():
+        try:
+            personas.append(load_persona_artifact(path)[0])
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Skipping persona artifact %s: %s", path, e)
+    return personas
+
+
+def register_personas(personas: Iterable[Persona], replace: bool = False) -> int:
+    """
+    Adds (or replaces) trained personas; built-in ids cannot be overridden.
+    With replace=True, trained personas not in personas are removed.
+    Returns how many were registered.
+    """
+    personas = list(personas)
+    if replace:
+        keep = {p.id for p in personas}
+        for pid in [pid for pid in PERSONAS if pid not in BUILTIN_IDS and pid not in keep]:
+            del PERSONAS[pid]
+    count = 0
+    for p in personas:
+        if p.id in BUILTIN_IDS:
+            log.warning("Persona artifact %s would shadow a built-in persona; ignored", p.id)
+            continue
+        PERSONAS[p.id] = p
+        count += 1
+    return count
+
+
+# -----------------------
+# OUTPUT FIELDS (one persona, several schemas)
+
+@lru_cache(maxsize=64)
+def with_output_fields(persona: Persona, fields: Tuple[str, ...]) -> Persona:
+    """
+    The persona with its output rules asking for exactly fields, e.g. v1's
+    KoiOutput (goal_confidence) from a Koi prompt written for KoiOutputV2
+    (goal_alignment). Unchanged if it already asks for them or has no rules.
+    """
+    head, sep, _ = persona.system_prompt.partition("STRICT OUTPUT:")
+    if not sep:
+        return persona
+    prompt = (
+        f"{head}STRICT OUTPUT: Return JSON only with EXACT fields:\n"
+        f"{', '.join(fields)}.\n"
+        "No extra keys. No commentary. No markdown."
+    )
+    return persona if prompt == persona.system_prompt else replace(persona, system_prompt=prompt)
+
+
+# -----------------------
+# FUSED (Koi + Fox in one call)
+
+def _split_output_rules(system_prompt: str) -> Tuple[str, str]:
+    """
+    (role and style, output rules) of a persona prompt; the rules start at "STRICT OUTPUT:".
+    """
+    head, sep, rules = system_prompt.partition("STRICT OUTPUT:")
+    if not sep:
+        return system_prompt.strip(), ""
+    rules = rules.replace("Return JSON only with EXACT fields:", "Fields:")
+    rules = rules.replace("No extra keys. No commentary. No markdown.", "")
+    return head.strip(), rules.strip()
+
+
+@lru_cache(maxsize=64)
+def fuse_personas(koi: Persona, fox: Persona) -> Persona:
+    """
+    One persona that answers as both koi and fox, so the conversation and draft
+    are sent once instead of twice. Its output is {"koi": {...}, "fox": {...}}.
+    """
+    koi_role, koi_rules = _split_output_rules(koi.system_prompt)
+    fox_role, fox_rules = _split_output_rules(fox.system_prompt)
+    return Persona(
+        id=f"{koi.id}+{fox.id}",
+        name=f"{koi.name} + {fox.name}",
+        module="fused",
+        description=f"{koi.description} / {fox.description}",
+        system_prompt=(
+            "You run two modules in a single pass and answer for both.\n\n"
+            "[MODULE koi]\n"
+            f"{koi_role}\n"
+            f"{koi_rules}\n\n"
+            "[MODULE fox]\n"
+            f"{fox_role}\n"
+            f"{fox_rules}\n\n"
+            "STRICT OUTPUT: Return one JSON object with EXACT keys: koi, fox.\n"
+            "koi holds the koi module's fields, fox holds the fox module's fields.\n"
+            "No extra keys. No commentary. No markdown."
+        ),
+    )
+
+
+# Reply styles Fox writes one option for, each as its own call in fan-out mode
+REPLY_STYLES: Tuple[str, ...] = ("Clearer", "Warmer", "More assertive")
+
+
+@lru_cache(maxsize=64)
+def fox_analysis_persona(fox: Persona) -> Persona:
+    """
+    The fox persona's reading of the situation only (emotion, power dynamic,
+    risks), for fan-out mode where the reply options are separate calls.
+    """
+    role, _ = _split_output_rules(fox.system_prompt)
+    return Persona(
+        id=f"{fox.id}#analysis",
+        name=f"{fox.name} (analysis)",
+        module="fox",
+        description=fox.description,
+        system_prompt=(
+            f"{role}\n\n"
+            "For this call only read the situation; the reply options are written separately.\n\n"
+            "STRICT OUTPUT: Return JSON only with EXACT fields:\n"
+            "detected_emotion, power_dynamic, risk_flags.\n"
+            "No extra keys. No commentary. No markdown."
+        ),
+    )
+
+
+@lru_cache(maxsize=256)
+def fox_style_persona(fox: Persona, style: str) -> Persona:
+    """
+    The fox persona writing the one reply option of the given style (fan-out mode).
+    """
+    role, _ = _split_output_rules(fox.system_prompt)
+    return Persona(
+        id=f"{fox.id}#{style}",
+        name=f"{fox.name} ({style})",
+        module="fox",
+        description=fox.description,
+        system_prompt=(
+            f"{role}\n\n"
+            f"Write ONE short reply option for the user's draft in this style: {style}.\n\n"
+            "STRICT OUTPUT: Return JSON only with EXACT fields: tag, text, why.\n"
+            f'tag is "{style}"; why is one sentence.\n'
+            "No extra keys. No commentary. No markdown."
+        ),
+    )
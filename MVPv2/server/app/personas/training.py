@@ -0,0 +1,352 @@
+"""
+Offline persona training: turns chat-history exports into a versioned persona
+artifact that registry.load_persona_dir() can load.
+
+    python -m app.personas.training exports/*.txt --speaker "Me" --module fox \
+        --id fox_custom_me --name "Fox · Me" --out-dir persona_artifacts --workers 4
+
+Exports are read line by line in fixed-size batches, so memory stays bounded
+whatever the file size. Supported lines:
+  Speaker: text
+  [2024-05-01 09:30] Speaker: text          (also "2024-05-01 09:30 - Speaker: text")
+  {"speaker": "...", "text": "...", "ts": "2024-05-01T09:30:00" or epoch seconds}
+Lines that match none of these continue the previous message.
+
+Per-speaker statistics are accumulated with NumPy over each batch; files are
+processed in parallel by a process pool and their accumulators merged.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .registry import ARTIFACT_FORMAT, ARTIFACT_FORMAT_VERSION, ARTIFACT_ID, OUTPUT_RULES, Module
+
+BATCH_MESSAGES = 20_000
+
+HEDGES = (
+    "maybe", "perhaps", "i think", "i guess", "probably", "might", "kind of", "sort of",
+    "possibly", "not sure", "i feel", "seems", "could be", "if possible",
+)
+ASSERTIVES = (
+    "must", "need to", "definitely", "clearly", "will", "now", "never", "always",
+    "have to", "absolutely", "certainly", "let's", "do it", "no way",
+)
+
+# Response latency histogram: log-spaced bucket edges from 1s to 2 days
+LATENCY_EDGES = np.logspace(0, np.log10(172_800), 48)
+# A gap longer than this starts a new conversation rather than being a slow reply
+MAX_REPLY_GAP_S = 12 * 3600
+
+_TS = r"(?P<ts>\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?)"
+_LINE_RE = re.compile(rf"^\s*(?:\[?{_TS}\]?\s*(?:-\s*)?)?(?P<speaker>[^:\[\]{{}}\n]{{1,40}}):\s?(?P<text>.*)$")
+
+
+def _terms_re(terms: Sequence[str]) -> "re.Pattern[str]":
+    return re.compile(r"\b(?:" + "|".join(re.escape(t).replace(r"\ ", r"\s+") for t in terms) + r")\b")
+
+
+_HEDGES_RE = _terms_re(HEDGES)
+_ASSERTIVES_RE = _terms_re(ASSERTIVES)
+_QUESTION_RE = re.compile(r"\?")
+_EXCLAMATION_RE = re.compile("!")
+
+
+def _parse_ts(raw: Any) -> float:
+    if raw is None or raw == "":
+        return float("nan")
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    try:
+        return datetime.fromisoformat(str(raw).replace("T", " ")).timestamp()
+    except ValueError:
+        return float("nan")
+
+
+def iter_messages(path: str) -> Iterator[Tuple[str, str, float]]:
+    """
+    (speaker, text, unix timestamp or nan) for each message of an export, streamed.
+    """
+    pending: Optional[List[Any]] = None
+    with open(path, "r", encoding="utf-8", errors="replace", buffering=1 << 20) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            message = None
+            if line.lstrip().startswith("{"):
+                try:
+                    obj = json.loads(line)
+                    message = [
+                        str(obj.get("speaker") or obj.get("author") or ""),
+                        str(obj.get("text") or obj.get("message") or ""),
+                        _parse_ts(obj.get("ts") or obj.get("timestamp")),
+                    ]
+                except (json.JSONDecodeError, AttributeError):
+                    message = None
+            if message is None:
+                m = _LINE_RE.match(line)
+                if m is not None:
+                    message = [m.group("speaker").strip(), m.group("text"), _parse_ts(m.group("ts"))]
+            if message is None:
+                if pending is not None:
+                    pending[1] += "\n" + line  # continuation of a multi-line message
+                continue
+            if pending is not None:
+                yield pending[0], pending[1], pending[2]
+            pending = message
+    if pending is not None:
+        yield pending[0], pending[1], pending[2]
+
+
+def _match_counts(pattern: "re.Pattern[str]", joined: str, starts: np.ndarray) -> np.ndarray:
+    # One scan over the whole batch; each match is attributed to the message it starts in
+    positions = np.fromiter((m.start() for m in pattern.finditer(joined)), dtype=np.int64)
+    owners = np.searchsorted(starts, positions, side="right") - 1
+    return np.bincount(owners, minlength=len(starts)).astype(np.float64)
+
+
+@dataclass
+class StyleAccumulator:
+    """
+    Mergeable per-speaker sums. Everything is a plain sum or histogram, so
+    accumulators from different batches, files and processes simply add up.
+    """
+    speakers: Dict[str, int] = field(default_factory=dict)
+    sums: np.ndarray = field(default_factory=lambda: np.zeros((0, 8)))
+    latency_hist: np.ndarray = field(default_factory=lambda: np.zeros((0, len(LATENCY_EDGES) + 1)))
+    bytes_read: int = 0
+    # Last message of the previous batch, for reply latency across batch boundaries
+    _last: Tuple[int, float] = (-1, float("nan"))
+
+    # Columns of sums
+    COLUMNS = ("messages", "chars", "chars_sq", "words", "questions", "exclamations", "hedges", "assertives")
+
+    def _speaker_ids(self, names: Sequence[str]) -> np.ndarray:
+        ids = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            sid = self.speakers.get(name)
+            if sid is None:
+                sid = self.speakers[name] = len(self.speakers)
+            ids[i] = sid
+        grow = len(self.speakers) - len(self.sums)
+        if grow > 0:
+            self.sums = np.vstack([self.sums, np.zeros((grow, self.sums.shape[1]))])
+            self.latency_hist = np.vstack([self.latency_hist, np.zeros((grow, self.latency_hist.shape[1]))])
+        return ids
+
+    def add_batch(self, batch: List[Tuple[str, str, float]]) -> None:
+        if not batch:
+            return
+        names, texts, stamps = zip(*batch)
+        ids = self._speaker_ids(names)
+        n = len(self.speakers)
+        # The batch as one lowercased string, so each term list is a single regex scan
+        lowered = [t.lower() for t in texts]
+        chars = np.fromiter(map(len, texts), dtype=np.float64, count=len(texts))
+        lengths = np.fromiter(map(len, lowered), dtype=np.int64, count=len(texts))
+        starts = np.concatenate([[0], np.cumsum(lengths[:-1] + 1)])
+        joined = "\x00".join(lowered)
+        words = np.fromiter((len(t.split()) for t in texts), dtype=np.float64, count=len(texts))
+        columns = (
+            np.ones(len(ids)),
+            chars,
+            chars * chars,
+            words,
+            (_match_counts(_QUESTION_RE, joined, starts) > 0).astype(np.float64),
+            (_match_counts(_EXCLAMATION_RE, joined, starts) > 0).astype(np.float64),
+            _match_counts(_HEDGES_RE, joined, starts),
+            _match_counts(_ASSERTIVES_RE, joined, starts),
+        )
+        for col, values in enumerate(columns):
+            self.sums[:, col] += np.bincount(ids, weights=values, minlength=n)
+
+        # Reply latency: time since the previous message when the speaker changed
+        ts = np.concatenate([[self._last[1]], np.array(stamps, dtype=np.float64)])
+        who = np.concatenate([[self._last[0]], ids])
+        gaps = np.diff(ts)
+        replies = (who[1:] != who[:-1]) & (who[:-1] >= 0) & np.isfinite(gaps) & (gaps >= 0) & (gaps <= MAX_REPLY_GAP_S)
+        if replies.any():
+            buckets = np.searchsorted(LATENCY_EDGES, gaps[replies])
+            np.add.at(self.latency_hist, (ids[replies], buckets), 1)
+        self._last = (int(ids[-1]), float(stamps[-1]))
+
+    def merge(self, other: "StyleAccumulator") -> None:
+        order = sorted(other.speakers, key=other.speakers.get)
+        ids = self._speaker_ids(order)
+        self.sums[ids] += other.sums
+        self.latency_hist[ids] += other.latency_hist
+        self.bytes_read += other.bytes_read
+
+    def summary(self, speaker: str) -> Dict[str, float]:
+        row = dict(zip(self.COLUMNS, self.sums[self.speakers[speaker]]))
+        count = max(row["messages"], 1.0)
+        words = max(row["words"], 1.0)
+        mean_chars = row["chars"] / count
+        hist = self.latency_hist[self.speakers[speaker]]
+        out = {
+            "messages": int(row["messages"]),
+            "mean_chars": round(mean_chars, 1),
+            "std_chars": round(float(np.sqrt(max(row["chars_sq"] / count - mean_chars ** 2, 0.0))), 1),
+            "mean_words": round(row["words"] / count, 1),
+            "question_rate": round(row["questions"] / count, 3),
+            "exclamation_rate": round(row["exclamations"] / count, 3),
+            "hedges_per_100_words": round(100.0 * row["hedges"] / words, 2),
+            "assertives_per_100_words": round(100.0 * row["assertives"] / words, 2),
+            "replies_timed": int(hist.sum()),
+        }
+        if hist.sum():
+            cdf = np.cumsum(hist) / hist.sum()
+            upper = np.append(LATENCY_EDGES, LATENCY_EDGES[-1])
+            out["reply_latency_p50_s"] = round(float(upper[np.searchsorted(cdf, 0.5)]), 1)
+            out["reply_latency_p90_s"] = round(float(upper[np.searchsorted(cdf, 0.9)]), 1)
+        return out
+
+    def top_speaker(self) -> str:
+        return max(self.speakers, key=lambda s: self.sums[self.speakers[s], 0])
+
+
+def accumulate_file(path: str, batch_messages: int = BATCH_MESSAGES) -> StyleAccumulator:
+    acc = StyleAccumulator()
+    batch: List[Tuple[str, str, float]] = []
+    for message in iter_messages(path):
+        batch.append(message)
+        if len(batch) >= batch_messages:
+            acc.add_batch(batch)
+            batch = []
+    acc.add_batch(batch)
+    acc.bytes_read = os.path.getsize(path)
+    return acc
+
+
+def accumulate(paths: Sequence[str], workers: int = 1) -> StyleAccumulator:
+    """
+    Accumulates every file, in parallel across files when workers > 1.
+    """
+    total = StyleAccumulator()
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for acc in pool.map(accumulate_file, paths):
+                total.merge(acc)
+    else:
+        for path in paths:
+            total.merge(accumulate_file(path))
+    return total
+
+
+def _style_line(stats: Dict[str, float]) -> str:
+    traits = []
+    traits.append("concise, short messages" if stats["mean_words"] < 12 else "fuller, explanatory messages")
+    if stats["question_rate"] >= 0.3:
+        traits.append("leads with questions")
+    if stats["hedges_per_100_words"] > stats["assertives_per_100_words"] * 1.5:
+        traits.append("soft, tentative wording")
+    elif stats["assertives_per_100_words"] > stats["hedges_per_100_words"] * 1.5:
+        traits.append("direct, assertive wording")
+    else:
+        traits.append("balanced between firm and gentle")
+    if stats["exclamation_rate"] >= 0.2:
+        traits.append("energetic tone")
+    latency = stats.get("reply_latency_p50_s")
+    if latency is not None:
+        traits.append("replies quickly" if latency < 120 else "takes time before replying")
+    return ", ".join(traits)
+
+
+_RESPONSIBILITY = {
+    "koi": "define the conversation goal, detect topic drift, and propose the next move",
+    "fox": "analyze emotion/power dynamics and propose reply options written the way this user writes",
+}
+
+
+def build_artifact(
+    stats: Dict[str, float],
+    persona_id: str,
+    name: str,
+    module: Module,
+    version: int,
+    sources: Sequence[str],
+) -> Dict[str, Any]:
+    style = _style_line(stats)
+    return {
+        "format": ARTIFACT_FORMAT,
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "id": persona_id,
+        "version": version,
+        "name": name,
+        "module": module,
+        "description": f"Trained from {stats['messages']} messages: {style}.",
+        "system_prompt": (
+            f"You are [{module.upper()} · {name}].\n"
+            f"Primary responsibility: {_RESPONSIBILITY[module]}.\n"
+            f"Style: {style}. Typical message length about {stats['mean_words']:g} words.\n\n"
+            f"{OUTPUT_RULES[module]}"
+        ),
+        "style": stats,
+        "sources": [os.path.basename(p) for p in sources],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_artifact(artifact: Dict[str, Any], out_dir: str) -> str:
+    if not ARTIFACT_ID.match(artifact["id"]):
+        raise ValueError(f"Invalid persona id {artifact['id']!r}: use letters, digits, _ and -")
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{artifact['id']}@v{artifact['version']}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def next_version(out_dir: str, persona_id: str) -> int:
+    pattern = re.compile(rf"^{re.escape(persona_id)}@v(\d+)\.json$")
+    versions = [int(m.group(1)) for m in map(pattern.match, os.listdir(out_dir) if os.path.isdir(out_dir) else []) if m]
+    return max(versions, default=0) + 1
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Train a persona artifact from chat-history exports")
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--speaker", help="whose style to learn (default: the most active speaker)")
+    ap.add_argument("--module", choices=["koi", "fox"], default="fox")
+    ap.add_argument("--id", dest="persona_id")
+    ap.add_argument("--name")
+    ap.add_argument("--out-dir", default="persona_artifacts")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+    # The id names the artifact file: anything else could escape --out-dir or never be loaded
+    if args.persona_id is not None and not ARTIFACT_ID.match(args.persona_id):
+        ap.error(f"--id {args.persona_id!r}: use letters, digits, _ and - only")
+
+    start = time.perf_counter()
+    acc = accumulate(args.paths, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    if not acc.speakers:
+        raise SystemExit("No messages found")
+    speaker = args.speaker or acc.top_speaker()
+    if speaker not in acc.speakers:
+        raise SystemExit(f"Speaker {speaker!r} not found; speakers: {sorted(acc.speakers)[:20]}")
+
+    slug = re.sub(r"[^a-z0-9]+", "_", speaker.lower()).strip("_") or "user"
+    persona_id = args.persona_id or f"{args.module}_custom_{slug}"
+    name = args.name or f"{speaker} (trained)"
+    artifact = build_artifact(
+        acc.summary(speaker), persona_id, name, args.module, next_version(args.out_dir, persona_id), args.paths
+    )
+    path = write_artifact(artifact, args.out_dir)
+    mb = acc.bytes_read / 1e6
+    print(f"{path}: {artifact['style']['messages']} messages of {speaker!r}; {mb:.1f} MB in {elapsed:.2f}s ({mb / elapsed:.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
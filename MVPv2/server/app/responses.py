@@ -0,0 +1,39 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any, Mapping, Optional, Type
+
+from pydantic import BaseModel, TypeAdapter
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+
+
+@lru_cache(maxsize=None)
+def adapter_for(model: Type[BaseModel]) -> TypeAdapter:
+    # Built once per response type; its serializer is compiled by pydantic-core
+    return TypeAdapter(model)
+
+
+class ModelResponse(Response):
+    """
+    JSON response for an already validated model, written straight to bytes by
+    pydantic-core.
+
+    Returning a Response from a route skips FastAPI's response_model handling
+    (validate again, convert to a dict, json.dumps), while the response_model
+    on the route still documents the schema in OpenAPI. Only return models whose
+    parts were validated when they were built.
+    """
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: BaseModel,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        super().__init__(content, status_code, headers, self.media_type, background)
+
+    def render(self, content: Any) -> bytes:
+        return adapter_for(type(content)).dump_json(content)
@@ -1,10 +1,21 @@
-from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import ClassVar, Dict, List, Literal, Optional
+
+# Koi/Fox collaboration modes, see engine.py
+Strategy = Literal["centralised", "relay", "solo"]
+FoxMode = Literal["single", "fanout"]
 
 
 class AnalyzeRequest(BaseModel):
     session_id: str = Field(default="demo")
-    conversation: str = Field(..., description="Recent conversation context (pasted by user)")
+    conversation: Optional[str] = Field(
+        default=None,
+        description="Recent conversation context (pasted by user); starts/restarts the session",
+    )
+    conversation_delta: Optional[str] = Field(
+        default=None,
+        description="Only the new turns since the last request of this session",
+    )
     user_draft: str = Field(..., description="User's message draft to be optimized")
 
     # NOTE: carp -> koi
@@ -15,6 +26,9 @@ class AnalyzeRequest(BaseModel):
     interruptiveness: float = Field(default=0.3, ge=0.0, le=1.0)
     structure_strength: float = Field(default=0.6, ge=0.0, le=1.0)
 
+    strategy: Strategy = Field(default="centralised", description="How Koi and Fox collaborate")
+    no_cache: bool = Field(default=False, description="Skip cached LLM responses for this request")
+
 
 class KoiOutput(BaseModel):
     goal: str
@@ -24,12 +38,26 @@ class KoiOutput(BaseModel):
     next_move: str
     summary_so_far: List[str]
 
+    # Fields that must not be empty for the output to be usable (see llm/repair.py)
+    content_fields: ClassVar[tuple] = ("goal", "next_move")
+
 
 class ReplyOption(BaseModel):
     tag: str
     text: str
     why: str
 
+    content_fields: ClassVar[tuple] = ("text",)
+
+
+class FoxAnalysis(BaseModel):
+    """
+    Fox's reading of the situation without reply options (fan-out mode's shared call).
+    """
+    detected_emotion: str
+    power_dynamic: str
+    risk_flags: List[str]
+
 
 class FoxOutput(BaseModel):
     detected_emotion: str
@@ -37,10 +65,40 @@ class FoxOutput(BaseModel):
     risk_flags: List[str]
     reply_options: List[ReplyOption]
 
+    content_fields: ClassVar[tuple] = ("reply_options",)
+
+
+class CompactionReport(BaseModel):
+    compacted: bool
+    tokens_before: int = Field(..., description="Estimated conversation tokens per prompt before compaction")
+    tokens_after: int
+    est_cost_before_usd: float = Field(..., description="Estimated input cost of the conversation, per LLM call")
+    est_cost_after_usd: float
+    turns_total: int = 0
+    turns_verbatim: int = 0
+    summaries: int = 0
+    summary_calls: int = 0
+    summary_cache_hits: int = 0
+
+
+class AnalysisMeta(BaseModel):
+    strategy: Strategy
+    timings_ms: Dict[str, float] = Field(default_factory=dict, description="Elapsed time per stage, plus total")
+    compaction: Optional[CompactionReport] = None
+    errors: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Modules that failed or missed the deadline (their output is null), with the reason",
+    )
+    koi_source: Optional[Literal["llm", "local", "reused"]] = Field(
+        default=None,
+        description="Who answered Koi when not always the LLM: local analyzer (LOCAL_KOI=tiered) or reused (live drafting)",
+    )
+
 
 class AnalyzeResponse(BaseModel):
-    koi: KoiOutput
-    fox: FoxOutput
+    koi: Optional[KoiOutput] = None
+    fox: Optional[FoxOutput] = None
+    meta: Optional[AnalysisMeta] = None
 
 
 class PersonaItem(BaseModel):
@@ -52,6 +110,7 @@ class PersonaItem(BaseModel):
 
 class PersonaListResponse(BaseModel):
     personas: List[PersonaItem]
+    next_cursor: Optional[str] = Field(default=None, description="Pass as cursor to get the next page; null on the last page")
 
 # V2 add-ons start from here
 class GoalSpec(BaseModel):
@@ -64,18 +123,26 @@ class GoalSpec(BaseModel):
 
 class AnalyzeRequestV2(BaseModel):
     session_id: str = Field(default="demo")
-    conversation: str
+    conversation: Optional[str] = Field(default=None, description="Full conversation; starts/restarts the session")
+    conversation_delta: Optional[str] = Field(default=None, description="Only the new turns since the last request")
     user_draft: str
 
     koi_persona_id: str
     fox_persona_id: str
 
-    goal_spec: GoalSpec
+    goal_spec: Optional[GoalSpec] = Field(default=None, description="Required once per session")
 
     aggressiveness: float = Field(default=0.5, ge=0.0, le=1.0)
     interruptiveness: float = Field(default=0.3, ge=0.0, le=1.0)
     structure_strength: float = Field(default=0.6, ge=0.0, le=1.0)
 
+    strategy: Strategy = Field(default="centralised", description="How Koi and Fox collaborate")
+    fox_mode: FoxMode = Field(
+        default="single",
+        description="fanout: Fox's situation analysis and each reply style are separate concurrent calls",
+    )
+    no_cache: bool = Field(default=False, description="Skip cached LLM responses for this request")
+
 
 class KoiOutputV2(BaseModel):
     # Koi no longer "guesses" goal; it should restate & track it
@@ -86,7 +153,67 @@ class KoiOutputV2(BaseModel):
     next_move: str
     summary_so_far: List[str]
 
+    content_fields: ClassVar[tuple] = ("goal", "next_move")
+
 
 class AnalyzeResponseV2(BaseModel):
-    koi: KoiOutputV2
-    fox: FoxOutput
\ No newline at end of file
+    koi: Optional[KoiOutputV2] = None
+    fox: Optional[FoxOutput] = None
+    meta: Optional[AnalysisMeta] = None
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = Field(default=None, description="Caller's label for this item, echoed in its result")
+    user_draft: Optional[str] = Field(default=None, description="Defaults to the batch's user_draft")
+    koi_persona_id: Optional[str] = Field(default=None, description="Defaults to the batch's koi_persona_id")
+    fox_persona_id: Optional[str] = Field(default=None, description="Defaults to the batch's fox_persona_id")
+
+
+class AnalyzeBatchRequest(BaseModel):
+    """
+    One shared conversation + goal spec, analyzed for many drafts and/or persona pairs.
+    """
+    session_id: str = Field(default="batch", description="Quota key for admission control; no session state is kept")
+    conversation: str
+    goal_spec: GoalSpec
+
+    user_draft: Optional[str] = None
+    koi_persona_id: Optional[str] = None
+    fox_persona_id: Optional[str] = None
+
+    aggressiveness: float = Field(default=0.5, ge=0.0, le=1.0)
+    interruptiveness: float = Field(default=0.3, ge=0.0, le=1.0)
+    structure_strength: float = Field(default=0.6, ge=0.0, le=1.0)
+
+    strategy: Strategy = Field(default="centralised", description="How Koi and Fox collaborate")
+    fox_mode: FoxMode = Field(
+        default="single",
+        description="fanout: Fox's situation analysis and each reply style are separate concurrent calls",
+    )
+    no_cache: bool = Field(default=False, description="Skip cached LLM responses for this request")
+
+    items: List[BatchItem] = Field(..., min_length=1, max_length=200)
+    concurrency: Optional[int] = Field(default=None, ge=1, description="Items analyzed at once (capped by the server)")
+
+    @model_validator(mode="after")
+    def _items_complete(self) -> "AnalyzeBatchRequest":
+        for i, item in enumerate(self.items):
+            for name in ("user_draft", "koi_persona_id", "fox_persona_id"):
+                if getattr(item, name) is None and getattr(self, name) is None:
+                    raise ValueError(f"items[{i}]: {name} is required (on the item or the batch)")
+        return self
+
+
+class BatchItemError(BaseModel):
+    status: int = Field(..., description="HTTP status the item would have got from /v2/analyze")
+    detail: str
+
+
+class BatchItemResult(BaseModel):
+    """
+    One NDJSON line of /v2/analyze/batch; exactly one of result and error is set.
+    """
+    index: int
+    id: Optional[str] = None
+    result: Optional[AnalyzeResponseV2] = None
+    error: Optional[BatchItemError] = None
@@ -0,0 +1,280 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, one worker per session directory
+    fcntl = None
+
+from .conversation import Turn, parse_turns
+from .schemas import AnalyzeRequest, AnalyzeRequestV2, GoalSpec
+
+Req = TypeVar("Req", AnalyzeRequest, AnalyzeRequestV2)
+
+
+class SessionError(Exception):
+    """
+    A delta request that cannot be applied (unknown or expired session, or
+    changed by another request since it was resolved).
+    """
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    conversation: str = ""
+    turns: List[Turn] = field(default_factory=list)
+    goal_spec: Optional[Dict[str, Any]] = None
+    updated_at: float = field(default_factory=time.time)
+    # Bumped by every committed update
+    version: int = 0
+    # Version this state was resolved from (None: a restart, which replaces any
+    # stored state); not persisted
+    base_version: Optional[int] = None
+
+    def append(self, delta: str) -> int:
+        """
+        Appends new conversation text; only the delta is parsed. Returns the number of new turns.
+        """
+        delta = delta.strip("\n")
+        if not delta.strip():
+            return 0
+        new_turns = parse_turns(delta, previous=self.turns[-1] if self.turns else None)
+        self.conversation = f"{self.conversation}\n{delta}" if self.conversation else delta
+        self.turns.extend(new_turns)
+        return len(new_turns)
+
+    def copy(self) -> "SessionState":
+        return replace(self, turns=list(self.turns))
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        del data["base_version"]
+        return json.dumps(data, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "SessionState":
+        data = json.loads(raw)
+        data["turns"] = [Turn(**t) for t in data.get("turns", [])]
+        # Files written by older versions may carry fields since dropped
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def _needs_write(stored: Optional[SessionState], state: SessionState) -> bool:
+    """
+    Compare-and-swap check for commit: False when state is already stored (e.g.
+    two identical requests shared one analysis); SessionError when the session
+    moved on since state was resolved.
+    """
+    if stored is not None and stored.version == state.version and stored.conversation == state.conversation:
+        return False
+    if state.base_version is not None and (stored is None or stored.version != state.base_version):
+        raise SessionError(
+            f"Session {state.session_id} changed while this request was analyzed. Send the full conversation."
+        )
+    return True
+
+
+class SessionStore:
+    """
+    Keeps per-session conversation state so clients can send only new turns.
+
+    apply() resolves a request against the stored state without changing it;
+    commit() stores the result once the request succeeded. A delta whose
+    analysis failed is therefore not stored, and the client's retry with the
+    same delta does not append it twice.
+    """
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        raise NotImplementedError
+
+    async def put(self, state: SessionState) -> None:
+        raise NotImplementedError
+
+    async def commit(self, state: SessionState) -> None:
+        raise NotImplementedError
+
+    async def apply(self, req: Req) -> Tuple[Req, SessionState]:
+        """
+        Resolves a full or delta request against the stored session.
+
+        - conversation set: the session is (re)started from it
+        - conversation_delta set: the new turns are appended to the stored session
+        - goal_spec (v2) may be omitted once the session has one
+
+        Returns the request with conversation (and goal_spec) filled in, plus the
+        new state to commit() once the request succeeded.
+        """
+        stored = await self.get(req.session_id)
+        if req.conversation is not None:
+            state = SessionState(session_id=req.session_id)
+            state.append(req.conversation)
+        else:
+            if stored is None:
+                raise SessionError(
+                    f"Unknown or expired session_id: {req.session_id}. Send the full conversation."
+                )
+            state = stored.copy()
+            state.base_version = stored.version
+            if req.conversation_delta:
+                state.append(req.conversation_delta)
+        state.version = (stored.version if stored is not None else 0) + 1
+
+        update: Dict[str, Any] = {"conversation": state.conversation, "conversation_delta": None}
+        if isinstance(req, AnalyzeRequestV2):
+            if req.goal_spec is not None:
+                state.goal_spec = req.goal_spec.model_dump()
+            elif state.goal_spec is not None:
+                update["goal_spec"] = GoalSpec(**state.goal_spec)
+            else:
+                raise SessionError("goal_spec is required on the first request of a session")
+
+        state.updated_at = time.time()
+        return req.model_copy(update=update), state
+
+    @staticmethod
+    def from_env() -> "SessionStore":
+        """
+        Env:
+          SESSION_BACKEND     memory | file (default memory)
+          SESSION_DIR         directory for the file backend
+          SESSION_IDLE_TTL_S  evict sessions idle for longer (default 3600): not read or
+                              written (memory), not written (file)
+        """
+        idle = float(os.getenv("SESSION_IDLE_TTL_S", "3600"))
+        if os.getenv("SESSION_BACKEND", "memory").lower() == "file":
+            directory = os.getenv("SESSION_DIR", "").strip() or os.path.join(tempfile.gettempdir(), "foxkoi-sessions")
+            return FileSessionStore(directory, idle_ttl_s=idle)
+        return MemorySessionStore(idle_ttl_s=idle)
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Per-process store. Sessions not read or written for idle_ttl_s are evicted,
+    and past max_sessions the least recently used ones go first.
+    """
+
+    def __init__(self, idle_ttl_s: float = 3600.0, max_sessions: int = 10_000):
+        self.idle_ttl_s = idle_ttl_s
+        self.max_sessions = max_sessions
+        # (last access time, state), least recently used first
+        self._data: "OrderedDict[str, Tuple[float, SessionState]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict(self) -> None:
+        # Entries are ordered by last access, so everything idle is at the head
+        cutoff = time.time() - self.idle_ttl_s
+        while self._data:
+            accessed_at, _ = next(iter(self._data.values()))
+            if accessed_at >= cutoff and len(self._data) <= self.max_sessions:
+                break
+            self._data.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        self._evict()
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        self._data[session_id] = (time.time(), entry[1])
+        self._data.move_to_end(session_id)
+        return entry[1]
+
+    async def put(self, state: SessionState) -> None:
+        self._data[state.session_id] = (time.time(), state)
+        self._data.move_to_end(state.session_id)
+        self._evict()
+
+    async def commit(self, state: SessionState) -> None:
+        # No await between the check and the write: atomic within the process
+        entry = self._data.get(state.session_id)
+        if _needs_write(entry[1] if entry is not None else None, state):
+            await self.put(state)
+
+
+class FileSessionStore(SessionStore):
+    """
+    One JSON file per session in a shared directory, so several uvicorn workers
+    see the same sessions. Writes are atomic (write + rename); commits hold a
+    per-session file lock across check and write, so concurrent workers cannot
+    lose each other's updates. Idle files are treated as missing and removed.
+    """
+
+    def __init__(self, directory: str, idle_ttl_s: float = 3600.0):
+        self.directory = directory
+        self.idle_ttl_s = idle_ttl_s
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str, suffix: str = ".json") -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}{suffix}")
+
+    @contextmanager
+    def _locked(self, session_id: str) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(session_id, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _commit(self, state: SessionState) -> None:
+        with self._locked(state.session_id):
+            if _needs_write(self._read(state.session_id), state):
+                self._write(state)
+
+    def _read(self, session_id: str) -> Optional[SessionState]:
+        path = self._path(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.idle_ttl_s:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return SessionState.from_json(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, state: SessionState) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(state.to_json())
+        os.replace(tmp, self._path(state.session_id))
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        return await asyncio.to_thread(self._read, session_id)
+
+    async def put(self, state: SessionState) -> None:
+        await asyncio.to_thread(self._write, state)
+
+    async def commit(self, state: SessionState) -> None:
+        await asyncio.to_thread(self._commit, state)
+
+    def sweep(self) -> int:
+        """
+        Removes idle session files; returns how many were removed.
+        """
+        removed = 0
+        cutoff = time.time() - self.idle_ttl_s
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
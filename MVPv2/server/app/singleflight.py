@@ -0,0 +1,95 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+from pydantic import BaseModel
+
+
+@dataclass
+class _Call:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+_BLANKS = re.compile(r"[ \t]+")
+
+
+def request_key(req: BaseModel, exclude: Iterable[str] = ("session_id",)) -> str:
+    """
+    Key of an analysis request for coalescing: the request with runs of spaces
+    and tabs collapsed (and trimmed) within each line of every string, minus
+    fields that do not change the result. Line breaks are kept: turns are
+    parsed by line, so they change the result.
+    """
+    def norm(value: Any) -> Any:
+        if isinstance(value, str):
+            return "\n".join(_BLANKS.sub(" ", line).strip() for line in value.splitlines()).strip("\n")
+        if isinstance(value, dict):
+            return {k: norm(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [norm(v) for v in value]
+        return value
+
+    data = norm(req.model_dump(exclude=set(exclude)))
+    blob = json.dumps([type(req).__name__, data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Concurrent do(key, fn) calls with the same key share one execution of fn and
+    all get its result (or exception).
+
+    Cancellation is reference-counted: a waiter that is cancelled (e.g. its client
+    disconnected) just stops waiting; the shared execution is cancelled only when
+    its last waiter is gone.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                # Last waiter gone: nobody wants the result any more
+                call.task.cancel()
+                self.cancelled += 1
+                self._forget(key, call)
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "in_flight": self.in_flight,
+        }
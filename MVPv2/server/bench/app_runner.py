@@ -0,0 +1,55 @@
+"""
+Serves app.main:app unchanged, plus an event-loop lag probe for benchmarks:
+
+  GET  /__bench/loop_lag   lag percentiles (ms) since the last reset
+  POST /__bench/loop_lag   reset the samples
+
+    uvicorn bench.app_runner:app --port 9000
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+from app.main import app as _app
+
+from bench.common import pct
+
+_INTERVAL_S = 0.02
+_samples: List[float] = []
+_monitor: Optional[asyncio.Task] = None
+
+
+async def _watch_loop() -> None:
+    # Lag = how late a short sleep wakes up; it grows when handlers block the loop
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(_INTERVAL_S)
+        _samples.append(max(0.0, (loop.time() - start - _INTERVAL_S) * 1000.0))
+        if len(_samples) > 100_000:
+            del _samples[:50_000]
+
+
+async def _send_json(send, status: int, body: dict) -> None:
+    raw = json.dumps(body).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": raw})
+
+
+async def app(scope, receive, send):
+    global _monitor
+    if _monitor is None and scope["type"] in ("lifespan", "http"):
+        _monitor = asyncio.create_task(_watch_loop())
+
+    if scope["type"] == "http" and scope["path"] == "/__bench/loop_lag":
+        if scope["method"] == "POST":
+            _samples.clear()
+            return await _send_json(send, 200, {"ok": True})
+        return await _send_json(send, 200, {
+            "samples": len(_samples),
+            "p50_ms": round(pct(_samples, 0.50), 3),
+            "p99_ms": round(pct(_samples, 0.99), 3),
+            "max_ms": round(max(_samples, default=0.0), 3),
+        })
+
+    await _app(scope, receive, send)
@@ -0,0 +1,80 @@
+"""
+Cassette store at scale: write rate, lookup latency and bytes per recording
+as the store grows to tens of thousands of recordings. Payloads look like
+real /v2 payloads (same few system prompts, varied conversations).
+
+    python -m bench.cassette_store --recordings 50000 --checkpoints 1000,10000,50000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from app.llm.cassette import CassetteStore, Recording, cassette_key
+from app.llm.provider import MockProvider
+from app.personas.registry import list_personas
+from bench.common import SAMPLE_REQUEST_V2, pct
+
+_WORDS = "price rebate deal volume quarter contract delivery margin discount partner timeline budget".split()
+
+
+def _payload(rng: random.Random) -> str:
+    lines = [f"{rng.choice(['Me', 'Them'])}: " + " ".join(rng.choices(_WORDS, k=rng.randint(6, 24))) for _ in range(12)]
+    return SAMPLE_REQUEST_V2["conversation"] + "\n" + "\n".join(lines)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recordings", type=int, default=50000)
+    ap.add_argument("--checkpoints", default="1000,10000,50000")
+    ap.add_argument("--lookups", type=int, default=5000)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    prompts = [p.system_prompt for p in list_personas()]
+    responses = [MockProvider._koi(), MockProvider._fox()]
+    checkpoints = sorted(int(c) for c in args.checkpoints.split(","))
+    keys = []
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cassette.db")
+        store = CassetteStore(path)
+        written, write_s, raw_bytes = 0, 0.0, 0
+        for target in checkpoints:
+            start = time.perf_counter()
+            while written < min(target, args.recordings):
+                prompt, payload, response = rng.choice(prompts), _payload(rng), rng.choice(responses)
+                store.put("gpt-4o-mini", prompt, payload, Recording(response, 812.5, 900, 260))
+                raw_bytes += len(prompt) + len(payload) + len(json.dumps(response))
+                keys.append(cassette_key("gpt-4o-mini", prompt, payload))
+                written += 1
+            write_s += time.perf_counter() - start
+
+            samples = []
+            for key in rng.sample(keys, min(args.lookups, len(keys))):  # uniform over the whole store
+                t = time.perf_counter()
+                assert store.get(key) is not None
+                samples.append((time.perf_counter() - t) * 1e6)
+            misses = []
+            for i in range(200):
+                t = time.perf_counter()
+                assert store.get(i.to_bytes(32, "big")) is None
+                misses.append((time.perf_counter() - t) * 1e6)
+            store.checkpoint()
+            results.append({
+                "recordings": written,
+                "writes_per_s": round(written / write_s),
+                "lookup_us_p50": round(pct(samples, 0.5), 1),
+                "lookup_us_p99": round(pct(samples, 0.99), 1),
+                "miss_us_p50": round(pct(misses, 0.5), 1),
+                "bytes_per_recording": round(store.size_bytes() / written),
+                "raw_bytes_per_recording": round(raw_bytes / written),
+            })
+        store.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cold start of the app per LLM provider: time to import app.main and run its
+startup (lifespan), plus resident memory afterwards, each in a fresh
+interpreter. "mock+sdk" imports the OpenAI SDK up front, as every worker did
+before providers were loaded lazily.
+
+    python -m bench.cold_start --providers mock,mock+sdk,openai --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+_PROBE = r"""
+import asyncio, json, resource, sys, time
+start = time.perf_counter()
+if PRELOAD_SDK:
+    import openai
+import app.main
+imported = time.perf_counter()
+
+async def startup():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        pass
+
+asyncio.run(startup())
+done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000.0,
+    "startup_ms": (done - imported) * 1000.0,
+    "total_ms": (done - start) * 1000.0,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "openai_loaded": "openai" in sys.modules,
+}))
+"""
+
+
+def _env(provider: str) -> Dict[str, str]:
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.getcwd(),
+        "LLM_WARMUP": "0",  # no network: only imports and object construction are measured
+        "LLM_CACHE": "0",
+        "PERSONA_DIR": "",
+    }
+    if provider == "openai":
+        env.update(LLM_PROVIDER="openai", OPENAI_API_KEY="bench", OPENAI_BASE_URL="http://127.0.0.1:9/v1")
+    else:
+        env.update(LLM_PROVIDER=provider.split("+")[0])
+    return env
+
+
+def _sample(provider: str) -> Dict[str, float]:
+    probe = _PROBE.replace("PRELOAD_SDK", str(provider.endswith("+sdk")))
+    out = subprocess.run(
+        [sys.executable, "-c", probe], env=_env(provider), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--providers", default="mock,mock+sdk,openai")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    results = {}
+    for provider in args.providers.split(","):
+        _sample(provider)  # warm the OS page cache and .pyc files
+        samples: List[Dict[str, float]] = [_sample(provider) for _ in range(args.runs)]
+        results[provider] = {
+            key: round(statistics.median(s[key] for s in samples), 1)
+            for key in ("import_ms", "startup_ms", "total_ms", "max_rss_mb")
+        }
+        results[provider]["openai_loaded"] = samples[0]["openai_loaded"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
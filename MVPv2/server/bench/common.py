@@ -0,0 +1,86 @@
+"""
+Helpers shared by the benchmark scripts: start the OpenAI stub and the app as
+subprocesses, wait for them, and compute percentiles.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+SAMPLE_REQUEST_V2 = {
+    "session_id": "bench",
+    "conversation": (
+        "Opponent boss: The price is non-negotiable 100 per unit.\n"
+        "Me: The price is a little bit too high\n"
+        "Opponent boss: Name your price\n"
+        "Me: Would 50 dollars be fine?\n"
+        "Opponent boss: It's just too high a price I can take\n"
+        "Me: Let's round it up to 75?\n"
+        "Opponent boss: I would still stick with 100, but I can offer you some rebate "
+        "after we done with the first bill transaction."
+    ),
+    "user_draft": "How about 90 with a 0.5 cent rebate per deal?",
+    "koi_persona_id": "koi_entrepreneur_driver",
+    "fox_persona_id": "fox_workplace_leader",
+    "goal_spec": {
+        "goal": "Final price of 90 with a 0.5 cent rebate per deal",
+        "goal_type": "business",
+        "relationship": "client",
+        "constraints": ["Don't push too hard"],
+        "success_criteria": [],
+    },
+}
+
+
+def pct(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def wait_ready(url: str, attempts: int = 100) -> None:
+    async with httpx.AsyncClient() as c:
+        for _ in range(attempts):
+            try:
+                await c.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+@contextmanager
+def serve(target: str, port: int, env: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """
+    Runs `uvicorn <target>` on 127.0.0.1:<port> for the duration of the block.
+    Yields the base URL.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, **(env or {})),
+    )
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def app_env(stub_base: str, **extra: str) -> Dict[str, str]:
+    """
+    Environment that points the app's OpenAIProvider at the stub.
+    """
+    env = {
+        "LLM_PROVIDER": "openai",
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_MODEL": "stub-model",
+        "OPENAI_BASE_URL": f"{stub_base}/v1",
+        "LLM_CACHE": "0",
+    }
+    env.update(extra)
+    return env
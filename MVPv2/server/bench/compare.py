@@ -0,0 +1,52 @@
+"""
+Compares two bench.load result files, row by row (endpoint, concurrency):
+
+    python -m bench.compare base.json head.json [--threshold 0.10]
+
+Exits non-zero when p99 latency or throughput regresses by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def _rows(path: str) -> Dict[Tuple[str, int], dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {(r["endpoint"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("base")
+    ap.add_argument("head")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args()
+
+    base, head = _rows(args.base), _rows(args.head)
+    regressions = 0
+    print(f"{'endpoint':<12} {'c':>4} {'rps':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    for key in sorted(set(base) & set(head)):
+        b, h = base[key], head[key]
+        rps = _change(b["throughput_rps"], h["throughput_rps"])
+        p50 = _change(b["latency_ms"]["p50"], h["latency_ms"]["p50"])
+        p99 = _change(b["latency_ms"]["p99"], h["latency_ms"]["p99"])
+        flag = ""
+        if rps < -args.threshold or p99 > args.threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(
+            f"{key[0]:<12} {key[1]:>4} "
+            f"{h['throughput_rps']:>9} ({rps:+.0%}) {h['latency_ms']['p50']:>9} ({p50:+.0%}) "
+            f"{h['latency_ms']['p99']:>9} ({p99:+.0%}){flag}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Offline evaluation of the v1 and v2 orchestrators over a directory of scenario
+files, with whatever provider the environment selects (LLM_PROVIDER etc.).
+
+    python -m bench.evaluate ../testFiles --versions v1,v2 --strategies centralised,solo \
+        --repeats 3 --concurrency 8 --out eval_report.json
+
+Every (scenario, version, persona pair, strategy, repeat) is one run; runs go
+concurrently. Per run it records wall time, prompt/completion tokens (provider-
+reported, else estimated), payload size, repair attempts, schema validity and
+goal scores. The report is JSON with stable ordering and rounding, so reports
+of two versions or configurations can be diffed; a summary table is printed.
+
+Scenario files look like testFiles/business.txt:
+
+    Goal wizard:
+    1. <goal>
+    2. (<goal type>)
+    3. <constraint>[; <constraint> ...]
+    Relationship: <relationship>        (optional)
+    Draft: <the draft to analyze>       (optional; default: no draft yet)
+
+    <conversation lines>
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.compaction import ContextCompactor, estimate_tokens
+from app.llm.pool import ProviderPool
+from app.llm.provider import LLMProvider
+from app.local_analyzer import LocalAnalyzer
+from app.metrics import tally
+from app.orchestrator import run_analysis
+from app.orchestrator_v2 import run_analysis_v2
+from app.personas.registry import list_personas
+from app.schemas import AnalyzeRequest, AnalyzeRequestV2, GoalSpec
+
+GOAL_TYPES = ("business", "relationship", "conflict_resolution", "small_talk", "other")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+@dataclass
+class Scenario:
+    name: str
+    goal_spec: GoalSpec
+    conversation: str
+    draft: str
+
+
+def parse_scenario(path: str) -> Scenario:
+    goal, goal_type, relationship, constraints, draft = "", "other", "unknown", [], ""
+    conversation: List[str] = []
+    in_wizard = False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.lower().startswith("goal wizard"):
+                in_wizard = True
+                continue
+            step = re.match(r"^(\d)\.\s*(.*)$", line) if in_wizard else None
+            if step is not None:
+                n, value = step.groups()
+                if n == "1":
+                    goal = value
+                elif n == "2":
+                    kind = value.strip("() ").lower().replace(" ", "_")
+                    goal_type = kind if kind in GOAL_TYPES else "other"
+                elif n == "3":
+                    constraints = [c.strip() for c in value.split(";") if c.strip()]
+                continue
+            if line.lower().startswith("relationship:"):
+                relationship = line.split(":", 1)[1].strip()
+            elif line.lower().startswith("draft:"):
+                draft = line.split(":", 1)[1].strip()
+            elif line:
+                in_wizard = False
+                conversation.append(line)
+    return Scenario(
+        name=os.path.splitext(os.path.basename(path))[0],
+        goal_spec=GoalSpec(goal=goal, goal_type=goal_type, relationship=relationship, constraints=constraints),
+        conversation="\n".join(conversation),
+        draft=draft,
+    )
+
+
+class _Metered(LLMProvider):
+    """
+    Per-run view of the shared provider that measures what is sent and received,
+    so token counts are available (estimated) even when the provider reports none.
+    """
+
+    def __init__(self, inner: LLMProvider):
+        self.inner = inner
+        self.calls = 0
+        self.payload_chars = 0
+        self.est_prompt_tokens = 0
+        self.est_completion_tokens = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
+
+    async def generate_json(self, system_prompt: str, user_payload: str) -> Dict[str, Any]:
+        self.calls += 1
+        self.payload_chars += len(system_prompt) + len(user_payload)
+        self.est_prompt_tokens += estimate_tokens(system_prompt) + estimate_tokens(user_payload)
+        result = await self.inner.generate_json(system_prompt, user_payload)
+        self.est_completion_tokens += estimate_tokens(json.dumps(result, ensure_ascii=False))
+        return result
+
+    async def stream_json(self, system_prompt: str, user_payload: str) -> AsyncIterator[str]:
+        async for chunk in self.inner.stream_json(system_prompt, user_payload):
+            yield chunk
+
+
+def _overlap(a: str, b: str) -> float:
+    # Word-set Jaccard similarity: how close the goal Koi states is to the scenario's goal
+    wa, wb = set(_WORD.findall(a.lower())), set(_WORD.findall(b.lower()))
+    return len(wa & wb) / len(wa | wb) if wa | wb else 0.0
+
+
+async def run_once(
+    llm: LLMProvider,
+    analyzer: Optional[LocalAnalyzer],
+    scenario: Scenario,
+    version: str,
+    koi: str,
+    fox: str,
+    strategy: str,
+    repeat: int,
+) -> Dict[str, Any]:
+    metered = _Metered(llm)
+    common = dict(
+        session_id=f"eval-{scenario.name}-{repeat}",
+        conversation=scenario.conversation,
+        user_draft=scenario.draft,
+        koi_persona_id=koi,
+        fox_persona_id=fox,
+        strategy=strategy,
+        no_cache=True,
+    )
+    row: Dict[str, Any] = {
+        "scenario": scenario.name, "version": version, "koi": koi, "fox": fox, "strategy": strategy, "repeat": repeat,
+    }
+    start = time.perf_counter()
+    with tally() as counts:
+        try:
+            compactor = ContextCompactor.from_env(metered)
+            if version == "v1":
+                resp = await run_analysis(AnalyzeRequest(**common), metered, compactor)
+                goal_score = resp.koi.goal_confidence if resp.koi else None
+            else:
+                req = AnalyzeRequestV2(**common, goal_spec=scenario.goal_spec)
+                resp = await run_analysis_v2(req, metered, compactor, analyzer=analyzer)
+                goal_score = resp.koi.goal_alignment if resp.koi else None
+            row.update(
+                ok=True,
+                partial=sorted(resp.meta.errors) if resp.meta and resp.meta.errors else [],
+                goal_score=goal_score,
+                goal_match=_overlap(resp.koi.goal, scenario.goal_spec.goal) if resp.koi else None,
+                topic_drift=resp.koi.topic_drift if resp.koi else None,
+                reply_options=len(resp.fox.reply_options) if resp.fox else 0,
+                koi_source=resp.meta.koi_source if resp.meta and resp.meta.koi_source else "llm",
+            )
+        except Exception as e:
+            row.update(ok=False, error=f"{type(e).__name__}: {e}")
+    row["wall_ms"] = (time.perf_counter() - start) * 1000.0
+
+    reported = counts.tokens
+    row.update(
+        calls=metered.calls,
+        payload_chars=metered.payload_chars,
+        tokens_source="provider" if reported else "estimate",
+        prompt_tokens=reported.get("prompt", metered.est_prompt_tokens),
+        completion_tokens=reported.get("completion", metered.est_completion_tokens),
+        repairs=counts.calls.get("local_repair", 0) + counts.calls.get("llm_repair", 0),
+        validations=sum(counts.validations.values()),
+        valid_as_returned=counts.validations.get("ok", 0),
+    )
+    return row
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    present = [v for v in values if v is not None]
+    return statistics.fmean(present) if present else None
+
+
+def summarize(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault((row["version"], row["koi"], row["fox"], row["strategy"]), []).append(row)
+    summary = []
+    for (version, koi, fox, strategy), group in sorted(groups.items()):
+        ok = [r for r in group if r["ok"]]
+        walls = sorted(r["wall_ms"] for r in group)
+        validations = sum(r["validations"] for r in group)
+        summary.append({
+            "version": version, "koi": koi, "fox": fox, "strategy": strategy,
+            "runs": len(group),
+            "success_rate": len(ok) / len(group),
+            "wall_ms_p50": walls[len(walls) // 2],
+            "wall_ms_max": walls[-1],
+            "prompt_tokens_mean": _mean([r["prompt_tokens"] for r in group]),
+            "completion_tokens_mean": _mean([r["completion_tokens"] for r in group]),
+            "payload_chars_mean": _mean([r["payload_chars"] for r in group]),
+            "calls_mean": _mean([r["calls"] for r in group]),
+            "repairs": sum(r["repairs"] for r in group),
+            "koi_local_rate": sum(r.get("koi_source") == "local" for r in ok) / len(ok) if ok else None,
+            "schema_valid_rate": sum(r["valid_as_returned"] for r in group) / validations if validations else None,
+            "goal_score_mean": _mean([r.get("goal_score") for r in ok]),
+            "goal_match_mean": _mean([r.get("goal_match") for r in ok]),
+        })
+    return summary
+
+
+def _rounded(value: Any) -> Any:
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rounded(v) for v in value]
+    return value
+
+
+def _table(summary: List[Dict[str, Any]]) -> str:
+    cols = ("version", "koi", "fox", "strategy", "runs", "success_rate", "wall_ms_p50", "prompt_tokens_mean",
+            "completion_tokens_mean", "repairs", "koi_local_rate", "schema_valid_rate", "goal_score_mean", "goal_match_mean")
+    lines = ["| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    for s in summary:
+        lines.append("| " + " | ".join("" if s[c] is None else str(_rounded(s[c])) for c in cols) + " |")
+    return "\n".join(lines)
+
+
+def _persona_pairs(spec: str) -> List[Tuple[str, str]]:
+    if spec:
+        return [tuple(pair.split(":", 1)) for pair in spec.split(",")]  # type: ignore[misc]
+    kois = [p.id for p in list_personas() if p.module == "koi"]
+    foxes = [p.id for p in list_personas() if p.module == "fox"]
+    return [(k, f) for k in kois for f in foxes]
+
+
+async def evaluate(args: argparse.Namespace) -> Dict[str, Any]:
+    paths = sorted(
+        os.path.join(args.scenarios, name) for name in os.listdir(args.scenarios) if name.endswith(".txt")
+    ) if os.path.isdir(args.scenarios) else [args.scenarios]
+    scenarios = [parse_scenario(p) for p in paths]
+
+    pool = ProviderPool.from_env()
+    await pool.start()
+    llm = pool.get()
+    # LOCAL_KOI=tiered evaluates v2 with the local Koi fast path
+    analyzer = LocalAnalyzer.from_env()
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def limited(*run: Any) -> Dict[str, Any]:
+        async with limit:
+            return await run_once(llm, analyzer, *run)
+
+    try:
+        rows = await asyncio.gather(*(
+            limited(scenario, version, koi, fox, strategy, repeat)
+            for scenario in scenarios
+            for version in args.versions.split(",")
+            for koi, fox in _persona_pairs(args.personas)
+            for strategy in args.strategies.split(",")
+            for repeat in range(args.repeats)
+        ))
+    finally:
+        await pool.close()
+
+    rows = sorted(rows, key=lambda r: (r["scenario"], r["version"], r["koi"], r["fox"], r["strategy"], r["repeat"]))
+    return {
+        "provider": getattr(llm, "name", ""),
+        "model": getattr(llm, "model", ""),
+        "scenarios": [s.name for s in scenarios],
+        "summary": _rounded(summarize(rows)),
+        "runs": _rounded(rows),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("scenarios", help="scenario file or directory of *.txt scenarios")
+    ap.add_argument("--versions", default="v1,v2")
+    ap.add_argument("--personas", default="", help="koi:fox pairs, comma-separated (default: every pair)")
+    ap.add_argument("--strategies", default="centralised")
+    ap.add_argument("--repeats", type=int, default=1)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--out", default="", help="write the JSON report here")
+    args = ap.parse_args()
+
+    report = asyncio.run(evaluate(args))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+    print(f"provider={report['provider']} model={report['model']} scenarios={','.join(report['scenarios'])}")
+    print(_table(report["summary"]))
+
+
+if __name__ == "__main__":
+    main()
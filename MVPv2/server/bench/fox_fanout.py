@@ -0,0 +1,73 @@
+"""
+Fox single-call versus fan-out (fox_mode=fanout) against the local stub with
+per-token decoding latency: time to the first reply option and to the full
+Fox result on /v2/analyze/stream, whole-response time on /v2/analyze, and
+tokens per analysis (as counted by the stub).
+
+    python -m bench.fox_fanout --runs 10 --latency-ms 300 --ms-per-token 15
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.common import SAMPLE_REQUEST_V2, app_env, pct, serve, wait_ready
+
+
+async def _stream(client: httpx.AsyncClient, body: Dict) -> Dict[str, float]:
+    marks: Dict[str, float] = {}
+    start = time.perf_counter()
+    async with client.stream("POST", "/v2/analyze/stream", json=body) as r:
+        async for line in r.aiter_lines():
+            if line.startswith("event: "):
+                marks.setdefault(line[7:], (time.perf_counter() - start) * 1000.0)
+    return marks
+
+
+async def _full(client: httpx.AsyncClient, body: Dict) -> float:
+    start = time.perf_counter()
+    r = await client.post("/v2/analyze", json=body)
+    r.raise_for_status()
+    return (time.perf_counter() - start) * 1000.0
+
+
+async def _mode(client: httpx.AsyncClient, stub: httpx.AsyncClient, mode: str, runs: int) -> Dict[str, float]:
+    body = {**SAMPLE_REQUEST_V2, "fox_mode": mode, "no_cache": True}
+    await stub.post("/stats/reset")
+    full: List[float] = [await _full(client, body) for _ in range(runs)]
+    counts = (await stub.get("/stats")).json()
+    streamed = [await _stream(client, body) for _ in range(runs)]
+    return {
+        "first_option_p50_ms": round(pct([m.get("reply_option", 0.0) for m in streamed], 0.5), 1),
+        "fox_done_p50_ms": round(pct([m.get("fox", 0.0) for m in streamed], 0.5), 1),
+        "full_response_p50_ms": round(pct(full, 0.5), 1),
+        "llm_calls_per_analysis": counts["requests"] / runs,
+        "prompt_tokens_per_analysis": counts["prompt_tokens"] / runs,
+        "completion_tokens_per_analysis": counts["completion_tokens"] / runs,
+    }
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--latency-ms", type=int, default=300)
+    ap.add_argument("--ms-per-token", type=float, default=15.0)
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=9000)
+    args = ap.parse_args()
+
+    stub_env = {"STUB_LATENCY_MS": str(args.latency_ms), "STUB_MS_PER_TOKEN": str(args.ms_per_token)}
+    with serve("bench.stub_openai:app", args.stub_port, stub_env) as stub_base:
+        with serve("app.main:app", args.app_port, app_env(stub_base, LLM_WARMUP="0")) as base:
+            await wait_ready(f"{base}/personas")
+            async with httpx.AsyncClient(base_url=base, timeout=120.0) as client, \
+                    httpx.AsyncClient(base_url=stub_base) as stub:
+                results = {mode: await _mode(client, stub, mode, args.runs) for mode in ("single", "fanout")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Fused (one call, strategy=solo) versus split (two calls, centralised / relay)
+Koi+Fox analysis against the local stub: upstream calls and tokens per request,
+latency, and how often the answer was valid as returned.
+
+    python -m bench.fused_vs_split --runs 30 --latency-ms 300 --ms-per-token 2 --malformed-rate 0.05
+
+--api v1 runs the same against /analyze (KoiOutput); --strict-fields makes the
+stub answer Koi with only the fields its prompt asks for, like a real model, so
+a prompt asking for the wrong schema shows up as fallbacks and coercions.
+
+"valid" counts responses whose module outputs passed validation without
+coercion and without a fused fallback call.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.common import SAMPLE_REQUEST_V2, app_env, pct, serve, wait_ready
+
+STRATEGIES = ("centralised", "relay", "solo")
+
+
+def _metric_total(text: str, name: str, **labels: str) -> float:
+    total = 0.0
+    for line in text.splitlines():
+        if not line.startswith(name + "{") and not line.startswith(name + " "):
+            continue
+        if all(f'{k}="{v}"' in line for k, v in labels.items()):
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+async def _counters(client: httpx.AsyncClient) -> Dict[str, float]:
+    text = (await client.get("/metrics")).text
+    return {
+        "coerced": _metric_total(text, "foxkoi_validations_total", outcome="coerced"),
+        "fallbacks": _metric_total(text, "foxkoi_fused_fallbacks_total"),
+    }
+
+
+async def _run(
+    client: httpx.AsyncClient, stub: httpx.AsyncClient, strategy: str, runs: int, api: str
+) -> Dict[str, float]:
+    await stub.post("/stats/reset")
+    before = await _counters(client)
+    latencies: List[float] = []
+    ok = 0
+    path = "/v2/analyze" if api == "v2" else "/analyze"
+    for i in range(runs):
+        body = dict(SAMPLE_REQUEST_V2, strategy=strategy, session_id=f"fused-{strategy}-{i}")
+        if api == "v1":
+            body.pop("goal_spec", None)
+        start = time.perf_counter()
+        r = await client.post(path, json=body)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        ok += r.status_code == 200
+    after = await _counters(client)
+    upstream = (await stub.get("/stats")).json()
+
+    repaired = (after["coerced"] - before["coerced"]) + (after["fallbacks"] - before["fallbacks"])
+    return {
+        "strategy": strategy,
+        "ok": ok,
+        "valid_rate": round(max(ok - repaired, 0) / runs, 3),
+        "fused_fallbacks": after["fallbacks"] - before["fallbacks"],
+        "upstream_calls_per_request": round(upstream["requests"] / runs, 2),
+        "prompt_tokens_per_request": round(upstream["prompt_tokens"] / runs, 1),
+        "completion_tokens_per_request": round(upstream["completion_tokens"] / runs, 1),
+        "latency_p50_ms": round(pct(latencies, 0.5), 1),
+        "latency_p95_ms": round(pct(latencies, 0.95), 1),
+    }
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=30)
+    ap.add_argument("--latency-ms", type=float, default=300)
+    ap.add_argument("--ms-per-token", type=float, default=2.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--api", choices=("v1", "v2"), default="v2")
+    ap.add_argument("--strict-fields", action="store_true", help="stub answers only the Koi fields asked for")
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=9000)
+    args = ap.parse_args()
+
+    stub_env = {
+        "STUB_LATENCY_MS": str(args.latency_ms),
+        "STUB_MS_PER_TOKEN": str(args.ms_per_token),
+        "STUB_MALFORMED_RATE": str(args.malformed_rate),
+        "STUB_SEED": str(args.seed),
+        "STUB_STRICT_FIELDS": "1" if args.strict_fields else "0",
+    }
+    with serve("bench.stub_openai:app", args.stub_port, stub_env) as stub_base:
+        await wait_ready(f"{stub_base}/stats")
+        with serve("app.main:app", args.app_port, app_env(stub_base)) as base:
+            await wait_ready(f"{base}/personas")
+            async with httpx.AsyncClient(base_url=base, timeout=60.0) as client, \
+                    httpx.AsyncClient(base_url=stub_base) as stub:
+                results = [await _run(client, stub, s, args.runs, args.api) for s in STRATEGIES]
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""
+Load-testing suite. Starts the OpenAI stub and the app (OpenAIProvider pointed
+at the stub), then drives each endpoint at each concurrency level and writes a
+machine-readable result file:
+
+    python -m bench.load --concurrency 1,8,32 --requests 200 \
+        --latency-ms 300 --latency-dist lognormal --error-rate 0.01 \
+        --out bench-results.json
+
+Compare two result files with `python -m bench.compare old.json new.json`.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import httpx
+
+from bench.common import SAMPLE_REQUEST_V2, app_env, pct, serve, wait_ready
+
+ENDPOINTS = ("personas", "analyze", "v2_analyze")
+
+
+def _request(endpoint: str, i: int) -> Dict[str, Any]:
+    """
+    Method, path and body for request number i. Drafts differ per request so
+    identical-request optimisations (cache, coalescing) do not flatter the numbers.
+    """
+    if endpoint == "personas":
+        return {"method": "GET", "url": "/personas"}
+    body = dict(SAMPLE_REQUEST_V2, session_id=f"load-{i}", user_draft=f"{SAMPLE_REQUEST_V2['user_draft']} (#{i})")
+    if endpoint == "analyze":
+        body.pop("goal_spec")
+        return {"method": "POST", "url": "/analyze", "json": body}
+    return {"method": "POST", "url": "/v2/analyze", "json": body}
+
+
+async def _level(client: httpx.AsyncClient, endpoint: str, concurrency: int, total: int) -> Dict[str, Any]:
+    await client.post("/__bench/loop_lag")
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                r = await client.request(**_request(endpoint, i))
+                statuses[str(r.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    lag = (await client.get("/__bench/loop_lag")).json()
+
+    ok = statuses.get("200", 0)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "error_rate": round(1 - ok / total, 4) if total else 0.0,
+        "statuses": dict(statuses),
+        "throughput_rps": round(total / wall, 2),
+        "latency_ms": {
+            "p50": round(pct(latencies, 0.50), 2),
+            "p95": round(pct(latencies, 0.95), 2),
+            "p99": round(pct(latencies, 0.99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        },
+        "loop_lag_ms": {"p50": lag["p50_ms"], "p99": lag["p99_ms"], "max": lag["max_ms"]},
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint and level")
+    ap.add_argument("--latency-ms", type=float, default=300)
+    ap.add_argument("--latency-dist", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    ap.add_argument("--latency-sigma", type=float, default=0.5)
+    ap.add_argument("--spike-rate", type=float, default=0.0)
+    ap.add_argument("--spike-ms", type=float, default=5000)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=9000)
+    ap.add_argument("--app-env", action="append", default=[], help="extra KEY=VALUE for the app")
+    ap.add_argument("--out", default="bench-results.json")
+    args = ap.parse_args()
+
+    stub_config = {
+        "latency_ms": args.latency_ms,
+        "latency_dist": args.latency_dist,
+        "latency_sigma": args.latency_sigma,
+        "spike_rate": args.spike_rate,
+        "spike_ms": args.spike_ms,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+    }
+    extra_env = dict(kv.split("=", 1) for kv in args.app_env)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    results = []
+
+    with serve("bench.stub_openai:app", args.stub_port, {"STUB_SEED": str(args.seed)}) as stub:
+        await wait_ready(f"{stub}/stats")
+        async with httpx.AsyncClient() as c:
+            (await c.post(f"{stub}/stub/config", json=stub_config)).raise_for_status()
+
+        with serve("bench.app_runner:app", args.app_port, app_env(stub, **extra_env)) as base:
+            await wait_ready(f"{base}/personas")
+            limits = httpx.Limits(max_connections=max(levels) + 4)
+            async with httpx.AsyncClient(base_url=base, timeout=120.0, limits=limits) as client:
+                for endpoint in args.endpoints.split(","):
+                    for concurrency in levels:
+                        result = await _level(client, endpoint, concurrency, args.requests)
+                        results.append(result)
+                        print(
+                            f"{endpoint:<12} c={concurrency:<4} {result['throughput_rps']:>8} rps  "
+                            f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms  "
+                            f"lag_p99={result['loop_lag_ms']['p99']}ms  errors={result['error_rate']}"
+                        )
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "stub": stub_config,
+        "app_env": extra_env,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+Throughput of the persona-training pipeline on synthetic chat exports, in MB/s,
+with one worker and with a process pool, plus peak memory (bounded regardless of size).
+
+    python -m bench.persona_training --mb 200 --files 8 --workers 1,4
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app.personas.training import accumulate
+
+_WORDS = (
+    "maybe we could try friday i think the price is too high need to close this deal now "
+    "clearly that works for me what about the budget let's do it not sure kind of always "
+    "thanks for the update please send the report by tomorrow sounds good"
+).split()
+
+
+def _write_export(path: str, target_bytes: int, seed: int) -> None:
+    rng = random.Random(seed)
+    when = datetime(2024, 1, 1, 9, 0)
+    speakers = ("Me", "Boss", "Client")
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target_bytes:
+            when += timedelta(seconds=rng.randint(5, 3600))
+            text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 30)))
+            if rng.random() < 0.3:
+                text += "?"
+            line = f"[{when:%Y-%m-%d %H:%M:%S}] {rng.choice(speakers)}: {text}\n"
+            f.write(line)
+            written += len(line)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=200, help="total export size")
+    ap.add_argument("--files", type=int, default=8)
+    ap.add_argument("--workers", default="1,4")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"export_{i}.txt") for i in range(args.files)]
+        for i, path in enumerate(paths):
+            _write_export(path, int(args.mb * 1e6 / args.files), seed=i)
+        total_mb = sum(os.path.getsize(p) for p in paths) / 1e6
+
+        results = []
+        for workers in (int(w) for w in args.workers.split(",")):
+            start = time.perf_counter()
+            acc = accumulate(paths, workers=workers)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "workers": workers,
+                "mb": round(total_mb, 1),
+                "seconds": round(elapsed, 2),
+                "mb_per_s": round(total_mb / elapsed, 1),
+                "messages": int(acc.sums[:, 0].sum()),
+            })
+
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({
+        "cpus": os.cpu_count(),
+        "results": results,
+        "peak_rss_mb": round(peak / 1024, 1),
+        "peak_worker_rss_mb": round(peak_children / 1024, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
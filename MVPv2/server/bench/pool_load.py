@@ -0,0 +1,92 @@
+"""
+Compares a fresh OpenAIProvider per request (the old _get_llm behaviour) with
+one shared, bounded provider from ProviderPool, against the local stub.
+
+    python -m bench.pool_load --requests 400 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+import httpx
+
+from app.llm.pool import BoundedProvider
+from app.llm.openai_provider import OpenAIProvider
+from app.personas.registry import get_persona
+from bench.common import pct, serve, wait_ready
+
+
+async def _stub_stats(base: str, reset: bool = False) -> dict:
+    async with httpx.AsyncClient() as c:
+        if reset:
+            await c.post(f"{base}/stats/reset")
+            return {}
+        return (await c.get(f"{base}/stats")).json()
+
+
+async def _run(mode: str, base: str, n: int, concurrency: int, max_connections: int) -> dict:
+    persona = get_persona("fox_workplace_leader")
+    shared = None
+    if mode == "pooled":
+        shared = BoundedProvider(
+            OpenAIProvider(api_key="stub", model="stub-model", base_url=f"{base}/v1", max_connections=max_connections),
+            max_connections,
+        )
+        await shared.warmup()
+
+    await _stub_stats(base, reset=True)
+    gate = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one() -> None:
+        async with gate:
+            start = time.perf_counter()
+            if shared is not None:
+                await shared.generate_json(persona.system_prompt, "hello")
+            else:
+                llm = OpenAIProvider(api_key="stub", model="stub-model", base_url=f"{base}/v1")
+                try:
+                    await llm.generate_json(persona.system_prompt, "hello")
+                finally:
+                    await llm.aclose()
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    wall = time.perf_counter() - start
+    if shared is not None:
+        await shared.aclose()
+
+    stats = await _stub_stats(base)
+    return {
+        "mode": mode,
+        "requests": n,
+        "throughput_rps": round(n / wall, 1),
+        "p50_ms": round(pct(latencies, 0.50), 1),
+        "p99_ms": round(pct(latencies, 0.99), 1),
+        "connections_opened": stats["connections"],
+    }
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--max-connections", type=int, default=20)
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=int, default=50)
+    args = ap.parse_args()
+
+    with serve("bench.stub_openai:app", args.port, {"STUB_LATENCY_MS": str(args.latency_ms)}) as base:
+        await wait_ready(f"{base}/stats")
+        results = [
+            await _run(mode, base, args.requests, args.concurrency, args.max_connections)
+            for mode in ("per_request", "pooled")
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
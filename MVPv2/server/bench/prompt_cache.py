@@ -0,0 +1,134 @@
+"""
+Prompt layouts (LLM_PROMPT_LAYOUT) against the stub's simulated prefix cache:
+the share of prompt tokens served from cache and request latency, for
+
+  session   one session growing by a turn per request (conversation_delta)
+  relay     the same with strategy=relay (Fox right after Koi)
+  fanout    the same with fox_mode=fanout (four Fox calls per request)
+  batch     /v2/analyze/batch: drafts x persona pairs on one conversation
+
+Token ratios are the stub's; app_cached_tokens is what the app read from the
+reported usage (foxkoi_llm_tokens_total{kind="cached"}).
+
+    python -m bench.prompt_cache --requests 12 --turns 60
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.common import SAMPLE_REQUEST_V2, app_env, pct, serve, wait_ready
+
+KOI_PERSONAS = ("koi_entrepreneur_driver", "koi_coach_clarifier")
+FOX_PERSONAS = ("fox_workplace_leader", "fox_empath_deescalator")
+
+
+def _turn(i: int) -> str:
+    speaker = "Opponent boss" if i % 2 == 0 else "Me"
+    return (
+        f"{speaker}: On point {i}, the delivery schedule and the volume commitments for the next "
+        f"quarter still need work; we discussed options {i}a and {i}b, the rebate and the payment terms."
+    )
+
+
+def _body(args: argparse.Namespace, step: int, **extra) -> Dict:
+    body = {**SAMPLE_REQUEST_V2, "no_cache": True, "user_draft": f"How about 90 with a rebate, take {step}?", **extra}
+    if step == 0:
+        body["conversation"] = "\n".join(_turn(i) for i in range(args.turns))
+    else:
+        body.pop("conversation")
+        body.pop("goal_spec")
+        body["conversation_delta"] = _turn(args.turns + step)
+    return body
+
+
+async def _session(client: httpx.AsyncClient, args: argparse.Namespace, name: str, **extra) -> List[float]:
+    latencies = []
+    for step in range(args.requests):
+        body = _body(args, step, session_id=f"cache-{name}", **extra)
+        start = time.perf_counter()
+        r = await client.post("/v2/analyze", json=body)
+        r.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+async def _batch(client: httpx.AsyncClient, args: argparse.Namespace) -> List[float]:
+    body = _body(args, 0)
+    body["items"] = [
+        {"user_draft": f"Draft {d}: could we settle at {90 - d}?", "koi_persona_id": koi, "fox_persona_id": fox}
+        for d in range(args.requests // 4 or 1)
+        for koi in KOI_PERSONAS
+        for fox in FOX_PERSONAS
+    ]
+    body["concurrency"] = args.batch_concurrency
+    start = time.perf_counter()
+    async with client.stream("POST", "/v2/analyze/batch", json=body) as r:
+        r.raise_for_status()
+        lines = [line async for line in r.aiter_lines() if line]
+    return [(time.perf_counter() - start) * 1000.0 / len(lines)] * len(lines)
+
+
+async def _app_cached_tokens(client: httpx.AsyncClient) -> int:
+    text = (await client.get("/metrics")).text
+    return sum(int(float(m)) for m in re.findall(r'^foxkoi_llm_tokens_total\{[^}]*kind="cached"[^}]*\} (\S+)', text, re.M))
+
+
+async def _layout(layout: str, args: argparse.Namespace, stub_base: str) -> Dict[str, Dict[str, float]]:
+    scenarios = {
+        "session": lambda c: _session(c, args, f"{layout}-session"),
+        "relay": lambda c: _session(c, args, f"{layout}-relay", strategy="relay"),
+        "fanout": lambda c: _session(c, args, f"{layout}-fanout", fox_mode="fanout"),
+        "batch": lambda c: _batch(c, args),
+    }
+    env = app_env(stub_base, LLM_WARMUP="0", LLM_PROMPT_LAYOUT=layout, CONTEXT_BUDGET_TOKENS="0")
+    out: Dict[str, Dict[str, float]] = {}
+    with serve("app.main:app", args.app_port, env) as base:
+        await wait_ready(f"{base}/personas")
+        async with httpx.AsyncClient(base_url=base, timeout=300.0) as client, \
+                httpx.AsyncClient(base_url=stub_base) as stub:
+            for name, run in scenarios.items():
+                await stub.post("/stats/reset")  # also empties the stub's cache
+                before = await _app_cached_tokens(client)
+                latencies = await run(client)
+                counts = (await stub.get("/stats")).json()
+                out[name] = {
+                    "llm_calls": counts["requests"],
+                    "prompt_tokens": counts["prompt_tokens"],
+                    "cached_ratio": round(counts["cached_tokens"] / max(counts["prompt_tokens"], 1), 3),
+                    "app_cached_tokens": await _app_cached_tokens(client) - before,
+                    "p50_ms": round(pct(latencies, 0.5), 1),
+                    "mean_ms": round(sum(latencies) / len(latencies), 1),
+                }
+    return out
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=12, help="requests per session; batch has requests//4 * 4 items")
+    ap.add_argument("--batch-concurrency", type=int, default=1)
+    ap.add_argument("--turns", type=int, default=60, help="conversation turns at the start of a session")
+    ap.add_argument("--latency-ms", type=int, default=300)
+    ap.add_argument("--ms-per-token", type=float, default=15.0)
+    ap.add_argument("--ms-per-prompt-token", type=float, default=0.2)
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=9000)
+    args = ap.parse_args()
+
+    stub_env = {
+        "STUB_LATENCY_MS": str(args.latency_ms),
+        "STUB_MS_PER_TOKEN": str(args.ms_per_token),
+        "STUB_MS_PER_PROMPT_TOKEN": str(args.ms_per_prompt_token),
+    }
+    with serve("bench.stub_openai:app", args.stub_port, stub_env) as stub_base:
+        await wait_ready(f"{stub_base}/stats")
+        results = {layout: await _layout(layout, args, stub_base) for layout in ("persona_first", "shared_prefix")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""
+CPU time per /v2/analyze response after the LLM calls: validating the module
+outputs, building the response and serializing it. Compares FastAPI's
+response_model path (validate again, dump to a dict, json.dumps) with the
+ModelResponse path (validated once, bytes from pydantic-core).
+
+    python -m bench.response_path --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from app.llm.provider import MockProvider
+from app.llm.repair import validate_output
+from app.main import app
+from app.responses import ModelResponse
+from app.schemas import AnalysisMeta, AnalyzeResponseV2, FoxOutput, KoiOutputV2
+
+
+def _build(koi_json, fox_json) -> AnalyzeResponseV2:
+    return AnalyzeResponseV2(
+        koi=validate_output(KoiOutputV2, koi_json, "koi", "bench"),
+        fox=validate_output(FoxOutput, fox_json, "fox", "bench"),
+        meta=AnalysisMeta(strategy="centralised", timings_ms={"koi": 812.4, "fox": 1033.9, "total": 1040.2}),
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=20000)
+    args = ap.parse_args()
+
+    field = next(r for r in app.routes if isinstance(r, APIRoute) and r.path == "/v2/analyze").response_field
+    koi_json, fox_json = MockProvider._koi(), MockProvider._fox()
+    koi_json["goal_alignment"] = 0.8
+
+    async def before() -> bytes:
+        content = await serialize_response(field=field, response_content=_build(koi_json, fox_json))
+        return JSONResponse(content).body
+
+    async def after() -> bytes:
+        return ModelResponse(_build(koi_json, fox_json)).body
+
+    async def measure(fn) -> float:
+        for _ in range(200):
+            await fn()
+        start = time.process_time()
+        for _ in range(args.iterations):
+            await fn()
+        return (time.process_time() - start) / args.iterations * 1e6
+
+    async def run() -> None:
+        assert json.loads(await before()) == json.loads(await after())
+        results = {"before_us": await measure(before), "after_us": await measure(after)}
+        results["speedup"] = results["before_us"] / results["after_us"]
+        print(json.dumps({k: round(v, 2) for k, v in results.items()}, indent=2))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Time to first useful content: /v2/analyze (whole response) versus
+/v2/analyze/stream (first koi / reply_option event), against the local stub.
+
+    python -m bench.stream_ttfb --runs 20 --latency-ms 800
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.common import SAMPLE_REQUEST_V2, app_env, pct, serve, wait_ready
+
+
+async def _full(client: httpx.AsyncClient) -> float:
+    start = time.perf_counter()
+    r = await client.post("/v2/analyze", json=SAMPLE_REQUEST_V2)
+    r.raise_for_status()
+    return (time.perf_counter() - start) * 1000.0
+
+
+async def _stream(client: httpx.AsyncClient) -> Dict[str, float]:
+    marks: Dict[str, float] = {}
+    start = time.perf_counter()
+    async with client.stream("POST", "/v2/analyze/stream", json=SAMPLE_REQUEST_V2) as r:
+        async for line in r.aiter_lines():
+            if line.startswith("event: "):
+                marks.setdefault(line[7:], (time.perf_counter() - start) * 1000.0)
+    return marks
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--latency-ms", type=int, default=800)
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=9000)
+    args = ap.parse_args()
+
+    with serve("bench.stub_openai:app", args.stub_port, {"STUB_LATENCY_MS": str(args.latency_ms)}) as stub:
+        with serve("app.main:app", args.app_port, app_env(stub)) as base:
+            await wait_ready(f"{base}/personas")
+            async with httpx.AsyncClient(base_url=base, timeout=60.0) as client:
+                full: List[float] = [await _full(client) for _ in range(args.runs)]
+                streamed = [await _stream(client) for _ in range(args.runs)]
+
+    first = [min(m.get("koi", 1e9), m.get("reply_option", 1e9)) for m in streamed]
+    result = {
+        "full_response_p50_ms": round(pct(full, 0.5), 1),
+        "stream_first_content_p50_ms": round(pct(first, 0.5), 1),
+        "stream_first_option_p50_ms": round(pct([m.get("reply_option", 0.0) for m in streamed], 0.5), 1),
+        "stream_done_p50_ms": round(pct([m.get("done", 0.0) for m in streamed], 0.5), 1),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Local OpenAI-compatible stub for load tests. Answers /v1/chat/completions with
+the MockProvider's Koi/Fox JSON after an artificial delay and counts the TCP
+connections clients open (one per distinct client address). With "stream": true
+the same JSON is sent as SSE chunks spread evenly over the delay.
+
+Prompt caching is simulated like OpenAI's: once a prompt has been answered,
+later prompts sharing at least its first STUB_CACHE_MIN_TOKENS tokens report
+the shared prefix (in 128-token steps) as usage.prompt_tokens_details.cached_tokens,
+and only uncached prompt tokens cost STUB_MS_PER_PROMPT_TOKEN.
+
+Behaviour is configured from the environment at start-up, or at runtime with
+POST /stub/config using the same names in lower case without the prefix:
+
+  STUB_LATENCY_MS      median latency (default 200)
+  STUB_LATENCY_DIST    fixed | uniform | lognormal (default fixed)
+  STUB_LATENCY_SIGMA   lognormal sigma / uniform +- fraction (default 0.5)
+  STUB_SPIKE_RATE      probability of a latency spike (default 0)
+  STUB_SPIKE_MS        extra latency of a spike (default 5000)
+  STUB_ERROR_RATE      probability of an HTTP 500 (default 0)
+  STUB_MALFORMED_RATE  probability of truncated, invalid JSON content (default 0)
+  STUB_MS_PER_TOKEN    extra latency per completion token, like real decoding (default 0)
+  STUB_MS_PER_PROMPT_TOKEN  extra latency per uncached prompt token, like prefill (default 0)
+  STUB_CACHE_MIN_TOKENS     shortest cacheable prefix; 0 disables the cache (default 1024)
+  STUB_STRICT_FIELDS   1: answer Koi with only the fields its prompt asks for, as a real
+                       model does (the mock sends goal_confidence and goal_alignment) (default 0)
+  STUB_SEED            RNG seed (default: random)
+
+    STUB_LATENCY_MS=200 uvicorn bench.stub_openai:app --port 9100
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.llm.provider import MockProvider
+
+app = FastAPI(title="OpenAI stub")
+
+_mock = MockProvider()
+_stats: Dict[str, Any] = {
+    "requests": 0, "connections": set(), "errors": 0, "malformed": 0,
+    "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+}
+# Digests of the cached prompt prefixes, oldest first
+_prefixes: "OrderedDict[bytes, None]" = OrderedDict()
+CACHE_BLOCK_TOKENS = 128
+CACHE_MAX_PREFIXES = 100_000
+
+
+def _env_config() -> Dict[str, Any]:
+    return {
+        "latency_ms": float(os.getenv("STUB_LATENCY_MS", "200")),
+        "latency_dist": os.getenv("STUB_LATENCY_DIST", "fixed"),
+        "latency_sigma": float(os.getenv("STUB_LATENCY_SIGMA", "0.5")),
+        "spike_rate": float(os.getenv("STUB_SPIKE_RATE", "0")),
+        "spike_ms": float(os.getenv("STUB_SPIKE_MS", "5000")),
+        "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),
+        "malformed_rate": float(os.getenv("STUB_MALFORMED_RATE", "0")),
+        "ms_per_token": float(os.getenv("STUB_MS_PER_TOKEN", "0")),
+        "ms_per_prompt_token": float(os.getenv("STUB_MS_PER_PROMPT_TOKEN", "0")),
+        "cache_min_tokens": int(os.getenv("STUB_CACHE_MIN_TOKENS", "1024")),
+        "strict_fields": os.getenv("STUB_STRICT_FIELDS", "0") == "1",
+    }
+
+
+_config = _env_config()
+_rng = random.Random(int(os.environ["STUB_SEED"]) if os.getenv("STUB_SEED") else None)
+
+
+def _latency_s() -> float:
+    median = _config["latency_ms"]
+    dist = _config["latency_dist"]
+    sigma = _config["latency_sigma"]
+    if dist == "lognormal":
+        ms = _rng.lognormvariate(0.0, sigma) * median
+    elif dist == "uniform":
+        ms = _rng.uniform(median * (1 - sigma), median * (1 + sigma))
+    else:
+        ms = median
+    if _rng.random() < _config["spike_rate"]:
+        ms += _config["spike_ms"]
+    return max(ms, 0.0) / 1000.0
+
+
+def _prefix_digests(messages: List[Dict[str, Any]]) -> List[bytes]:
+    # One digest per 128-token (~512 chars) step of the prompt, from the start
+    text = "".join(f"<{m.get('role')}>{m.get('content') or ''}" for m in messages)
+    step = CACHE_BLOCK_TOKENS * 4
+    h = hashlib.sha1()
+    digests = []
+    for i in range(0, len(text) - step + 1, step):
+        h.update(text[i:i + step].encode("utf-8"))
+        digests.append(h.copy().digest())
+    return digests
+
+
+def _cached_tokens(digests: List[bytes]) -> int:
+    first = _config["cache_min_tokens"] // CACHE_BLOCK_TOKENS
+    if not _config["cache_min_tokens"] or len(digests) < first:
+        return 0
+    blocks = 0
+    for i, digest in enumerate(digests):
+        if digest not in _prefixes:
+            break
+        blocks = i + 1
+    return blocks * CACHE_BLOCK_TOKENS if blocks >= first else 0
+
+
+def _remember(digests: List[bytes]) -> None:
+    if not _config["cache_min_tokens"] or len(digests) < _config["cache_min_tokens"] // CACHE_BLOCK_TOKENS:
+        return
+    for digest in digests:
+        _prefixes[digest] = None
+        _prefixes.move_to_end(digest)
+    while len(_prefixes) > CACHE_MAX_PREFIXES:
+        _prefixes.popitem(last=False)
+
+
+# The Koi field list of a Koi or fused prompt ("EXACT fields:" / "Fields:", then "goal, ...")
+_KOI_FIELDS = re.compile(r"(?:EXACT fields:|Fields:)\n(goal, [a-z_, ]+)\.")
+
+
+def _strict(data: Dict[str, Any], system_prompt: str) -> Dict[str, Any]:
+    m = _KOI_FIELDS.search(system_prompt)
+    if m is None:
+        return data
+    fields = m.group(1).split(", ")
+    if isinstance(data.get("koi"), dict):
+        return {**data, "koi": {k: data["koi"][k] for k in fields if k in data["koi"]}}
+    if "goal" in data:
+        return {k: data[k] for k in fields if k in data}
+    return data
+
+
+def _track(request: Request) -> None:
+    _stats["requests"] += 1
+    if request.client is not None:
+        _stats["connections"].add((request.client.host, request.client.port))
+
+
+@app.get("/v1/models")
+async def models(request: Request):
+    _track(request)
+    return {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    _track(request)
+    body = await request.json()
+    messages = body.get("messages", [])
+    system_prompt = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    user_payload = "\n".join(m["content"] for m in messages if m["role"] == "user")
+
+    latency_s = _latency_s()
+    if _rng.random() < _config["error_rate"]:
+        _stats["errors"] += 1
+        await asyncio.sleep(latency_s / 4)
+        return JSONResponse(
+            status_code=500,
+            content={"error": {"message": "stub: injected server error", "type": "server_error"}},
+        )
+
+    data = await _mock.generate_json(system_prompt, user_payload)
+    if _config["strict_fields"]:
+        data = _strict(data, system_prompt)
+    content = json.dumps(data)
+    if _rng.random() < _config["malformed_rate"]:
+        _stats["malformed"] += 1
+        content = content[: len(content) // 2]
+
+    prompt_tokens = (len(system_prompt) + len(user_payload)) // 4
+    completion_tokens = len(content) // 4
+    digests = _prefix_digests(messages)
+    cached_tokens = min(_cached_tokens(digests), prompt_tokens)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+    _stats["prompt_tokens"] += prompt_tokens
+    _stats["completion_tokens"] += completion_tokens
+    _stats["cached_tokens"] += cached_tokens
+    latency_s += completion_tokens * _config["ms_per_token"] / 1000.0
+    latency_s += (prompt_tokens - cached_tokens) * _config["ms_per_prompt_token"] / 1000.0
+
+    if body.get("stream"):
+        return StreamingResponse(_stream(body, content, latency_s, usage, digests), media_type="text/event-stream")
+
+    await asyncio.sleep(latency_s)
+    # Cached once answered: calls already in flight with the same prefix miss, as upstream
+    _remember(digests)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub-model"),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": usage,
+    }
+
+
+async def _stream(body: dict, content: str, latency_s: float, usage: Dict[str, Any], digests: List[bytes]):
+    pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+    base = {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "stub-model"),
+    }
+    for piece in pieces:
+        await asyncio.sleep(latency_s / len(pieces))
+        chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        yield f"data: {json.dumps(chunk)}\n\n"
+    _remember(digests)
+    yield f"data: {json.dumps(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))}\n\n"
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/stub/config")
+async def set_config(request: Request):
+    changes = await request.json()
+    unknown = sorted(set(changes) - set(_config))
+    if unknown:
+        return JSONResponse(status_code=400, content={"unknown": unknown})
+    _config.update(changes)
+    return _config
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "requests": _stats["requests"],
+        "connections": len(_stats["connections"]),
+        "errors": _stats["errors"],
+        "malformed": _stats["malformed"],
+        "prompt_tokens": _stats["prompt_tokens"],
+        "completion_tokens": _stats["completion_tokens"],
+        "cached_tokens": _stats["cached_tokens"],
+    }
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    _stats.update(
+        requests=0, connections=set(), errors=0, malformed=0, prompt_tokens=0, completion_tokens=0, cached_tokens=0
+    )
+    _prefixes.clear()
+    return {"ok": True}